@@ -9,18 +9,38 @@ import json
 import time
 import re
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timezone
 from flask import Flask, render_template, request, jsonify, send_file
 from flask_socketio import SocketIO, emit
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
+import io
 import threading
-from litellm import completion
+import asyncio
+import contextlib
+import shutil
+import sqlite3
+import hashlib
+import random
+import mmap
+import codecs
+import uuid
+import zipfile
+import gzip
+import xml.etree.ElementTree as ET
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from litellm import completion, acompletion
 import os
 from dotenv import load_dotenv
-from docx import Document
 from markdownify import markdownify as md
 
+try:
+    import brotli  # 可选依赖：安装后下载额外提供 br 压缩版本
+except ImportError:
+    brotli = None
+
 # 自动加载 .env 文件（如果存在）
 load_dotenv()
 
@@ -29,6 +49,11 @@ app = Flask(__name__)
 app.config['SECRET_KEY'] = 'master-translator-secret-2024'
 app.config['UPLOAD_FOLDER'] = Path('./uploads')
 app.config['OUTPUT_FOLDER'] = Path('./outputs')
+app.config['CACHE_FOLDER'] = Path('./cache')
+app.config['CHECKPOINT_FOLDER'] = app.config['OUTPUT_FOLDER'] / 'checkpoints'
+app.config['UPLOAD_OBJECTS_FOLDER'] = app.config['UPLOAD_FOLDER'] / 'objects'  # 按内容哈希保存的上传文件
+app.config['UPLOAD_MANIFEST_FOLDER'] = app.config['UPLOAD_FOLDER'] / 'manifests'  # 每个任务的上传清单（task_id.json)
+app.config['PLAN_CACHE_FOLDER'] = app.config['CACHE_FOLDER'] / 'plans'         # 按内容哈希缓存的分块计划
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB
 
 CORS(app)
@@ -37,6 +62,11 @@ socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
 # 确保目录存在
 app.config['UPLOAD_FOLDER'].mkdir(exist_ok=True)
 app.config['OUTPUT_FOLDER'].mkdir(exist_ok=True)
+app.config['CACHE_FOLDER'].mkdir(exist_ok=True)
+app.config['CHECKPOINT_FOLDER'].mkdir(exist_ok=True)
+app.config['UPLOAD_OBJECTS_FOLDER'].mkdir(exist_ok=True)
+app.config['UPLOAD_MANIFEST_FOLDER'].mkdir(exist_ok=True)
+app.config['PLAN_CACHE_FOLDER'].mkdir(exist_ok=True)
 
 # ============ 翻译配置 ============
 # 从环境变量读取 OpenRouter API Key，避免硬编码泄漏
@@ -49,6 +79,7 @@ MODEL_CONFIGS = {
     'deepseek-free': {
         'name': 'tngtech/deepseek-r1t-chimera:free',
         'max_tokens': 16000,
+        'context_window': 163840,
         'temperature': 0.3,
         'cost_per_1k': 0.0,
         'description': '免费模型，适合 Demo 和开发测试',
@@ -58,6 +89,7 @@ MODEL_CONFIGS = {
     'claude-sonnet-4': {
         'name': 'anthropic/claude-sonnet-4',
         'max_tokens': 100000,
+        'context_window': 200000,
         'temperature': 0.3,
         'cost_per_1k': 0.01,
         'description': '最高质量，适合生产环境',
@@ -67,6 +99,7 @@ MODEL_CONFIGS = {
     'gpt-4o': {
         'name': 'openai/gpt-4o',
         'max_tokens': 100000,
+        'context_window': 128000,
         'temperature': 0.3,
         'cost_per_1k': 0.0067,
         'description': '平衡性能和成本',
@@ -76,6 +109,7 @@ MODEL_CONFIGS = {
     'deepseek-v3': {
         'name': 'deepseek/deepseek-chat',
         'max_tokens': 64000,
+        'context_window': 64000,
         'temperature': 0.3,
         'cost_per_1k': 0.0013,
         'description': '高性价比，适合大规模生产',
@@ -84,6 +118,17 @@ MODEL_CONFIGS = {
     }
 }
 
+# 速率限制（进程内所有任务共享)：每分钟请求数 rpm、每分钟 token 数 tpm，None 表示不限
+# 'openrouter' 为整个提供商的总限额，每次调用同时占用提供商和模型两个额度
+RATE_LIMITS = {
+    'openrouter': {'rpm': 200, 'tpm': None},
+    'deepseek-free': {'rpm': 20, 'tpm': None},
+    'claude-sonnet-4': {'rpm': 50, 'tpm': 400000},
+    'gpt-4o': {'rpm': 500, 'tpm': 450000},
+    'deepseek-v3': {'rpm': 60, 'tpm': None}
+}
+RATE_LIMIT_DEFAULT_BACKOFF = 30  # 429 未给出 Retry-After 时暂停该额度的秒数
+
 # 当前使用的模型（修改这里切换模型)
 ACTIVE_MODEL = 'deepseek-free'  # 可选: deepseek-free, claude-sonnet-4, gpt-4o, deepseek-v3
 
@@ -94,6 +139,27 @@ MAX_TOKENS = current_config['max_tokens']
 TEMPERATURE = current_config['temperature']
 TIMEOUT = 3600
 
+# 模型回退链：当前模型熔断（持续出错或响应过慢)时按顺序改用后面的模型
+FALLBACK_MODELS = ['deepseek-v3', 'gpt-4o', 'claude-sonnet-4']
+MODEL_FALLBACK_CHAIN = [ACTIVE_MODEL] + [
+    key for key in FALLBACK_MODELS if key != ACTIVE_MODEL and key in MODEL_CONFIGS
+]
+
+# 熔断配置（每个模型独立统计最近 CIRCUIT_WINDOW 次调用)
+CIRCUIT_WINDOW = 20
+CIRCUIT_MIN_CALLS = 4            # 至少这么多次调用后才判断错误率
+CIRCUIT_ERROR_RATE = 0.5         # 失败（含慢调用)比例达到此值时熔断
+CIRCUIT_SLOW_SECONDS = 120       # 首个 token 超过此时间视为慢调用
+CIRCUIT_COOLDOWN = 60            # 熔断后多少秒放行一次探测请求
+
+# ============ 翻译引擎配置 ============
+# 'asyncio': 所有块的流式请求共享一个事件循环线程（acompletion)，单机可同时保持数百个流
+# 'threads': 每个在途块占用一个线程（同步 completion)
+TRANSLATION_ENGINE = 'asyncio'
+ASYNC_MAX_STREAMS = 256          # asyncio 引擎同时打开的流上限（所有任务共享)
+ASYNC_BLOCKING_WORKERS = 4       # asyncio 引擎执行阻塞操作（翻译记忆、术语扫描)的线程数
+STREAM_IDLE_TIMEOUT = 300        # 流式响应超过此秒数没有新内容视为超时（可重试)
+
 # ============ 分块配置 ============
 # 使用专门的 Demo 文件 (demo_files/) 进行演示
 # Ultra Quick Demo: 200 words (~20-30s, 3 chunks)
@@ -102,12 +168,117 @@ DEMO_MODE = True  # 已有专门 Demo 文件，使用生产配置
 
 if DEMO_MODE:
     CHUNK_TARGET_SIZE = 800          # Demo: 超小块，确保 Quick Demo 3章→3块（~20-30s）
+    CHAPTER_SPLIT_SIZE = 4000        # Demo: 章节不超过此大小时整章一块，Standard Demo 3章→3块
     CONTEXT_PARAGRAPHS = 1           # Demo: 减少上下文，加快速度
     OVERLAP_CHECK_CHARS = 100        # Demo: 减少重叠检查
+    MAX_CONCURRENT_CHUNKS = 3        # Demo: 3 块并行，Quick Demo 一轮完成
 else:
     CHUNK_TARGET_SIZE = 110000       # 生产: 大块，减少 API 调用
+    CHAPTER_SPLIT_SIZE = 110000      # 生产: 超过目标大小的章节即切分
     CONTEXT_PARAGRAPHS = 2           # 生产: 更多上下文，提高质量
     OVERLAP_CHECK_CHARS = 200        # 生产: 更多重叠检查
+    MAX_CONCURRENT_CHUNKS = 4        # 生产: 每个任务最多 4 块同时翻译
+
+# 单任务并发上限（/api/translate 可通过 concurrency 参数调整，但不超过此值）
+# asyncio 引擎中在途块不占线程，上限可以放宽
+MAX_CONCURRENCY_LIMIT = 32 if TRANSLATION_ENGINE == 'asyncio' else 8
+
+# ============ 翻译任务队列配置 ============
+TRANSLATION_WORKERS = 16 if TRANSLATION_ENGINE == 'asyncio' else 4  # 同时翻译的书籍数（每本书内部再按 max_concurrency 并发分块)
+TRANSLATION_QUEUE_LIMIT = 20     # 排队等待的任务上限，超出时 /api/translate 返回 429
+QUEUE_FULL_RETRY_AFTER = 60      # 队列已满时建议客户端的重试间隔（秒)
+
+# ============ 实时推送配置 ============
+EVENT_MAX_PER_SECOND = 4         # 每个任务每秒最多推送的 WebSocket 消息数（日志和进度合并推送)
+EVENT_BATCHER_IDLE_SECONDS = 5   # 推送线程空闲多久后退出（有新事件时自动重启)
+TASK_LOG_BUFFER_SIZE = 1000      # 每个任务保留的最近日志条数（环形缓冲，供断线重连补发)
+
+# ============ 失败重试配置 ============
+CHUNK_MAX_ATTEMPTS = 4           # 每块最多尝试次数（含首次)
+RETRY_BASE_DELAY = 2             # 首次重试等待秒数，之后指数增长（带随机抖动)
+RETRY_MAX_DELAY = 60
+RETRY_MIN_RECOVER_CHARS = 200    # 断流时已收到的译文达到此长度才续写，否则整块重译
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504, 520, 522, 524, 529}
+# 没有状态码的网络类异常（litellm / httpx / requests)
+RETRYABLE_ERROR_NAMES = {
+    'APIConnectionError', 'Timeout', 'APITimeoutError', 'RateLimitError',
+    'ServiceUnavailableError', 'InternalServerError', 'BadGatewayError',
+    'ReadTimeout', 'ConnectTimeout', 'ReadError', 'RemoteProtocolError',
+    'ChunkedEncodingError', 'IncompleteRead'
+}
+# 只针对当前模型的错误：模型不存在/下线、额度或价格限制、超出上下文窗口，改用回退链中的下一个模型
+MODEL_SPECIFIC_STATUS_CODES = {402, 404, 413}
+MODEL_SPECIFIC_ERROR_NAMES = {'ContextWindowExceededError', 'NotFoundError'}
+# 400 错误中表示超出该模型上下文窗口 / 输出上限的提示（其他 400 多为请求本身有误，换模型也不会成功)
+CONTEXT_LIMIT_ERROR_RE = re.compile(
+    r"maximum context length|context[ _](?:length|window)[ _]exceeded|prompt is too long"
+    r"|max_tokens\b.{0,40}?\b(?:too large|exceeds?|must be (?:less|at most|<=))",
+    re.IGNORECASE
+)
+
+# ============ Token 预算配置 ============
+# 译文 token 数 ≈ 原文 token 数 × 目标语言膨胀系数（非拉丁文字分词更碎，膨胀更明显)
+TARGET_TOKEN_RATIOS = {
+    'Chinese': 1.5, 'Traditional Chinese': 1.6, 'Japanese': 1.7, 'Korean': 1.8,
+    'French': 1.3, 'German': 1.35, 'Spanish': 1.3, 'Italian': 1.3, 'Portuguese': 1.3,
+    'Russian': 1.6, 'Polish': 1.5, 'Dutch': 1.3, 'Swedish': 1.3,
+    'Arabic': 1.9, 'Hebrew': 1.9, 'Hindi': 2.5, 'Urdu': 2.3, 'Persian': 2.0, 'Turkish': 1.6,
+    'Thai': 2.5, 'Vietnamese': 1.8, 'Indonesian': 1.4, 'Malay': 1.4
+}
+DEFAULT_TARGET_TOKEN_RATIO = 1.5
+OUTPUT_TOKEN_SAFETY = 0.8        # 只用 max_tokens 的 80%，为推理内容和格式波动留余量
+PROMPT_OVERHEAD_TOKENS = 3000    # 系统提示词、上下文、术语表的预留 token
+REQUEST_TOKEN_MARGIN = 1000      # 输入 token 为估算值，max_tokens 按上下文窗口收紧时再留的余量
+
+# ============ 翻译记忆配置 ============
+TRANSLATION_MEMORY_ENABLED = True
+TRANSLATION_MEMORY_PATH = app.config['CACHE_FOLDER'] / 'translation_memory.sqlite3'
+TRANSLATION_MEMORY_MAX_BYTES = 200 * 1024 * 1024  # 超出后按最近使用时间淘汰
+PROMPT_VERSION = 'v3'  # 修改翻译提示词时递增，使旧的翻译记忆失效
+
+# ============ 上传存储配置 ============
+UPLOAD_HASH_BLOCK_SIZE = 1024 * 1024  # 上传文件边写边哈希的块大小
+PLAN_CACHE_VERSION = 'v2'  # 修改分块算法时递增，使缓存的分块计划失效
+
+# ============ 原文缓冲配置 ============
+SOURCE_MMAP_THRESHOLD = 8 * 1024 * 1024  # 原文超过此字节数时用 mmap 映射，不读入内存
+SOURCE_INDEX_STEP = 64 * 1024            # mmap 原文每隔多少字符记录一次字节偏移
+
+# ============ 预览配置 ============
+PREVIEW_PAGE_CHARS = 50_000       # 预览接口每页默认返回的字符数
+PREVIEW_MAX_PAGE_CHARS = 500_000  # 单页字符数上限
+PREVIEW_CACHE_SIZE = 16           # 缓存已打开的预览文件数（按修改时间和大小校验)
+
+# ============ 下载配置 ============
+DOWNLOAD_GZIP_LEVEL = 9        # 翻译完成时预压缩结果文件，压缩一次、下载多次
+DOWNLOAD_BROTLI_QUALITY = 11   # 仅在安装了 brotli 时使用
+DOWNLOAD_ENCODINGS = ('br', 'gzip')  # 同等 q 值时的优先顺序
+
+# ============ 术语配置 ============
+TERM_MATCHER_CACHE_SIZE = 8  # 缓存的术语自动机个数（每个术语表版本一个)
+TERM_PROMPT_TOKEN_BUDGET = 300  # 每块提示词中术语表的 token 上限（只放本块出现的术语)
+GLOSSARY_MIN_SUPPORT = 2        # 译名需在至少几个块的术语标注中出现才算确认（写入后续提示词)
+GLOSSARY_MAX_RENDERING_CHARS = 12  # 从 CJK 译文中学习的译名最长字符数
+GLOSSARY_MAX_RENDERING_WORDS = 4   # 从空格分词的译文中学习的译名最多词数
+# 空格分词的译文中，译名开头不应包含的冠词、介词、代词（统计前去掉，如 "le"、"l'"、"nous")
+GLOSSARY_LEADING_WORDS = {
+    # 法语
+    'le', 'la', 'les', 'un', 'une', 'des', 'du', 'de', 'au', 'aux', 'ce', 'cette', 'ces', 'son', 'sa', 'ses',
+    'leur', 'leurs', 'notre', 'nos', 'votre', 'vos', 'et', 'ou', 'en', 'à', 'je', 'il', 'elle', 'on', 'nous', 'vous',
+    # 西班牙语 / 意大利语 / 葡萄牙语
+    'el', 'los', 'las', 'una', 'del', 'al', 'su', 'sus', 'y', 'o', 'con', 'por', 'para',
+    'lo', 'gli', 'di', 'della', 'e', 'um', 'uma', 'os', 'as', 'do', 'da', 'dos', 'das',
+    # 德语 / 荷兰语 / 英语
+    'der', 'die', 'den', 'dem', 'ein', 'eine', 'einen', 'einem', 'einer', 'und', 'wir',
+    'het', 'een', 'the', 'a', 'an', 'of', 'and',
+    # 关系代词（"vague qui vient" 的 "qui vient" 不是完整译名)
+    'qui', 'que', 'dont', 'che', 'cui', 'which', 'that', 'who',
+}
+
+# ============ 任务仓库配置 ============
+# 任务元数据、分块计划和结果保存在 SQLite（WAL)，多个服务进程共享同一文件
+TASK_STORE_PATH = app.config['OUTPUT_FOLDER'] / 'tasks.sqlite3'
+TASK_STORE_PROGRESS_INTERVAL = 2  # 翻译中进度写入仓库的最小间隔（秒)
 
 # 其他配置
 
@@ -150,32 +321,266 @@ LANGUAGES = {
 tasks = {}  # 存储所有翻译任务
 
 
+# ============ 实时事件批量推送 ============
+
+class TaskEventBatcher:
+    """单个任务的 WebSocket 事件批量推送器
+    
+    翻译线程只把日志和进度放进内存缓冲区，由后台线程合并后以 'task_events'
+    消息推送，每秒最多 max_per_second 条。同一 update_key 的进度日志
+    （update_last，每个分块一个 key)和进度更新只保留最新一条，Socket.IO 传输再慢也不会拖慢流式读取。
+    on_progress 在推送进度后于推送线程中调用（用于把进度写入任务仓库)。
+    """
+    def __init__(self, room, max_per_second=EVENT_MAX_PER_SECOND, on_progress=None):
+        self.room = room
+        self.on_progress = on_progress
+        self.interval = 1.0 / max_per_second
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._logs = []
+        self._progress = None
+        self._thread = None
+
+    def push_log(self, entry):
+        """缓存一条日志；可覆盖的进度日志与缓冲中同一 update_key 的进度日志合并"""
+        with self._lock:
+            if entry.get('update_last'):
+                key = entry.get('update_key')
+                for i in range(len(self._logs) - 1, -1, -1):
+                    buffered = self._logs[i]
+                    if buffered.get('update_last') and buffered.get('update_key') == key:
+                        self._logs[i] = entry
+                        break
+                else:
+                    self._logs.append(entry)
+            else:
+                self._logs.append(entry)
+            self._ensure_thread()
+        self._wakeup.set()
+
+    def push_progress(self, progress):
+        """缓存最新进度（覆盖尚未推送的旧进度)"""
+        with self._lock:
+            self._progress = progress
+            self._ensure_thread()
+        self._wakeup.set()
+
+    def flush(self):
+        """立即推送缓冲区中的事件，返回是否推送了消息"""
+        with self._lock:
+            logs, progress = self._logs, self._progress
+            self._logs, self._progress = [], None
+        if not logs and progress is None:
+            return False
+        socketio.emit('task_events', {'logs': logs, 'progress': progress}, room=self.room)
+        if progress is not None and self.on_progress is not None:
+            self.on_progress()
+        return True
+
+    def _ensure_thread(self):
+        """（持有锁时调用)推送线程未运行则启动"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            if not self._wakeup.wait(timeout=EVENT_BATCHER_IDLE_SECONDS):
+                with self._lock:
+                    if not self._logs and self._progress is None:
+                        self._thread = None  # 空闲退出，下次 push 时重新启动
+                        return
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"⚠️  Event push failed for {self.room}: {e}")
+            time.sleep(self.interval)  # 两次推送之间至少间隔 interval
+
+
+# ============ 原文缓冲 ============
+
+class SourceBuffer:
+    """任务原文的共享只读缓冲
+    
+    分块只保存字符偏移，内容在发送或预览时才从这里切片生成。大文件用 mmap 映射
+    （不常驻内存)，并记录稀疏的字符偏移 → 字节偏移索引，切片时只解码附近的字节。
+    """
+    
+    def __init__(self, text=None, mapped=None, length=0, byte_index=None):
+        self._text = text
+        self._mapped = mapped
+        self._length = len(text) if text is not None else length
+        self._byte_index = byte_index  # 每 SOURCE_INDEX_STEP 个字符的字节偏移；纯 ASCII 时为 None
+    
+    @classmethod
+    def from_text(cls, text):
+        return cls(text=text)
+    
+    @classmethod
+    def open(cls, path, text=None):
+        """打开原文文件：超过 SOURCE_MMAP_THRESHOLD 时 mmap 映射，否则读入内存（已读取的 text 直接复用)"""
+        path = Path(path)
+        if path.stat().st_size >= SOURCE_MMAP_THRESHOLD:
+            buffer = cls._map(path)
+            if buffer is not None:
+                return buffer
+        if text is None:
+            with open(path, 'r', encoding='utf-8') as f:
+                text = f.read()
+        return cls.from_text(text)
+    
+    @classmethod
+    def _map(cls, path):
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if mapped.find(b'\r') != -1:
+            # 文本模式读取会转换 \r\n，字符偏移与文件不再对应，改为读入内存
+            mapped.close()
+            return None
+        
+        # 单次扫描建立字符偏移 → 字节偏移索引（按块增量解码，内存占用固定)
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        byte_index = [0]
+        byte_pos = 0
+        pending = ''
+        block_size = 1024 * 1024
+        for block_start in range(0, len(mapped), block_size):
+            block = mapped[block_start:block_start + block_size]
+            pending += decoder.decode(block, final=block_start + block_size >= len(mapped))
+            while len(pending) >= SOURCE_INDEX_STEP:
+                byte_pos += len(pending[:SOURCE_INDEX_STEP].encode('utf-8'))
+                byte_index.append(byte_pos)
+                pending = pending[SOURCE_INDEX_STEP:]
+        length = (len(byte_index) - 1) * SOURCE_INDEX_STEP + len(pending)
+        if length == len(mapped):
+            byte_index = None  # 纯 ASCII：字符偏移就是字节偏移
+        return cls(mapped=mapped, length=length, byte_index=byte_index)
+    
+    @property
+    def mapped(self):
+        return self._mapped is not None
+    
+    def __len__(self):
+        return self._length
+    
+    def __getitem__(self, key):
+        if not isinstance(key, slice) or key.step not in (None, 1):
+            raise TypeError("SourceBuffer only supports contiguous slices")
+        start, end, _ = key.indices(self._length)
+        return self.slice(start, end)
+    
+    def slice(self, start, end):
+        """原文 [start, end) 的字符"""
+        if self._text is not None:
+            return self._text[start:end]
+        start, end = max(0, start), min(end, self._length)
+        if start >= end:
+            return ''
+        if self._byte_index is None:
+            return self._mapped[start:end].decode('utf-8')
+        step = SOURCE_INDEX_STEP
+        first = start // step
+        last = -(-end // step)
+        byte_start = self._byte_index[first]
+        byte_end = self._byte_index[last] if last < len(self._byte_index) else len(self._mapped)
+        text = self._mapped[byte_start:byte_end].decode('utf-8')
+        offset = start - first * step
+        return text[offset:offset + end - start]
+    
+    def text(self):
+        """完整原文（临时生成，用于建立索引或整篇预览)"""
+        return self.slice(0, self._length)
+
+
+def chunk_text(source, chunk):
+    """块的原文：按 spans 从原文切片，多段之间空一行（前言 / 尾声与首末章合并时)
+    
+    source 可以是字符串或 SourceBuffer。兼容旧版计划中直接保存的 content。
+    """
+    if 'spans' in chunk:
+        return "\n\n".join(source[start:end] for start, end in chunk['spans'])
+    if chunk.get('content') is not None:
+        return chunk['content']
+    return source[chunk['start_pos']:chunk['end_pos']]
+
+
+def stripped_span(content, start, end):
+    """content[start:end].strip() 对应的偏移范围"""
+    while start < end and content[start].isspace():
+        start += 1
+    while end > start and content[end - 1].isspace():
+        end -= 1
+    return start, end
+
+
 class TranslationTask:
     """翻译任务类"""
     def __init__(self, task_id, filename, language):
         self.task_id = task_id
         self.filename = filename
         self.language = language
-        self.status = 'pending'  # pending, analyzing, translating, completed, failed
+        self.status = 'pending'  # pending, analyzing, analyzed, queued, translating, completed, failed
         self.progress = 0
         self.current_chunk = 0
         self.total_chunks = 0
         self.chunks_info = []
-        self.logs = []
-        self.source_content = ""
+        self.logs = deque(maxlen=TASK_LOG_BUFFER_SIZE)  # 最近日志（带递增 seq)
+        self.log_seq = 0
+        self._log_lock = threading.Lock()
+        self.source = SourceBuffer.from_text("")  # 原文（块只保存偏移，按需切片)
+        self.md_index = None  # index_markdown() 结果：标题、代码块位置
+        self.source_path = None  # 源文件路径（断点续传时重新读取)
+        self.resume_checkpoints = {}  # chunk_id -> 检查点（/api/resume 恢复的已完成块)
         self.result_file = None
         self.start_time = None
         self.end_time = None
+        self.queued_at = None   # 进入翻译队列的时间（time.time())
+        self.queue_wait = None  # 排队等待秒数（开始翻译后确定)
+        self.persisted_at = 0.0  # 最近一次写入任务仓库的时间（与仓库 updated_at 比较判断新旧)
+        self.plan_version = None  # 仓库中分块计划/源文件的写入时间（plan_updated_at)，变化时才需要重新加载
         self.error = None
         self.use_terminology = True  # 默认使用术语数据库
-        
-    def emit_log(self, message, level='info', update_last=False):
-        """发送日志到前端
+        self.glossary = None  # 双语术语表（开始翻译时建立，BilingualGlossary)
+        self.max_concurrency = MAX_CONCURRENT_CHUNKS  # 同时翻译的块数
+        self.chunk_progress = {}  # chunk_id -> 0~100，并发翻译时汇总整体进度
+        self.cancel_event = threading.Event()  # 任务失败时通知其他块停止
+        self._progress_lock = threading.Lock()
+        self._persist_lock = threading.Lock()
+        self.events = TaskEventBatcher(task_id, on_progress=self.persist_progress)  # 日志/进度批量推送
+        self.metrics = {  # LLM 调用统计（/api/status 返回)
+            'api_calls': 0, 'retries': 0, 'retryable_errors': 0,
+            'fatal_errors': 0, 'model_errors': 0, 'recovered_chars': 0, 'fallback_chunks': 0,
+            'rate_limited': 0, 'rate_limit_wait_seconds': 0
+        }
+        self._metrics_lock = threading.Lock()
+
+    @property
+    def source_content(self):
+        """完整原文（临时生成)"""
+        return self.source.text()
+    
+    @source_content.setter
+    def source_content(self, text):
+        self.source = SourceBuffer.from_text(text)
+    
+    def load_source(self, path, text=None):
+        """从文件加载原文并建立结构索引（大文件 mmap 映射)"""
+        self.source = SourceBuffer.open(path, text)
+        self.md_index = index_markdown(text if text is not None else self.source.text())
+    
+    def chunk_content(self, chunk):
+        """块的原文（发送或预览时才从原文缓冲切出)"""
+        return chunk_text(self.source, chunk)
+    
+    def emit_log(self, message, level='info', update_last=False, update_key=None):
+        """发送日志到前端（经 events 批量推送，不阻塞翻译线程)
         
         Args:
             message: 日志消息
             level: 日志级别 (info, success, error, warning, progress)
-            update_last: 是否更新最后一条日志（用于进度更新)
+            update_last: 是否覆盖同一 update_key 的上一条日志（用于进度更新)
+            update_key: 进度日志的合并键（如 'chunk-3')，并发分块各自保留一条
         """
         log_entry = {
             'timestamp': datetime.now().strftime('%H:%M:%S'),
@@ -183,404 +588,2703 @@ class TranslationTask:
             'level': level,
             'update_last': update_last
         }
-        self.logs.append(log_entry)
-        socketio.emit('log', log_entry, room=self.task_id)
+        if update_key is not None:
+            log_entry['update_key'] = update_key
+        with self._log_lock:
+            self.log_seq += 1
+            log_entry['seq'] = self.log_seq
+            self.logs.append(log_entry)
+            self.events.push_log(log_entry)  # 在锁内推送，保证推送顺序与 seq 一致
         
     def emit_progress(self, progress, chunk_progress=0):
-        """发送进度到前端"""
+        """发送进度到前端（只保留最新一次进度)；写入任务仓库由推送线程完成，不阻塞翻译"""
         self.progress = progress
-        socketio.emit('progress', {
-            'overall': progress,
+        self.events.push_progress(self.progress_snapshot(chunk_progress))
+
+    def persist_progress(self):
+        """（推送线程调用)距上次写入超过间隔时把进度写入任务仓库"""
+        with self._persist_lock:
+            now = time.time()
+            if now - self.persisted_at < TASK_STORE_PROGRESS_INTERVAL:
+                return
+            self.persisted_at = now  # 先占位，并发调用不会重复写入
+        persist_task(self, chunks=False)
+
+    def progress_snapshot(self, chunk_progress=0):
+        """当前进度（与 progress 事件格式相同)"""
+        return {
+            'overall': self.progress,
             'chunk': chunk_progress,
             'current_chunk': self.current_chunk,
             'total_chunks': self.total_chunks
-        }, room=self.task_id)
+        }
 
+    def record_chunk_model(self, chunk_id, model_name):
+        """记录实际翻译该块的模型（写入分块信息、检查点和输出注释)"""
+        for chunk in self.chunks_info:
+            if chunk['id'] == chunk_id:
+                chunk['model'] = model_name
+                break
 
-# ============ 翻译核心函数（改造自 script_v3_chunked.py)============
+    def record_metric(self, name, amount=1):
+        """累加统计计数（并发安全)"""
+        with self._metrics_lock:
+            self.metrics[name] = self.metrics.get(name, 0) + amount
 
-def convert_docx_to_markdown(docx_path):
-    """
-    将 Word 文档转换为 Markdown 格式
-    
-    Args:
-        docx_path: Word 文档路径
-        
-    Returns:
-        str: Markdown 格式的文本内容
-    """
-    try:
-        doc = Document(docx_path)
-        markdown_content = []
-        
-        for para in doc.paragraphs:
-            # 处理标题
-            if para.style.name.startswith('Heading'):
-                level = int(para.style.name.split()[-1]) if para.style.name.split()[-1].isdigit() else 1
-                markdown_content.append(f"{'#' * level} {para.text}\n")
-            # 处理普通段落
-            elif para.text.strip():
-                markdown_content.append(f"{para.text}\n")
-        
-        # 处理表格
-        for table in doc.tables:
-            markdown_content.append("\n")
-            for i, row in enumerate(table.rows):
-                cells = [cell.text.strip() for cell in row.cells]
-                markdown_content.append("| " + " | ".join(cells) + " |")
-                # 添加表头分隔符
-                if i == 0:
-                    markdown_content.append("| " + " | ".join(["---"] * len(cells)) + " |")
-            markdown_content.append("\n")
-        
-        result = "\n".join(markdown_content)
-        
-        # 清理多余的空行
-        result = re.sub(r'\n{3,}', '\n\n', result)
-        
-        return result.strip()
-        
-    except Exception as e:
-        raise Exception(f"DOCX conversion failed: {str(e)}")
+    def logs_since(self, last_seq=0):
+        """返回 seq 大于 last_seq 的日志（已被环形缓冲淘汰的无法补发)"""
+        with self._log_lock:
+            if not self.logs or self.logs[-1]['seq'] <= last_seq:
+                return []
+            # seq 连续递增，可直接按偏移切片
+            start = max(0, last_seq - self.logs[0]['seq'] + 1)
+            return [self.logs[i] for i in range(start, len(self.logs))]
 
+    def continue_logs_from(self, previous):
+        """沿用旧任务对象的日志和 seq（续传重建任务时，客户端游标保持有效)"""
+        with previous._log_lock:
+            self.logs = deque(previous.logs, maxlen=TASK_LOG_BUFFER_SIZE)
+            self.log_seq = previous.log_seq
 
-def extract_chapters(content):
-    """提取章节结构"""
-    pattern = r'^(#{1,2}) (.+)$'
-    chapters = []
-    lines = content.split('\n')
-    
-    for i, line in enumerate(lines):
-        match = re.match(pattern, line)
-        if match:
-            level = len(match.group(1))
-            title = match.group(2).strip()
-            start_pos = sum(len(l) + 1 for l in lines[:i])
-            chapters.append({
-                'line': i + 1,
-                'level': level,
-                'title': title,
-                'start_pos': start_pos
-            })
-    
-    total_len = len(content)
-    for i, ch in enumerate(chapters):
-        if i < len(chapters) - 1:
-            ch['chars'] = chapters[i+1]['start_pos'] - ch['start_pos']
-            ch['end_pos'] = chapters[i+1]['start_pos']
-        else:
-            ch['chars'] = total_len - ch['start_pos']
-            ch['end_pos'] = total_len
-    
-    return chapters
+    def update_chunk_progress(self, chunk_id, chunk_progress):
+        """更新单块进度，并按所有块的进度汇总整体进度（并发安全）"""
+        with self._progress_lock:
+            self.chunk_progress[chunk_id] = chunk_progress
+            self.current_chunk = chunk_id
+            total = max(1, self.total_chunks)
+            overall = int(sum(self.chunk_progress.values()) / total)
+        self.emit_progress(progress=min(100, overall), chunk_progress=chunk_progress)
 
 
-def plan_chunks(chapters, content):
-    """规划分Chunk - 支持任何 Markdown 文件结构"""
-    chunks = []
-    current_chunk_chapters = []
-    current_size = 0
-    
-    # 优先使用 level 2 标题，如果没有则使用 level 1
-    main_chapters = [c for c in chapters if c['level'] == 2]
-    if not main_chapters:
-        main_chapters = [c for c in chapters if c['level'] == 1]
+# ============ 翻译记忆（持久化缓存)============
+
+class TranslationMemory:
+    """基于 SQLite 的翻译记忆
     
-    # 如果仍然没有章节，按固定大小分块整个文档
-    if not main_chapters:
-        total_len = len(content)
-        num_chunks = max(1, (total_len + CHUNK_TARGET_SIZE - 1) // CHUNK_TARGET_SIZE)
-        for i in range(num_chunks):
-            start = i * CHUNK_TARGET_SIZE
-            end = min(start + CHUNK_TARGET_SIZE, total_len)
-            chunks.append({
-                'id': i + 1,
-                'chapters': [f'Segment {i+1}'],
-                'start_pos': start,
-                'end_pos': end,
-                'size': end - start,
-                'content': content[start:end]
-            })
-        return chunks
+    以 (提示词版本, 模型, 目标语言, 块原文) 的哈希为键缓存译文。
+    总大小超过 max_bytes 时按最近使用时间淘汰到 90%。
+    """
+    def __init__(self, db_path, max_bytes=TRANSLATION_MEMORY_MAX_BYTES):
+        self.db_path = Path(db_path)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False, timeout=30)
+        with self._lock, self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS translations (
+                    key TEXT PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    language TEXT NOT NULL,
+                    prompt_version TEXT NOT NULL,
+                    translation TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used REAL NOT NULL,
+                    hit_count INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            self._conn.execute('CREATE INDEX IF NOT EXISTS idx_translations_last_used ON translations(last_used)')
+            row = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM translations').fetchone()
+        self._total_bytes = row[0]
     
-    if main_chapters:
-        first_chapter_pos = main_chapters[0]['start_pos']
-        prologue_content = content[:first_chapter_pos].strip()
-        prologue_size = len(prologue_content)
-    else:
-        prologue_content = ""
-        prologue_size = 0
+    @staticmethod
+    def make_key(chunk_content, language, model, prompt_version=PROMPT_VERSION):
+        """计算缓存键（上下文和术语不参与，相同原文在任意位置都可复用)"""
+        digest = hashlib.sha256()
+        for part in (prompt_version, model, language, chunk_content):
+            digest.update(part.encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
     
-    if main_chapters:
-        last_chapter_pos = main_chapters[-1]['end_pos']
-        epilogue_content = content[last_chapter_pos:].strip()
-        epilogue_size = len(epilogue_content)
-    else:
-        epilogue_content = ""
-        epilogue_size = 0
+    def get(self, key):
+        """查询译文，未命中返回 None"""
+        found = self.lookup([key])
+        return found[1] if found else None
     
-    for chapter in main_chapters:
-        if current_size > 0 and current_size + chapter['chars'] > CHUNK_TARGET_SIZE:
-            chunk_start = current_chunk_chapters[0]['start_pos']
-            chunk_end = current_chunk_chapters[-1]['end_pos']
-            chunks.append({
-                'id': len(chunks) + 1,
-                'chapters': [c['title'] for c in current_chunk_chapters],
-                'start_pos': chunk_start,
-                'end_pos': chunk_end,
-                'size': current_size,
-                'content': content[chunk_start:chunk_end]
-            })
-            current_chunk_chapters = []
-            current_size = 0
+    def lookup(self, keys):
+        """一次查询多个候选键，返回按 keys 顺序第一个命中的 (key, 译文)，都未命中返回 None
         
-        current_chunk_chapters.append(chapter)
-        current_size += chapter['chars']
-    
-    if current_chunk_chapters:
-        chunk_start = current_chunk_chapters[0]['start_pos']
-        chunk_end = current_chunk_chapters[-1]['end_pos']
-        chunks.append({
-            'id': len(chunks) + 1,
-            'chapters': [c['title'] for c in current_chunk_chapters],
-            'start_pos': chunk_start,
-            'end_pos': chunk_end,
-            'size': current_size,
-            'content': content[chunk_start:chunk_end]
-        })
+        无论候选键有几个，一次查询只记一次命中或未命中。
+        """
+        keys = list(keys)
+        with self._lock, self._conn:
+            rows = dict(self._conn.execute(
+                f"SELECT key, translation FROM translations WHERE key IN ({','.join('?' * len(keys))})", keys
+            ).fetchall())
+            key = next((k for k in keys if k in rows), None)
+            if key is None:
+                self.misses += 1
+                return None
+            self._conn.execute(
+                'UPDATE translations SET last_used = ?, hit_count = hit_count + 1 WHERE key = ?',
+                (time.time(), key)
+            )
+            self.hits += 1
+            return key, rows[key]
     
-    if chunks and prologue_content:
-        chunks[0]['content'] = prologue_content + "\n\n" + chunks[0]['content']
-        chunks[0]['size'] += prologue_size + 2
-        chunks[0]['has_prologue'] = True
-        chunks[0]['prologue_size'] = prologue_size
+    def put(self, key, translation, model, language, prompt_version=PROMPT_VERSION):
+        """写入译文，必要时淘汰最久未使用的记录"""
+        size = len(translation.encode('utf-8')) + len(key)
+        now = time.time()
+        with self._lock, self._conn:
+            old = self._conn.execute('SELECT size FROM translations WHERE key = ?', (key,)).fetchone()
+            self._conn.execute(
+                """INSERT OR REPLACE INTO translations
+                   (key, model, language, prompt_version, translation, size, created_at, last_used, hit_count)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0)""",
+                (key, model, language, prompt_version, translation, size, now, now)
+            )
+            self._total_bytes += size - (old[0] if old else 0)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
     
-    if chunks and epilogue_content:
-        chunks[-1]['content'] = chunks[-1]['content'] + "\n\n" + epilogue_content
-        chunks[-1]['size'] += epilogue_size + 2
-        chunks[-1]['has_epilogue'] = True
-        chunks[-1]['epilogue_size'] = epilogue_size
+    def _evict(self):
+        """淘汰最久未使用的记录，直到总大小降到上限的 90%（调用方持有锁)"""
+        target = int(self.max_bytes * 0.9)
+        doomed = []
+        for key, size in self._conn.execute('SELECT key, size FROM translations ORDER BY last_used'):
+            if self._total_bytes <= target:
+                break
+            doomed.append((key,))
+            self._total_bytes -= size
+        self._conn.executemany('DELETE FROM translations WHERE key = ?', doomed)
+        self.evictions += len(doomed)
     
-    return chunks
+    def stats(self):
+        """命中统计"""
+        with self._lock:
+            entries = self._conn.execute('SELECT COUNT(*) FROM translations').fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            'entries': entries,
+            'bytes': self._total_bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+        }
 
 
-# ============ 模型管理函数 ============
+translation_memory = None
+if TRANSLATION_MEMORY_ENABLED:
+    try:
+        translation_memory = TranslationMemory(TRANSLATION_MEMORY_PATH)
+    except sqlite3.Error as e:
+        print(f"[WARN] 翻译记忆初始化失败，将不使用缓存: {e}")
 
-def get_model_info():
-    """获取当前模型配置信息"""
-    config = MODEL_CONFIGS[ACTIVE_MODEL]
-    return {
-        'active_model': ACTIVE_MODEL,
-        'model_name': config['name'],
-        'max_tokens': config['max_tokens'],
-        'temperature': config['temperature'],
-        'cost_per_1k': config['cost_per_1k'],
-        'description': config['description'],
-        'speed': config['speed'],
-        'quality': config['quality']
-    }
 
+# ============ 断点续传（分块检查点)============
 
-def list_available_models():
-    """列出所有可用模型"""
-    return {
-        key: {
-            'name': config['name'],
-            'description': config['description'],
-            'cost': f"${config['cost_per_1k']:.4f}/1K chars",
-            'speed': config['speed'],
-            'quality': config['quality']
-        }
-        for key, config in MODEL_CONFIGS.items()
-    }
+def write_text_atomic(path, text):
+    """原子写入文本文件（临时文件 + fsync + rename)"""
+    path = Path(path)
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
 
 
-def load_terminology_db():
-    """加载精选术语数据库"""
-    term_file = Path(__file__).parent / 'terminology_curated.json'
-    
-    if term_file.exists():
-        with open(term_file, 'r', encoding='utf-8') as f:
-            terminology = json.load(f)
-        
-        all_terms = []
-        for category, terms in terminology.items():
-            all_terms.extend(terms)
-        
-        return all_terms
-    return None
+def write_json_atomic(path, data):
+    """原子写入 JSON：先写临时文件并 fsync，再 rename 覆盖，崩溃时不会留下半截文件"""
+    path = Path(path)
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
 
 
-def extract_terminology_from_chunk(translation_text, source_text):
-    """从翻译块中提取新术语（动态提取)"""
-    import re
+class CheckpointStore:
+    """任务检查点存储
     
-    # 1. 提取专有名词（大写开头的词组)
-    proper_nouns = re.findall(r'\b[A-Z][A-Za-z]+(?:\s+[A-Z][A-Za-z]+){0,3}\b', source_text)
+    目录结构: {root}/{task_id}/task.json        任务元数据和分块计划
+                               chunk_0001.md    每个完成块的译文段文件
+                               chunk_0001.json  每个完成块的术语状态、上下文尾部
+                               glossary.json    双语术语表和译名一致性问题
+    """
+    def __init__(self, root):
+        self.root = Path(root)
     
-    # 过滤常见词
-    common_words = {
-        'The', 'This', 'That', 'These', 'Those', 'Chapter', 'Part', 'Section',
-        'And', 'But', 'For', 'With', 'When', 'Where', 'Which', 'What', 'How',
-        'Figure', 'Table', 'Some', 'Many', 'Most', 'All', 'Each', 'Every',
-        'First', 'Second', 'Third', 'Last', 'Next', 'Previous', 'Introduction',
-        'Conclusion', 'Summary', 'Overview', 'Today', 'Tomorrow', 'Yesterday'
-    }
-    proper_nouns = [t for t in set(proper_nouns) if t not in common_words and len(t) > 2]
+    def task_dir(self, task_id):
+        return self.root / secure_filename(task_id)
     
-    # 2. 检测技术术语（常见技术词汇在源文本中出现)
-    tech_keywords = [
-        'AI', 'ML', 'API', 'GPU', 'CPU', 'DNA', 'RNA', 'AGI',
-        'artificial intelligence', 'machine learning', 'deep learning',
-        'neural network', 'algorithm', 'model', 'dataset', 'training',
-        'inference', 'transformer', 'attention', 'backpropagation',
-        'reinforcement learning', 'supervised learning', 'unsupervised learning',
-        'natural language processing', 'computer vision', 'robotics',
-        'blockchain', 'cryptocurrency', 'quantum computing',
-        'biotechnology', 'synthetic biology', 'gene editing', 'CRISPR'
-    ]
+    def save_task(self, task):
+        """保存任务元数据和分块计划（开始翻译时调用)"""
+        task_dir = self.task_dir(task.task_id)
+        task_dir.mkdir(parents=True, exist_ok=True)
+        write_json_atomic(task_dir / 'task.json', {
+            'task_id': task.task_id,
+            'filename': task.filename,
+            'language': task.language,
+            'source_path': task.source_path,
+            'use_terminology': task.use_terminology,
+            'max_concurrency': task.max_concurrency,
+            'total_chunks': task.total_chunks,
+            'chunks': task.chunks_info,
+            'saved_at': datetime.now().isoformat()
+        })
     
-    found_tech = [term for term in tech_keywords if term.lower() in source_text.lower()]
+    def segment_path(self, task_id, chunk_id):
+        """单块译文段文件路径"""
+        return self.task_dir(task_id) / f"chunk_{chunk_id:04d}.md"
     
-    # 合并并去重
-    extracted_terms = list(set(proper_nouns + found_tech))
+    def save_chunk(self, task_id, chunk, translation, terminology, context_tail):
+        """保存单块检查点（先写译文段文件，再写元数据，元数据存在即表示该块完成)"""
+        task_dir = self.task_dir(task_id)
+        task_dir.mkdir(parents=True, exist_ok=True)
+        write_text_atomic(self.segment_path(task_id, chunk['id']), translation)
+        write_json_atomic(task_dir / f"chunk_{chunk['id']:04d}.json", {
+            'chunk_id': chunk['id'],
+            'chapters': chunk['chapters'],
+            'chars': len(translation),
+            'model': chunk.get('model'),
+            'terminology': terminology,
+            'context_tail': context_tail,
+            'saved_at': datetime.now().isoformat()
+        })
     
-    return extracted_terms
-
-
-def get_context_from_previous(prev_translation):
-    """从前一块翻译末尾提取上下文"""
-    if not prev_translation:
-        return ""
+    def save_glossary(self, task_id, glossary, issues):
+        """保存双语术语表（每块学习后覆盖写入)和译名一致性问题"""
+        task_dir = self.task_dir(task_id)
+        task_dir.mkdir(parents=True, exist_ok=True)
+        write_json_atomic(task_dir / 'glossary.json', {
+            **glossary.to_dict(),
+            'issues': issues,
+            'saved_at': datetime.now().isoformat()
+        })
     
-    paragraphs = [p.strip() for p in prev_translation.split('\n\n') if p.strip()]
-    context_paras = paragraphs[-CONTEXT_PARAGRAPHS:] if len(paragraphs) >= CONTEXT_PARAGRAPHS else paragraphs
-    context = '\n\n'.join(context_paras)
+    def load_glossary(self, task_id):
+        """读取双语术语表，不存在或损坏时返回 None"""
+        try:
+            with open(self.task_dir(task_id) / 'glossary.json', 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
     
-    return context
+    def read_segment(self, task_id, chunk_id):
+        """读取单块译文"""
+        with open(self.segment_path(task_id, chunk_id), 'r', encoding='utf-8') as f:
+            return f.read()
+    
+    def load_task(self, task_id):
+        """读取任务元数据，不存在时返回 None"""
+        task_file = self.task_dir(task_id) / 'task.json'
+        if not task_file.exists():
+            return None
+        with open(task_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    
+    def load_chunks(self, task_id):
+        """读取所有已完成块的检查点: chunk_id -> 检查点"""
+        checkpoints = {}
+        for chunk_file in sorted(self.task_dir(task_id).glob('chunk_*.json')):
+            try:
+                with open(chunk_file, 'r', encoding='utf-8') as f:
+                    checkpoint = json.load(f)
+            except (OSError, ValueError):
+                continue  # 损坏的检查点视为未完成，重新翻译
+            if not self.segment_path(task_id, checkpoint['chunk_id']).exists():
+                continue
+            checkpoints[checkpoint['chunk_id']] = checkpoint
+        return checkpoints
 
 
-def translate_chunk_web(task, chunk_id, total_chunks, chunk_content, language, 
-                        prev_context="", terminology=None):
-    """Web版翻译单块（带实时日志)"""
+class IncrementalOutputWriter:
+    """追加写入的增量输出文件
     
-    task.emit_log(f"━━━━━━━━━━━━━━━━━━━━━━━━━━━━", 'info')
-    task.emit_log(f"🔄 Starting chunk {chunk_id}/{total_chunks}", 'info')
-    task.emit_log(f"📝 Input size: {len(chunk_content):,} characters", 'info')
+    每块译文只写一次：已完成的连续前缀按块顺序从段文件流式追加到输出文件，
+    每次追加后 fsync，与检查点保持一致。
+    """
+    def __init__(self, output_file, chunk_ids, segment_path_for):
+        self.output_file = Path(output_file)
+        self.chunk_ids = list(chunk_ids)
+        self.segment_path_for = segment_path_for  # chunk_id -> 段文件路径
+        self.written = 0
+        self._file = open(self.output_file, 'wb')
     
-    # Demo 优化：快速显示开始信息
-    if DEMO_MODE:
-        task.emit_log(f"⚡ Demo mode: Using small chunks for quick demonstration", 'info')
+    def append_ready(self, done):
+        """追加所有已完成的连续块
+        
+        Args:
+            done: chunk_id -> {'chapters': [...], 'model': ...}，已完成块的元数据
+            
+        Returns:
+            int: 本次追加的块数
+        """
+        appended = 0
+        while self.written < len(self.chunk_ids) and self.chunk_ids[self.written] in done:
+            chunk_id = self.chunk_ids[self.written]
+            model = done[chunk_id].get('model')
+            model_note = f" | model: {model}" if model else ""
+            header = f"\n\n<!-- Chunk {chunk_id}: {', '.join(done[chunk_id]['chapters'])}{model_note} -->\n\n"
+            self._file.write(header.encode('utf-8'))
+            with open(self.segment_path_for(chunk_id), 'rb') as segment:
+                shutil.copyfileobj(segment, self._file)
+            self.written += 1
+            appended += 1
+        if appended:
+            self.checkpoint()
+        return appended
     
-    # 显示使用的术语数量
-    if terminology:
-        task.emit_log(f"� Using {len(terminology)} terms for consistency", 'info')
+    def checkpoint(self):
+        """刷新并 fsync 到磁盘"""
+        self._file.flush()
+        os.fsync(self._file.fileno())
     
-    system_prompt = f"""You are a professional book translator. Translate the following book excerpt from English to {language}.
+    def close(self):
+        if not self._file.closed:
+            self.checkpoint()
+            self._file.close()
 
-CRITICAL REQUIREMENTS:
-1. **Preserve ALL markdown formatting**: headers (#, ##, ###), lists, quotes (>), code blocks, links
-2. **Maintain structure**: Keep all chapters, sections, paragraphs exactly as structured
-3. **Preserve names**: Keep all person names, company names, book titles in original English
-4. **Technical terms**: Translate technical terms accurately, add English in parentheses for first occurrence if needed
-5. **Natural language**: Use native {language} expression, not word-by-word translation
-6. **Completeness**: Translate EVERY sentence, don't skip any content
-7. **Consistency**: Maintain consistent terminology throughout the book
 
-CONTEXT: This is chunk {chunk_id}/{total_chunks} of the complete book.
-"""
+def assemble_final_output(output_file, segment_paths, separator='\n\n'):
+    """按顺序流式拼接段文件生成最终译文，不在内存中拼接整本书
     
-    context_info = ""
-    if prev_context:
-        context_info = f"""
-<previous_context>
-For continuity, here are the last paragraphs from the previous chunk:
-{prev_context}
-</previous_context>
-"""
+    Returns:
+        int: 写入的字节数
+    """
+    output_file = Path(output_file)
+    tmp_path = output_file.with_name(output_file.name + '.tmp')
+    sep = separator.encode('utf-8')
+    with open(tmp_path, 'wb') as out:
+        for i, segment_path in enumerate(segment_paths):
+            if i > 0:
+                out.write(sep)
+            with open(segment_path, 'rb') as segment:
+                shutil.copyfileobj(segment, out)
+        out.flush()
+        os.fsync(out.fileno())
+        total_bytes = out.tell()
+    os.replace(tmp_path, output_file)
+    return total_bytes
+
+
+checkpoint_store = CheckpointStore(app.config['CHECKPOINT_FOLDER'])
+
+
+class SourceUnavailableError(Exception):
+    """续传需要的原文文件已不存在"""
+
+
+def restore_task_from_checkpoint(task_id):
+    """从检查点重建任务，返回 None 表示没有可恢复的检查点
     
-    term_info = ""
+    Raises:
+        SourceUnavailableError: 还有未完成的块需要从原文切出，但原文文件已不存在
+    """
+    meta = checkpoint_store.load_task(task_id)
+    if meta is None:
+        return None
+    
+    task = TranslationTask(task_id, meta['filename'], meta['language'])
+    task.source_path = meta.get('source_path')
+    task.use_terminology = meta.get('use_terminology', True)
+    task.max_concurrency = meta.get('max_concurrency', MAX_CONCURRENT_CHUNKS)
+    task.chunks_info = meta['chunks']
+    task.total_chunks = meta['total_chunks']
+    task.resume_checkpoints = checkpoint_store.load_chunks(task_id)
+    
+    if task.source_path and Path(task.source_path).exists():
+        task.load_source(task.source_path)
+    else:
+        # 旧版计划的块自带 content；其余未完成的块只保存偏移，没有原文就无法翻译
+        pending = [c for c in task.chunks_info if c['id'] not in task.resume_checkpoints and 'content' not in c]
+        if pending:
+            raise SourceUnavailableError(
+                f"source file {task.source_path} is missing, {len(pending)} chunks cannot be translated"
+            )
+    
+    task.status = 'analyzed'
+    return task
+
+
+# ============ 任务仓库（SQLite)============
+
+def _iso(value):
+    return value.isoformat() if value else None
+
+
+def _from_iso(value):
+    return datetime.fromisoformat(value) if value else None
+
+
+class TaskStore:
+    """基于 SQLite（WAL)的任务仓库
+    
+    tasks 表保存任务元数据和状态（状态接口只读这一行)，task_chunks 表保存分块计划
+    （含实际翻译模型)。多个服务进程共享同一个数据库文件，任一进程都能查询、
+    预览、下载其他进程分析或翻译的任务。
+    """
+    STATUS_COLUMNS = (
+        'task_id', 'filename', 'language', 'status', 'progress', 'current_chunk',
+        'total_chunks', 'result_file', 'error', 'start_time', 'end_time', 'metrics', 'updated_at',
+        'plan_updated_at'
+    )
+    
+    def __init__(self, db_path):
+        self.db_path = Path(db_path)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False, timeout=30)
+        with self._lock, self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS tasks (
+                    task_id TEXT PRIMARY KEY,
+                    filename TEXT NOT NULL,
+                    language TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    progress INTEGER NOT NULL DEFAULT 0,
+                    current_chunk INTEGER NOT NULL DEFAULT 0,
+                    total_chunks INTEGER NOT NULL DEFAULT 0,
+                    result_file TEXT,
+                    error TEXT,
+                    source_path TEXT,
+                    use_terminology INTEGER NOT NULL DEFAULT 1,
+                    max_concurrency INTEGER,
+                    start_time TEXT,
+                    end_time TEXT,
+                    metrics TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    plan_updated_at REAL
+                )
+            """)
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info('tasks')")}
+            if 'plan_updated_at' not in columns:  # 旧版数据库
+                self._conn.execute('ALTER TABLE tasks ADD COLUMN plan_updated_at REAL')
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS task_chunks (
+                    task_id TEXT PRIMARY KEY,
+                    chunks TEXT NOT NULL
+                )
+            """)
+            self._conn.execute('CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks(status)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS idx_tasks_updated_at ON tasks(updated_at)')
+    
+    def save(self, task, chunks=True):
+        """保存任务（chunks=True 时同时保存分块计划)"""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                """INSERT INTO tasks
+                   (task_id, filename, language, status, progress, current_chunk, total_chunks,
+                    result_file, error, source_path, use_terminology, max_concurrency,
+                    start_time, end_time, metrics, created_at, updated_at, plan_updated_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(task_id) DO UPDATE SET
+                    filename = excluded.filename, language = excluded.language,
+                    status = excluded.status, progress = excluded.progress,
+                    current_chunk = excluded.current_chunk, total_chunks = excluded.total_chunks,
+                    result_file = excluded.result_file, error = excluded.error,
+                    source_path = excluded.source_path, use_terminology = excluded.use_terminology,
+                    max_concurrency = excluded.max_concurrency, start_time = excluded.start_time,
+                    end_time = excluded.end_time, metrics = excluded.metrics,
+                    updated_at = excluded.updated_at, plan_updated_at = excluded.plan_updated_at""",
+                (task.task_id, task.filename, task.language, task.status, task.progress,
+                 task.current_chunk, task.total_chunks, task.result_file, task.error,
+                 task.source_path, int(task.use_terminology), task.max_concurrency,
+                 _iso(task.start_time), _iso(task.end_time), json.dumps(task.metrics), now, now,
+                 now if chunks else task.plan_version)
+            )
+            if chunks:
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO task_chunks (task_id, chunks) VALUES (?, ?)',
+                    (task.task_id, json.dumps(task.chunks_info, ensure_ascii=False))
+                )
+        task.persisted_at = now
+        if chunks:
+            task.plan_version = now
+    
+    def update_status(self, task):
+        """只更新状态列（进度、状态变化时调用)"""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                """UPDATE tasks SET status = ?, progress = ?, current_chunk = ?, total_chunks = ?,
+                   result_file = ?, error = ?, use_terminology = ?, max_concurrency = ?,
+                   start_time = ?, end_time = ?, metrics = ?, updated_at = ?
+                   WHERE task_id = ?""",
+                (task.status, task.progress, task.current_chunk, task.total_chunks,
+                 task.result_file, task.error, int(task.use_terminology), task.max_concurrency,
+                 _iso(task.start_time), _iso(task.end_time), json.dumps(task.metrics), now, task.task_id)
+            )
+        task.persisted_at = now
+    
+    def claim(self, task, expected_status, new_status, **options):
+        """比较并设置状态，防止多个进程同时启动同一任务
+        
+        options（use_terminology / max_concurrency)与状态一起写入，成功后才设置到 task 上。
+        
+        Returns:
+            bool: 仓库中状态为 expected_status（或任务未入库)时设置成功
+        """
+        use_terminology = options.get('use_terminology', task.use_terminology)
+        max_concurrency = options.get('max_concurrency', task.max_concurrency)
+        now = time.time()
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                """UPDATE tasks SET status = ?, use_terminology = ?, max_concurrency = ?, updated_at = ?
+                   WHERE task_id = ? AND status = ?""",
+                (new_status, int(use_terminology), max_concurrency, now, task.task_id, expected_status)
+            )
+            if cursor.rowcount == 0:
+                exists = self._conn.execute(
+                    'SELECT 1 FROM tasks WHERE task_id = ?', (task.task_id,)
+                ).fetchone()
+                if exists:
+                    return False
+        task.status = new_status
+        task.use_terminology = use_terminology
+        task.max_concurrency = max_concurrency
+        task.persisted_at = now
+        return True
+    
+    def get_status(self, task_id):
+        """读取任务状态行（不含分块计划)，不存在时返回 None"""
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(self.STATUS_COLUMNS)} FROM tasks WHERE task_id = ?", (task_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        status = dict(zip(self.STATUS_COLUMNS, row))
+        status['metrics'] = json.loads(status['metrics']) if status['metrics'] else {}
+        return status
+    
+    @staticmethod
+    def apply_status(task, status):
+        """把 get_status() 读到的状态列写回已加载的任务（分块计划和原文不变)"""
+        for name in ('status', 'progress', 'current_chunk', 'total_chunks', 'result_file', 'error'):
+            setattr(task, name, status[name])
+        task.start_time = _from_iso(status['start_time'])
+        task.end_time = _from_iso(status['end_time'])
+        task.metrics.update(status['metrics'])
+        task.persisted_at = status['updated_at']
+    
+    def load(self, task_id, with_source=True):
+        """从仓库重建 TranslationTask，不存在时返回 None
+        
+        Args:
+            with_source: 是否读取源文件和分块计划（状态查询不需要)
+        """
+        with self._lock:
+            row = self._conn.execute(
+                """SELECT filename, language, status, progress, current_chunk, total_chunks,
+                          result_file, error, source_path, use_terminology, max_concurrency,
+                          start_time, end_time, metrics, updated_at, plan_updated_at
+                   FROM tasks WHERE task_id = ?""", (task_id,)
+            ).fetchone()
+            chunks_row = None
+            if row is not None and with_source:
+                chunks_row = self._conn.execute(
+                    'SELECT chunks FROM task_chunks WHERE task_id = ?', (task_id,)
+                ).fetchone()
+        if row is None:
+            return None
+        
+        (filename, language, status, progress, current_chunk, total_chunks, result_file, error,
+         source_path, use_terminology, max_concurrency, start_time, end_time, metrics, updated_at,
+         plan_updated_at) = row
+        task = TranslationTask(task_id, filename, language)
+        task.status = status
+        task.progress = progress
+        task.current_chunk = current_chunk
+        task.total_chunks = total_chunks
+        task.result_file = result_file
+        task.error = error
+        task.source_path = source_path
+        task.use_terminology = bool(use_terminology)
+        if max_concurrency:
+            task.max_concurrency = max_concurrency
+        task.start_time = _from_iso(start_time)
+        task.end_time = _from_iso(end_time)
+        if metrics:
+            task.metrics.update(json.loads(metrics))
+        task.persisted_at = updated_at
+        task.plan_version = plan_updated_at
+        
+        if chunks_row is not None:
+            task.chunks_info = json.loads(chunks_row[0])
+        if with_source and source_path and Path(source_path).exists():
+            task.load_source(source_path)
+        return task
+
+
+task_store = None
+try:
+    task_store = TaskStore(TASK_STORE_PATH)
+except sqlite3.Error as e:
+    print(f"[WARN] 任务仓库初始化失败，任务状态只保存在本进程内存中: {e}")
+
+
+def persist_task(task, chunks=False):
+    """写入任务仓库（失败只打印警告，不影响翻译)
+    
+    Args:
+        chunks: 是否同时写入任务全部字段和分块计划（否则只更新状态列)
+    """
+    if task_store is None:
+        return
+    try:
+        if chunks:
+            task_store.save(task)
+        else:
+            task_store.update_status(task)
+    except sqlite3.Error as e:
+        print(f"⚠️  Failed to persist task {task.task_id}: {e}")
+
+
+def claim_task(task, expected_status, new_status, **options):
+    """跨进程比较并设置任务状态，仓库不可用时只检查内存状态
+    
+    options 为随状态一起保存的用户选项（use_terminology / max_concurrency)，占用成功后才生效。
+    """
+    if task.status != expected_status:
+        return False
+    if task_store is not None:
+        try:
+            return task_store.claim(task, expected_status, new_status, **options)
+        except sqlite3.Error as e:
+            print(f"⚠️  Failed to claim task {task.task_id}: {e}")
+    task.status = new_status
+    for name, value in options.items():
+        setattr(task, name, value)
+    return True
+
+
+def get_task(task_id, with_source=True):
+    """按 task_id 取任务
+    
+    本进程正在排队/翻译的任务直接使用内存对象；否则与仓库比较，
+    仓库中更新（其他进程推进了任务)或本进程没有时从仓库加载。分块计划没有变化时
+    只刷新状态列，不重新读取原文和分块计划。
+    
+    Args:
+        with_source: 是否需要源文件内容和分块计划（状态查询传 False)
+    """
+    task = tasks.get(task_id)
+    if task_store is None or (task is not None and translation_queue.owns(task_id)):
+        return task
+    try:
+        status = task_store.get_status(task_id)
+        if status is None or (task is not None and status['updated_at'] <= task.persisted_at):
+            return task
+        if task is not None and status['plan_updated_at'] == task.plan_version:
+            TaskStore.apply_status(task, status)
+            return task
+        loaded = task_store.load(task_id, with_source)
+    except sqlite3.Error as e:
+        print(f"⚠️  Failed to read task {task_id} from store: {e}")
+        return task
+    if loaded is not None and with_source:
+        tasks[task_id] = loaded
+    return loaded
+
+
+# ============ 翻译核心函数（改造自 script_v3_chunked.py)============
+
+# DOCX（WordprocessingML)命名空间
+W_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+HEADING_STYLE_RE = re.compile(r'^heading\s*(\d*)$', re.IGNORECASE)
+
+
+def _w_val(parent, path):
+    """读取 parent 下 path 元素的 w:val 属性，不存在时返回 None"""
+    if parent is None:
+        return None
+    node = parent.find(path)
+    return node.get(f'{W_NS}val') if node is not None else None
+
+
+class DocxStyles:
+    """styles.xml / numbering.xml 中转换需要的信息（样式按 basedOn 继承解析)"""
+    
+    def __init__(self, zf):
+        self.styles = {}       # styleId -> {'name', 'based_on', 'outline', 'num'}
+        self.levels = {}       # (numId, ilvl) -> (numFmt, start)
+        names = set(zf.namelist())
+        if 'word/styles.xml' in names:
+            with zf.open('word/styles.xml') as f:
+                self._load_styles(ET.parse(f).getroot())
+        if 'word/numbering.xml' in names:
+            with zf.open('word/numbering.xml') as f:
+                self._load_numbering(ET.parse(f).getroot())
+    
+    def _load_styles(self, root):
+        for style in root.iter(f'{W_NS}style'):
+            if style.get(f'{W_NS}type') != 'paragraph':
+                continue
+            ppr = style.find(f'{W_NS}pPr')
+            num_id = _w_val(ppr, f'{W_NS}numPr/{W_NS}numId')
+            self.styles[style.get(f'{W_NS}styleId')] = {
+                'name': _w_val(style, f'{W_NS}name') or '',
+                'based_on': _w_val(style, f'{W_NS}basedOn'),
+                'outline': _w_val(ppr, f'{W_NS}outlineLvl'),
+                'num': (num_id, _w_val(ppr, f'{W_NS}numPr/{W_NS}ilvl') or '0') if num_id else None
+            }
+    
+    def _load_numbering(self, root):
+        abstract = {}
+        for node in root.iter(f'{W_NS}abstractNum'):
+            abstract[node.get(f'{W_NS}abstractNumId')] = {
+                lvl.get(f'{W_NS}ilvl'): (_w_val(lvl, f'{W_NS}numFmt') or 'decimal',
+                                         int(_w_val(lvl, f'{W_NS}start') or 1))
+                for lvl in node.iter(f'{W_NS}lvl')
+            }
+        for num in root.iter(f'{W_NS}num'):
+            for ilvl, fmt in abstract.get(_w_val(num, f'{W_NS}abstractNumId'), {}).items():
+                self.levels[(num.get(f'{W_NS}numId'), ilvl)] = fmt
+    
+    def _chain(self, style_id):
+        """样式及其 basedOn 祖先（防止循环引用)"""
+        seen = set()
+        while style_id and style_id in self.styles and style_id not in seen:
+            seen.add(style_id)
+            yield self.styles[style_id]
+            style_id = self.styles[style_id]['based_on']
+    
+    def heading_level(self, style_id, outline=None):
+        """段落的标题级别（1 起)，不是标题时返回 0
+        
+        依次看段落自身的大纲级别、样式名（Heading N / Title，含基于标题的自定义样式)、样式的大纲级别。
+        """
+        if outline is not None and outline.isdigit() and int(outline) < 9:
+            return int(outline) + 1
+        for style in self._chain(style_id):
+            name = style['name'].strip().lower()
+            match = HEADING_STYLE_RE.match(name)
+            if match:
+                return int(match.group(1)) if match.group(1) else 1
+            if name == 'title':
+                return 1
+            if style['outline'] is not None and style['outline'].isdigit() and int(style['outline']) < 9:
+                return int(style['outline']) + 1
+        return 0
+    
+    def numbering(self, style_id):
+        """样式自带的列表编号 (numId, ilvl)"""
+        for style in self._chain(style_id):
+            if style['num']:
+                return style['num']
+        return None
+    
+    def list_format(self, num_id, ilvl):
+        return self.levels.get((num_id, ilvl), ('bullet', 1))
+
+
+class DocxListCounter:
+    """有序列表的编号计数（同一 numId 共用，出现上级条目时重置下级)"""
+    
+    def __init__(self, styles):
+        self.styles = styles
+        self.counts = {}  # numId -> [每级已出现的条目数]
+    
+    def marker(self, num_id, ilvl):
+        fmt, start = self.styles.list_format(num_id, str(ilvl))
+        levels = self.counts.setdefault(num_id, [0] * 10)
+        levels[ilvl] += 1
+        for deeper in range(ilvl + 1, len(levels)):
+            levels[deeper] = 0
+        if fmt in ('bullet', 'none'):
+            return '-'
+        return f"{start + levels[ilvl] - 1}."
+
+
+def _docx_text(element):
+    """元素内的文本（w:tab → 制表符，w:br / w:cr → 换行，删除修订和域代码不计入)"""
+    pieces = []
+    for node in element.iter():
+        if node.tag == f'{W_NS}t':
+            pieces.append(node.text or '')
+        elif node.tag == f'{W_NS}tab':
+            pieces.append('\t')
+        elif node.tag in (f'{W_NS}br', f'{W_NS}cr'):
+            pieces.append('\n')
+    return ''.join(pieces)
+
+
+def _docx_paragraph_block(p, styles, counter):
+    ppr = p.find(f'{W_NS}pPr')
+    style_id = _w_val(ppr, f'{W_NS}pStyle')
+    text = _docx_text(p).strip()
+    if not text:
+        return None
+    
+    level = styles.heading_level(style_id, _w_val(ppr, f'{W_NS}outlineLvl'))
+    if level:
+        return 'heading', f"{'#' * min(level, 6)} {' '.join(text.split())}"
+    
+    num_id = _w_val(ppr, f'{W_NS}numPr/{W_NS}numId')
+    ilvl = _w_val(ppr, f'{W_NS}numPr/{W_NS}ilvl')
+    if num_id is None:
+        num_id, ilvl = styles.numbering(style_id) or (None, None)
+    if num_id and num_id != '0':
+        ilvl = min(int(ilvl or 0), 9)
+        return 'list', f"{'    ' * ilvl}{counter.marker(num_id, ilvl)} {text}"
+    
+    return 'paragraph', text
+
+
+def _docx_table_block(tbl):
+    rows = []
+    for tr in tbl.findall(f'{W_NS}tr'):
+        cells = []
+        for tc in tr.findall(f'{W_NS}tc'):
+            text = ' '.join(_docx_text(p).strip() for p in tc.iter(f'{W_NS}p'))
+            cells.append(' '.join(text.split()).replace('|', '\\|'))
+            span = _w_val(tc.find(f'{W_NS}tcPr'), f'{W_NS}gridSpan')
+            if span and span.isdigit():
+                cells.extend([''] * (int(span) - 1))  # 合并单元格补空列，保持列对齐
+        rows.append(cells)
+    if not rows:
+        return None
+    
+    lines = []
+    for i, cells in enumerate(rows):
+        lines.append("| " + " | ".join(cells) + " |")
+        # 添加表头分隔符
+        if i == 0:
+            lines.append("| " + " | ".join(["---"] * len(cells)) + " |")
+    return 'table', '\n'.join(lines)
+
+
+def _docx_body_blocks(element, styles, counter):
+    if element.tag == f'{W_NS}p':
+        block = _docx_paragraph_block(element, styles, counter)
+    elif element.tag == f'{W_NS}tbl':
+        block = _docx_table_block(element)
+    elif element.tag == f'{W_NS}sdt':
+        # 内容控件（如目录)：按顺序处理其中的段落和表格
+        content = element.find(f'{W_NS}sdtContent')
+        for child in (content if content is not None else []):
+            yield from _docx_body_blocks(child, styles, counter)
+        return
+    else:
+        return
+    if block is not None:
+        yield block
+
+
+def iter_docx_blocks(docx_path):
+    """按文档顺序逐个产出 Markdown 块 (kind, text)，kind 为 heading / paragraph / list / table
+    
+    word/document.xml 用 iterparse 流式解析，正文的每个段落、表格处理完立即释放，
+    内存占用不随文档长度增长。
+    """
+    with zipfile.ZipFile(docx_path) as zf:
+        styles = DocxStyles(zf)
+        counter = DocxListCounter(styles)
+        with zf.open('word/document.xml') as f:
+            depth = 0
+            body = None
+            for event, element in ET.iterparse(f, events=('start', 'end')):
+                if event == 'start':
+                    depth += 1
+                    if depth == 2 and element.tag == f'{W_NS}body':
+                        body = element
+                    continue
+                depth -= 1
+                if depth == 2 and body is not None:  # <w:body> 的直接子元素已完整解析
+                    yield from _docx_body_blocks(element, styles, counter)
+                    body.clear()
+
+
+def write_docx_markdown(docx_path, out):
+    """把 DOCX 转换为 Markdown，逐块写入 out（文本文件对象)
+    
+    块之间空一行，相邻的列表项之间不空行（保持为同一个列表)。
+    
+    Returns:
+        dict: {'chars': 写入的字符数, 'words': 词数}
+    """
+    chars = words = 0
+    prev_kind = None
+    for kind, text in iter_docx_blocks(docx_path):
+        if prev_kind is not None:
+            separator = '\n' if kind == prev_kind == 'list' else '\n\n'
+            out.write(separator)
+            chars += len(separator)
+        out.write(text)
+        chars += len(text)
+        words += len(text.split())
+        prev_kind = kind
+    return {'chars': chars, 'words': words}
+
+
+def convert_docx_to_markdown_file(docx_path, md_path):
+    """将 Word 文档流式转换为 Markdown 文件（先写临时文件，成功后替换)
+    
+    Returns:
+        dict: {'chars', 'words'}
+    """
+    md_path = Path(md_path)
+    tmp_path = md_path.with_name(f"{md_path.name}.{uuid.uuid4().hex[:8]}.tmp")  # 并发转换同一文件时互不覆盖
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as out:
+            stats = write_docx_markdown(docx_path, out)
+        os.replace(tmp_path, md_path)
+        return stats
+    except Exception as e:
+        tmp_path.unlink(missing_ok=True)
+        raise Exception(f"DOCX conversion failed: {str(e)}")
+
+
+def convert_docx_to_markdown(docx_path):
+    """
+    将 Word 文档转换为 Markdown 格式
+    
+    按文档顺序输出标题、段落、列表和表格（表格保留在原位置)。
+    
+    Args:
+        docx_path: Word 文档路径
+        
+    Returns:
+        str: Markdown 格式的文本内容
+    """
+    try:
+        out = io.StringIO()
+        write_docx_markdown(docx_path, out)
+        return out.getvalue()
+    except Exception as e:
+        raise Exception(f"DOCX conversion failed: {str(e)}")
+
+
+# Markdown 结构识别（ATX 标题、Setext 标题、围栏代码块)
+ATX_HEADING_RE = re.compile(r'^ {0,3}(#{1,6})[ \t]+(.+?)(?:[ \t]+#+)?[ \t]*$')
+SETEXT_UNDERLINE_RE = re.compile(r'^ {0,3}(=+|-+)[ \t]*$')
+FENCE_OPEN_RE = re.compile(r'^ {0,3}(`{3,}|~{3,})')
+NON_PARAGRAPH_RE = re.compile(r'^\s*(?:[>|]|[-*+][ \t]|\d+[.)][ \t])')
+TABLE_ROW_RE = re.compile(r'^ {0,3}\|')
+
+
+def index_markdown(content):
+    """单次线性扫描建立 Markdown 结构索引
+    
+    识别 ATX 标题（# ~ ######)、Setext 标题（=== / --- 下划线)、围栏代码块和表格，
+    代码块内的 # 行不会被当作标题。所有位置均为字符偏移。
+    
+    Returns:
+        dict: {
+            'headings': [{'line', 'level', 'title', 'start_pos', 'end_pos', 'chars', 'setext'}],
+            'code_blocks': [{'start_line', 'end_line', 'start_pos', 'end_pos'}],
+            'tables': [{'start_line', 'end_line', 'start_pos', 'end_pos'}],
+            'total_len': int
+        }
+        标题的 end_pos 为下一个同级或更高级标题的位置（即整节范围)
+    """
+    headings = []
+    code_blocks = []
+    tables = []
+    table = None          # 当前表格 {'start_line', 'start_pos', 'end_line', 'end_pos'}
+    pos = 0
+    fence = None          # 当前打开的围栏（如 ``` 或 ~~~~)
+    fence_start = (0, 0)  # (line, pos)
+    para = None           # 当前段落 {'line', 'pos', 'lines'}，用于识别 Setext 标题
+    line_no = 0
+    
+    for line_no, raw in enumerate(content.splitlines(keepends=True), 1):
+        line = raw.rstrip('\r\n')
+        
+        if fence:
+            stripped = line.strip()
+            if stripped.startswith(fence) and not stripped.lstrip(fence[0]):
+                code_blocks.append({
+                    'start_line': fence_start[0],
+                    'end_line': line_no,
+                    'start_pos': fence_start[1],
+                    'end_pos': pos + len(raw)
+                })
+                fence = None
+            pos += len(raw)
+            continue
+        
+        # 表格：连续的 | 开头行
+        if TABLE_ROW_RE.match(line):
+            if table is None:
+                table = {'start_line': line_no, 'start_pos': pos}
+            table['end_line'] = line_no
+            table['end_pos'] = pos + len(raw)
+        elif table is not None:
+            tables.append(table)
+            table = None
+        
+        fence_match = FENCE_OPEN_RE.match(line)
+        atx_match = ATX_HEADING_RE.match(line) if not fence_match else None
+        
+        if fence_match:
+            fence = fence_match.group(1)
+            fence_start = (line_no, pos)
+            para = None
+        elif atx_match:
+            headings.append({
+                'line': line_no,
+                'level': len(atx_match.group(1)),
+                'title': atx_match.group(2).strip(),
+                'start_pos': pos,
+                'setext': False
+            })
+            para = None
+        elif para and SETEXT_UNDERLINE_RE.match(line):
+            headings.append({
+                'line': para['line'],
+                'level': 1 if line.strip()[0] == '=' else 2,
+                'title': ' '.join(para['lines']),
+                'start_pos': para['pos'],
+                'setext': True
+            })
+            para = None
+        elif line.strip() and not NON_PARAGRAPH_RE.match(line):
+            if para is None:
+                para = {'line': line_no, 'pos': pos, 'lines': []}
+            para['lines'].append(line.strip())
+        else:
+            para = None
+        
+        pos += len(raw)
+    
+    total_len = len(content)
+    
+    if table is not None:
+        tables.append(table)
+    
+    # 未闭合的代码块延续到文末
+    if fence:
+        code_blocks.append({
+            'start_line': fence_start[0],
+            'end_line': line_no,
+            'start_pos': fence_start[1],
+            'end_pos': total_len
+        })
+    
+    # 用栈计算每个标题的整节范围（到下一个同级或更高级标题)
+    open_headings = []
+    for heading in headings:
+        while open_headings and open_headings[-1]['level'] >= heading['level']:
+            open_headings.pop()['end_pos'] = heading['start_pos']
+        open_headings.append(heading)
+    for heading in open_headings:
+        heading['end_pos'] = total_len
+    for heading in headings:
+        heading['chars'] = heading['end_pos'] - heading['start_pos']
+    
+    return {
+        'headings': headings,
+        'code_blocks': code_blocks,
+        'tables': tables,
+        'total_len': total_len
+    }
+
+
+def extract_chapters(content, md_index=None):
+    """提取章节结构（基于 index_markdown 的标题索引)"""
+    if md_index is None:
+        md_index = index_markdown(content)
+    return md_index['headings']
+
+
+CJK_CHAR_RE = re.compile(r'[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]')
+
+
+def estimate_tokens(text):
+    """粗略估算 token 数：CJK 字符约 1 token/字，其他文本约 4 字符/token"""
+    if not text:
+        return 0
+    cjk_chars = len(CJK_CHAR_RE.findall(text))
+    return int(cjk_chars + (len(text) - cjk_chars) / 4) + 1
+
+
+def plan_chunk_budget(content, language=None, model_key=None):
+    """根据模型输出上限和目标语言计算每块的字符预算
+    
+    保证每块译文能在一次响应中输出完（不被 max_tokens 截断)，
+    同时原文 + 输出不超过模型上下文窗口。
+    
+    Returns:
+        dict: target_chars、max_source_tokens、token_ratio 等规划参数
+    """
+    model_key = model_key or ACTIVE_MODEL
+    config = MODEL_CONFIGS[model_key]
+    ratio = TARGET_TOKEN_RATIOS.get(language, DEFAULT_TARGET_TOKEN_RATIO)
+    
+    max_output_tokens = int(config['max_tokens'] * OUTPUT_TOKEN_SAFETY)
+    by_output = max_output_tokens / ratio
+    # 原文 + 预计译文 + 提示词开销 ≤ 上下文窗口
+    by_context = (config['context_window'] - PROMPT_OVERHEAD_TOKENS) / (1 + ratio)
+    max_source_tokens = max(1000, int(min(by_output, by_context)))
+    
+    source_tokens = estimate_tokens(content)
+    chars_per_token = len(content) / source_tokens if source_tokens else 4.0
+    budget_chars = int(max_source_tokens * chars_per_token)
+    
+    return {
+        'model': model_key,
+        'language': language,
+        'token_ratio': ratio,
+        'max_output_tokens': max_output_tokens,
+        'max_source_tokens': max_source_tokens,
+        'chars_per_token': round(chars_per_token, 2),
+        'target_chars': max(1, min(CHUNK_TARGET_SIZE, budget_chars)),
+        'split_chars': max(1, min(max(CHUNK_TARGET_SIZE, CHAPTER_SPLIT_SIZE), budget_chars))
+    }
+
+
+def annotate_chunk_tokens(chunks, budget, content):
+    """为每块标注预计的原文/译文 token 数"""
+    for chunk in chunks:
+        source_tokens = estimate_tokens(chunk_text(content, chunk))
+        output_tokens = int(source_tokens * budget['token_ratio'])
+        chunk['source_tokens'] = source_tokens
+        chunk['output_tokens'] = output_tokens
+        chunk['exceeds_budget'] = output_tokens > budget['max_output_tokens']
+    return chunks
+
+
+PARAGRAPH_BREAK_RE = re.compile(r'\n[ \t]*\n+')
+SENTENCE_END_RE = re.compile(r'(?<=[.!?。！？])["\'”’)\]]*\s+')
+SPLIT_TOLERANCES = (0.35, 0.2, 0.1)  # 标题 / 段落 / 句子边界允许偏离理想切分点的比例
+
+
+def _protected_ranges(md_index):
+    """不可切开的区域（围栏代码块、表格)，按起点排序"""
+    ranges = [(b['start_pos'], b['end_pos']) for b in md_index['code_blocks']]
+    ranges += [(t['start_pos'], t['end_pos']) for t in md_index.get('tables', [])]
+    return sorted(ranges)
+
+
+def _find_protected(pos, protected, protected_starts):
+    """pos 落在某个保护区内部时返回该区域，否则返回 None"""
+    i = bisect_right(protected_starts, pos) - 1
+    if i >= 0 and protected[i][0] < pos < protected[i][1]:
+        return protected[i]
+    return None
+
+
+def split_oversized_range(content, start, end, target_size, md_index, min_level=2):
+    """把超出目标大小的范围切分为大小接近的若干片段
+    
+    依次优先在更深一级的标题（如 ###)、空行段落、句子边界处切分，
+    围栏代码块和表格内部永远不会被切开。
+    
+    Args:
+        min_level: 所在章节的标题级别，只有更深的标题才作为切分点
+        
+    Returns:
+        list: [(start, end), ...] 首尾相接的片段
+    """
+    protected = _protected_ranges(md_index)
+    protected_starts = [r[0] for r in protected]
+    
+    def usable(positions):
+        return [p for p in positions
+                if start < p < end and _find_protected(p, protected, protected_starts) is None]
+    
+    tiers = [
+        usable(h['start_pos'] for h in md_index['headings'] if h['level'] > min_level),
+        usable(m.end() for m in PARAGRAPH_BREAK_RE.finditer(content, start, end)),
+        usable(m.end() for m in SENTENCE_END_RE.finditer(content, start, end)),
+    ]
+    
+    pieces = []
+    cur = start
+    while end - cur > target_size:
+        # 按剩余长度均分，避免最后留下很小的尾块
+        remaining = end - cur
+        ideal = remaining / -(-remaining // target_size)
+        desired = cur + ideal
+        cut = None
+        
+        for positions, tolerance in zip(tiers, SPLIT_TOLERANCES):
+            lo = cur + ideal * (1 - tolerance)
+            hi = min(cur + target_size, cur + ideal * (1 + tolerance))
+            k = bisect_left(positions, desired)
+            nearby = [p for p in positions[max(0, k - 1):k + 1] if lo <= p <= hi]
+            if nearby:
+                cut = min(nearby, key=lambda p: abs(p - desired))
+                break
+        
+        if cut is None:
+            # 没有结构边界：退回到理想点之前最近的空白处
+            cut = int(desired)
+            space = max(content.rfind(' ', cur + 1, cut), content.rfind('\n', cur + 1, cut))
+            if space > cur + ideal / 2:
+                cut = space + 1
+            block = _find_protected(cut, protected, protected_starts)
+            if block is not None:
+                # 切点落在代码块/表格内：移到块开头，块本身超大时整块保留
+                cut = block[0] if block[0] > cur else block[1]
+        
+        if cut >= end:
+            break
+        pieces.append((cur, cut))
+        cur = cut
+    
+    pieces.append((cur, end))
+    return pieces
+
+
+def plan_chunks(chapters, content, budget=None, md_index=None):
+    """规划分Chunk - 支持任何 Markdown 文件结构
+    
+    Args:
+        budget: plan_chunk_budget() 结果，默认按当前模型和默认语言计算
+        md_index: index_markdown() 结果，用于在超大章节内部寻找安全的切分点
+    """
+    if budget is None:
+        budget = plan_chunk_budget(content)
+    if md_index is None:
+        md_index = index_markdown(content)
+    target_size = budget['target_chars']
+    split_size = max(target_size, budget.get('split_chars', target_size))  # 章节超过此大小才切分
+    
+    chunks = []
+    current_chunk_chapters = []
+    current_size = 0
+    
+    # 优先使用 level 2 标题，如果没有则使用 level 1
+    main_headings = [c for c in chapters if c['level'] == 2]
+    if not main_headings:
+        main_headings = [c for c in chapters if c['level'] == 1]
+    
+    # 主章节首尾相接：两个主章节之间的内容（如更高级的 "# Part II"）归入后一章
+    # 超出 split_size 的章节按 ### 标题 → 段落 → 句子切分成接近目标大小的多个部分
+    main_chapters = []
+    for i, heading in enumerate(main_headings):
+        start_pos = main_headings[i - 1]['end_pos'] if i > 0 else heading['start_pos']
+        end_pos = heading['end_pos']
+        if end_pos - start_pos <= split_size:
+            pieces = [(start_pos, end_pos)]
+        else:
+            pieces = split_oversized_range(content, start_pos, end_pos, target_size,
+                                           md_index, min_level=heading['level'])
+        for k, (piece_start, piece_end) in enumerate(pieces, 1):
+            title = heading['title'] if len(pieces) == 1 else f"{heading['title']} (part {k}/{len(pieces)})"
+            main_chapters.append({
+                'title': title,
+                'start_pos': piece_start,
+                'end_pos': piece_end,
+                'chars': piece_end - piece_start
+            })
+    
+    # 如果仍然没有章节，按目标大小分段，切点对齐到段落/句子边界（不切开代码块和表格)
+    if not main_chapters:
+        segments = split_oversized_range(content, 0, len(content), target_size, md_index, min_level=0)
+        for i, (start, end) in enumerate(segments):
+            chunks.append({
+                'id': i + 1,
+                'chapters': [f'Segment {i+1}'],
+                'start_pos': start,
+                'end_pos': end,
+                'size': end - start,
+                'spans': [[start, end]]
+            })
+        return annotate_chunk_tokens(chunks, budget, content)
+    
+    # 前言 / 尾声（去掉首尾空白)只记录偏移，合并到首末块的 spans
+    prologue_span = stripped_span(content, 0, main_chapters[0]['start_pos'])
+    prologue_size = prologue_span[1] - prologue_span[0]
+    epilogue_span = stripped_span(content, main_chapters[-1]['end_pos'], len(content))
+    epilogue_size = epilogue_span[1] - epilogue_span[0]
+    
+    for chapter in main_chapters:
+        if current_size > 0 and current_size + chapter['chars'] > target_size:
+            chunk_start = current_chunk_chapters[0]['start_pos']
+            chunk_end = current_chunk_chapters[-1]['end_pos']
+            chunks.append({
+                'id': len(chunks) + 1,
+                'chapters': [c['title'] for c in current_chunk_chapters],
+                'start_pos': chunk_start,
+                'end_pos': chunk_end,
+                'size': current_size,
+                'spans': [[chunk_start, chunk_end]]
+            })
+            current_chunk_chapters = []
+            current_size = 0
+        
+        current_chunk_chapters.append(chapter)
+        current_size += chapter['chars']
+    
+    if current_chunk_chapters:
+        chunk_start = current_chunk_chapters[0]['start_pos']
+        chunk_end = current_chunk_chapters[-1]['end_pos']
+        chunks.append({
+            'id': len(chunks) + 1,
+            'chapters': [c['title'] for c in current_chunk_chapters],
+            'start_pos': chunk_start,
+            'end_pos': chunk_end,
+            'size': current_size,
+            'spans': [[chunk_start, chunk_end]]
+        })
+    
+    if chunks and prologue_size:
+        chunks[0]['spans'].insert(0, list(prologue_span))
+        chunks[0]['size'] += prologue_size + 2
+        chunks[0]['has_prologue'] = True
+        chunks[0]['prologue_size'] = prologue_size
+    
+    if chunks and epilogue_size:
+        chunks[-1]['spans'].append(list(epilogue_span))
+        chunks[-1]['size'] += epilogue_size + 2
+        chunks[-1]['has_epilogue'] = True
+        chunks[-1]['epilogue_size'] = epilogue_size
+    
+    return annotate_chunk_tokens(chunks, budget, content)
+
+
+def build_outline(md_index, start_pos=0, end_pos=None):
+    """从结构索引生成大纲（供预览接口使用)"""
+    if not md_index:
+        return []
+    if end_pos is None:
+        end_pos = md_index['total_len']
+    return [
+        {
+            'line': h['line'],
+            'level': h['level'],
+            'title': h['title'],
+            'start_pos': h['start_pos']
+        }
+        for h in md_index['headings']
+        if start_pos <= h['start_pos'] < end_pos
+    ]
+
+
+# ============ 模型管理函数 ============
+
+def get_model_info():
+    """获取当前模型配置信息"""
+    config = MODEL_CONFIGS[ACTIVE_MODEL]
+    return {
+        'active_model': ACTIVE_MODEL,
+        'model_name': config['name'],
+        'max_tokens': config['max_tokens'],
+        'context_window': config['context_window'],
+        'temperature': config['temperature'],
+        'cost_per_1k': config['cost_per_1k'],
+        'description': config['description'],
+        'speed': config['speed'],
+        'quality': config['quality'],
+        'fallback_chain': MODEL_FALLBACK_CHAIN,
+        'circuits': {key: circuit_breakers[key].snapshot() for key in MODEL_FALLBACK_CHAIN},
+        'rate_limits': {key: limiter.snapshot() for key, limiter in rate_limiters.items()},
+        'engine': async_engine.stats()
+    }
+
+
+def list_available_models():
+    """列出所有可用模型"""
+    return {
+        key: {
+            'name': config['name'],
+            'description': config['description'],
+            'cost': f"${config['cost_per_1k']:.4f}/1K chars",
+            'speed': config['speed'],
+            'quality': config['quality']
+        }
+        for key, config in MODEL_CONFIGS.items()
+    }
+
+
+# ============ 模型熔断与回退 ============
+
+class CircuitBreaker:
+    """单个模型的熔断器
+    
+    统计最近 window 次调用的失败率（出错或首 token 过慢都算失败)。
+    closed: 正常放行；open: 熔断，冷却期内拒绝；half_open: 冷却后只放行一次探测，
+    探测成功恢复 closed，失败重新 open。
+    """
+    def __init__(self, model_key, window=CIRCUIT_WINDOW):
+        self.model_key = model_key
+        self._lock = threading.Lock()
+        self._results = deque(maxlen=window)  # (是否成功, 首 token 延迟秒数或 None)
+        self.state = 'closed'
+        self.opened_at = 0.0
+        self._probe_started = None
+
+    def allow_request(self):
+        """当前是否可以把请求发给该模型"""
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            now = time.time()
+            if self.state == 'open':
+                if now - self.opened_at < CIRCUIT_COOLDOWN:
+                    return False
+                self.state = 'half_open'
+                self._probe_started = now
+                return True
+            # half_open：探测进行中则拒绝；探测卡住（超过冷却时间无结果)则重新放行
+            if self._probe_started is None or now - self._probe_started >= CIRCUIT_COOLDOWN:
+                self._probe_started = now
+                return True
+            return False
+
+    def record_success(self, latency=None):
+        """记录一次成功调用，latency 为首 token 延迟"""
+        slow = latency is not None and latency > CIRCUIT_SLOW_SECONDS
+        with self._lock:
+            if self.state == 'half_open' and not slow:
+                self.state = 'closed'
+                self._results.clear()
+                self._probe_started = None
+            self._results.append((not slow, latency))
+            self._update_state()
+
+    def record_failure(self):
+        """记录一次失败调用"""
+        with self._lock:
+            self._results.append((False, None))
+            if self.state == 'half_open':
+                self._open()
+            else:
+                self._update_state()
+
+    def reset(self):
+        with self._lock:
+            self._results.clear()
+            self.state = 'closed'
+            self._probe_started = None
+
+    def _update_state(self):
+        """（持有锁时调用)失败率达到阈值则熔断"""
+        if self.state == 'closed' and len(self._results) >= CIRCUIT_MIN_CALLS:
+            failures = sum(1 for ok, _ in self._results if not ok)
+            if failures / len(self._results) >= CIRCUIT_ERROR_RATE:
+                self._open()
+        elif self.state == 'half_open' and self._results and not self._results[-1][0]:
+            self._open()
+
+    def _open(self):
+        self.state = 'open'
+        self.opened_at = time.time()
+        self._probe_started = None
+        print(f"⚡ Circuit opened for model {self.model_key}")
+
+    def snapshot(self):
+        """熔断器状态（/api/model-info 返回)"""
+        with self._lock:
+            calls = len(self._results)
+            failures = sum(1 for ok, _ in self._results if not ok)
+            latencies = [lat for _, lat in self._results if lat is not None]
+            return {
+                'state': self.state,
+                'calls': calls,
+                'error_rate': round(failures / calls, 3) if calls else 0.0,
+                'avg_first_token_seconds': round(sum(latencies) / len(latencies), 2) if latencies else None
+            }
+
+
+circuit_breakers = {key: CircuitBreaker(key) for key in MODEL_CONFIGS}
+
+
+def select_model(exclude=()):
+    """按回退链选择第一个可用（未熔断)的模型
+    
+    exclude 中的模型（本块已被其拒绝)不参与选择。全部熔断时仍返回剩余的首选模型，
+    由重试退避控制请求频率。
+    """
+    candidates = [model_key for model_key in MODEL_FALLBACK_CHAIN if model_key not in exclude]
+    for model_key in candidates:
+        if circuit_breakers[model_key].allow_request():
+            return model_key
+    return candidates[0]
+
+
+# ============ 速率限制（令牌桶)============
+
+class RateLimiter:
+    """按分钟额度限速的令牌桶（请求数 + token 数)
+    
+    桶容量为一分钟的额度，按秒匀速补充。收到 429 时 penalize() 暂停发放，
+    直到 Retry-After 到期。
+    """
+    def __init__(self, name, rpm=None, tpm=None):
+        self.name = name
+        self.rpm = rpm
+        self.tpm = tpm
+        self._lock = threading.Lock()
+        self._requests = float(rpm or 0)
+        self._tokens = float(tpm or 0)
+        self._updated = time.time()
+        self.blocked_until = 0.0
+        self.throttled = 0  # 被 429 限流的次数
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        self._updated = now
+        if self.rpm:
+            self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60)
+        if self.tpm:
+            self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60)
+
+    def try_acquire(self, tokens=0):
+        """尝试占用一次请求和 tokens 个 token
+        
+        Returns:
+            float: 0 表示成功，否则为需要等待的秒数
+        """
+        with self._lock:
+            now = time.time()
+            self._refill(now)
+            if now < self.blocked_until:
+                return self.blocked_until - now
+            tokens = min(tokens, self.tpm) if self.tpm else 0  # 超过桶容量的请求按满桶处理
+            wait = 0.0
+            if self.rpm and self._requests < 1:
+                wait = max(wait, (1 - self._requests) * 60 / self.rpm)
+            if self.tpm and self._tokens < tokens:
+                wait = max(wait, (tokens - self._tokens) * 60 / self.tpm)
+            if wait > 0:
+                return wait
+            if self.rpm:
+                self._requests -= 1
+            if self.tpm:
+                self._tokens -= tokens
+            return 0.0
+
+    def acquire(self, tokens=0, cancel_event=None):
+        """阻塞直到获得额度，返回等待的秒数；cancel_event 置位时抛出 TranslationCancelled"""
+        start = time.time()
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait <= 0:
+                return time.time() - start
+            wait = min(wait, 5)  # 分段等待，及时响应取消和额度变化
+            if cancel_event is not None:
+                if cancel_event.wait(wait):
+                    raise TranslationCancelled(f"Cancelled while waiting for rate limit {self.name}")
+            else:
+                time.sleep(wait)
+
+    def penalize(self, retry_after=None):
+        """收到 429：在 retry_after 秒内暂停发放额度"""
+        with self._lock:
+            delay = retry_after if retry_after is not None else RATE_LIMIT_DEFAULT_BACKOFF
+            self.blocked_until = max(self.blocked_until, time.time() + delay)
+            self.throttled += 1
+
+    def snapshot(self):
+        with self._lock:
+            self._refill(time.time())
+            return {
+                'rpm': self.rpm,
+                'tpm': self.tpm,
+                'available_requests': int(self._requests) if self.rpm else None,
+                'available_tokens': int(self._tokens) if self.tpm else None,
+                'blocked_seconds': round(max(0.0, self.blocked_until - time.time()), 1),
+                'throttled': self.throttled
+            }
+
+
+rate_limiters = {
+    key: RateLimiter(key, limits.get('rpm'), limits.get('tpm'))
+    for key, limits in RATE_LIMITS.items()
+}
+
+
+def model_rate_limiters(model_key):
+    """一次调用需要占用的限速器：提供商总额度 + 模型额度"""
+    return [rate_limiters[key] for key in ('openrouter', model_key) if key in rate_limiters]
+
+
+def acquire_rate_limit(model_key, tokens, cancel_event=None):
+    """打开流之前占用提供商和模型的额度，返回总等待秒数"""
+    return sum(limiter.acquire(tokens, cancel_event) for limiter in model_rate_limiters(model_key))
+
+
+def retry_after_seconds(error):
+    """从 429 异常中读取 Retry-After（秒数或 HTTP 日期)，没有时返回 None"""
+    value = getattr(error, 'retry_after', None)
+    if value is None:
+        response = getattr(error, 'response', None)
+        headers = getattr(response, 'headers', None) or getattr(error, 'headers', None) or {}
+        try:
+            value = headers.get('retry-after') or headers.get('Retry-After')
+        except AttributeError:
+            value = None
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        from email.utils import parsedate_to_datetime
+        return max(0.0, parsedate_to_datetime(str(value)).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+# ============ 术语匹配（Aho-Corasick)============
+
+def _fold_char(ch):
+    """逐字符小写；小写后长度改变的字符（如 İ)保持原样，使匹配位置与原文一致"""
+    lower = ch.lower()
+    return lower if len(lower) == 1 else ch
+
+
+def _is_word_char(ch):
+    return ch.isalnum() or ch == '_'
+
+
+class TermMatcher:
+    """多模式术语自动机：构建一次，单次扫描找出文本中出现的全部术语
+    
+    不区分大小写，并按词边界匹配（术语首尾是字母数字时，前后不能紧接字母数字)，
+    例如 "AI" 不会匹配 "said"。重叠的术语都会报告（"deep learning" 与 "learning")。
+    """
+    
+    def __init__(self, terms):
+        self.terms = []          # 模式编号 → 原始术语（大小写不同的重复术语只保留第一个)
+        self._goto = [{}]        # 状态 → {字符: 下一状态}
+        self._fail = [0]
+        self._output = [-1]      # 状态 → 在此结束的模式编号
+        self._dict_link = [0]    # 状态 → 沿失败链最近的有输出状态（0 表示没有)
+        self._depth = [0]
+        
+        for term in terms:
+            folded = ''.join(_fold_char(ch) for ch in term.strip())
+            if not folded:
+                continue
+            state = 0
+            for ch in folded:
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append(-1)
+                    self._dict_link.append(0)
+                    self._depth.append(self._depth[state] + 1)
+                state = nxt
+            if self._output[state] == -1:
+                self._output[state] = len(self.terms)
+                self.terms.append(term.strip())
+        self._build_links()
+    
+    def _build_links(self):
+        """按层（BFS)计算失败链接和输出链接"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                link = self._fail[nxt]
+                self._dict_link[nxt] = link if self._output[link] != -1 else self._dict_link[link]
+                queue.append(nxt)
+    
+    def __len__(self):
+        return len(self.terms)
+    
+    def finditer(self, text):
+        """逐个产生命中 (start, end, 模式编号)，位置为原文字符偏移"""
+        goto, fail, output, dict_link, depth = self._goto, self._fail, self._output, self._dict_link, self._depth
+        terms = self.terms
+        state = 0
+        last = len(text)
+        for i, ch in enumerate(text):
+            ch = _fold_char(ch)
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            hit = state if output[state] != -1 else dict_link[state]
+            while hit:
+                start, end = i + 1 - depth[hit], i + 1
+                term = terms[output[hit]]
+                if ((start == 0 or not _is_word_char(term[0]) or not _is_word_char(text[start - 1]))
+                        and (end == last or not _is_word_char(term[-1]) or not _is_word_char(text[end]))):
+                    yield start, end, output[hit]
+                hit = dict_link[hit]
+    
+    def scan(self, text):
+        """单次扫描文本
+        
+        Returns:
+            dict: {术语: [起始位置, ...]}，按首次出现的顺序
+        """
+        hits = {}
+        for start, _, index in self.finditer(text):
+            hits.setdefault(self.terms[index], []).append(start)
+        return hits
+    
+    def counts(self, text):
+        """{术语: 出现次数}"""
+        return {term: len(positions) for term, positions in self.scan(text).items()}
+
+
+_term_matchers = OrderedDict()
+_term_matchers_lock = threading.Lock()
+
+
+def get_term_matcher(terms):
+    """按术语表版本（内容哈希)缓存自动机，术语表不变时不重复构建"""
+    terms = tuple(terms)
+    version = hashlib.sha1('\x00'.join(terms).encode('utf-8')).hexdigest()
+    with _term_matchers_lock:
+        matcher = _term_matchers.get(version)
+        if matcher is not None:
+            _term_matchers.move_to_end(version)
+            return matcher
+    
+    matcher = TermMatcher(terms)
+    with _term_matchers_lock:
+        _term_matchers[version] = matcher
+        while len(_term_matchers) > TERM_MATCHER_CACHE_SIZE:
+            _term_matchers.popitem(last=False)
+    return matcher
+
+
+def select_chunk_terms(terminology, chunk_content, token_budget=TERM_PROMPT_TOKEN_BUDGET):
+    """选出本块原文中出现的术语：按出现次数排序（相同时按首次出现位置)，累计不超过 token 预算"""
+    if not terminology:
+        return []
+    hits = get_term_matcher(terminology).scan(chunk_content)
+    ranked = sorted(hits.items(), key=lambda item: (-len(item[1]), item[1][0]))
+    selected = []
+    used = 0
+    for term, _ in ranked:
+        cost = estimate_tokens(term) + 1  # 含分隔符
+        if used + cost > token_budget:
+            continue
+        selected.append(term)
+        used += cost
+    return selected
+
+
+# 译文中的术语标注："译名 (English term)" 或全角括号
+TERM_ANNOTATION_RE = re.compile(r'[(（]\s*([A-Za-z][^()（）\n]{0,80}?)\s*[)）]')
+RENDERING_CJK_TAIL_RE = re.compile(CJK_CHAR_RE.pattern + '+$')
+
+
+def annotated_rendering(prefix):
+    """术语标注前面的整段文字（遇到标点或文字种类变化为止)，没有时返回空串
+    
+    CJK 译文取括号前连续的文字（最多 GLOSSARY_MAX_RENDERING_CHARS 个字)，空格分词的译文
+    取最后几个词（小写)。
+    """
+    prefix = prefix.rstrip()
+    if not prefix:
+        return ""
+    if CJK_CHAR_RE.match(prefix[-1]):
+        return RENDERING_CJK_TAIL_RE.search(prefix).group()[-GLOSSARY_MAX_RENDERING_CHARS:]
+    
+    words = []
+    for raw in reversed(prefix.split()[-GLOSSARY_MAX_RENDERING_WORDS:]):
+        word = raw.strip('.,;:!?"“”«»')
+        if not word or CJK_CHAR_RE.search(word) or (words and raw[-1] in '.,;:!?'):
+            break  # 不跨越句子、分句或文字种类
+        words.insert(0, word)
+        if raw[0] in '"“«':
+            break
+    return ' '.join(words).lower()
+
+
+RENDERING_ELISION_RE = re.compile(r"^(?:l|d|qu|j|n|s|c|m|t|dell|all|dall|nell|sull|un)['’](?=\w)")
+
+
+def strip_leading_words(words):
+    """去掉译名开头的冠词、介词、代词和省音冠词（"l'apprentissage" → "apprentissage")"""
+    words = list(words)
+    while words and words[0] in GLOSSARY_LEADING_WORDS:
+        words.pop(0)
+    if words:
+        words[0] = RENDERING_ELISION_RE.sub('', words[0])
+    return words
+
+
+def rendering_suffixes(run):
+    """标注前文字的后缀，即可能的译名：CJK 按字（至少 2 个字)，其他按词（去掉开头的冠词等)"""
+    if CJK_CHAR_RE.match(run[-1]):
+        return [run[-n:] for n in range(min(2, len(run)), len(run) + 1)]
+    words = run.split()
+    suffixes = []
+    for n in range(1, len(words) + 1):
+        suffix = ' '.join(strip_leading_words(words[-n:]))
+        if suffix and suffix not in suffixes:
+            suffixes.append(suffix)
+    return suffixes
+
+
+class BilingualGlossary:
+    """任务级双语术语表：从译文学习术语的目标语言译名，检查各块译名是否一致
+    
+    提示词要求术语首次出现时写成 "译名 (English term)"。每块完成后取每个术语第一处标注前的
+    整段文字（"我们必须实现遏制（containment）" 取 "我们必须实现遏制")，按块累计。
+    这段文字的某个后缀在至少 GLOSSARY_MIN_SUPPORT 个块的标注中出现时算确认，取块数最多、
+    其次最长的后缀（另一块写成 "遏制（containment）" 时确认 "遏制")，写入后续块的提示词。
+    空格分词的译文先去掉开头的冠词、代词等，再取块数最多的候选中最短、词数不少于术语的一个。
+    只统计标注处的文字，未标注的出现不计数；一致性检查只做字符串查找，不额外调用模型。
+    """
+    
+    def __init__(self, language, renderings=None):
+        self.language = language
+        self._renderings = {term: dict(counts) for term, counts in (renderings or {}).items()}  # 术语 → {标注前文字: 块数}
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['language'], data.get('renderings'))
+    
+    def to_dict(self):
+        with self._lock:
+            return {
+                'language': self.language,
+                'renderings': {term: dict(counts) for term, counts in self._renderings.items()}
+            }
+    
+    def _confirmed(self, term):
+        counts = self._renderings.get(term)
+        if not counts:
+            return None
+        support = {}
+        for run, chunks in counts.items():
+            for rendering in rendering_suffixes(run):
+                support[rendering] = support.get(rendering, 0) + chunks
+        if CJK_CHAR_RE.match(next(iter(support))[-1]):
+            rendering, chunks = max(support.items(), key=lambda item: (item[1], len(item[0])))
+        else:
+            # 空格分词：取支持最多的候选中最短的，但词数不少于术语本身（避免只剩 "automatique")
+            min_words = len(term.split())
+            candidates = [item for item in support.items() if len(item[0].split()) >= min_words] or list(support.items())
+            rendering, chunks = max(candidates, key=lambda item: (item[1], -len(item[0].split())))
+        return rendering if chunks >= GLOSSARY_MIN_SUPPORT else None
+    
+    def confirmed(self, terms=None):
+        """已确认的译名 {术语: 译名}（terms 为 None 时返回全部)"""
+        with self._lock:
+            pairs = {}
+            for term in (self._renderings if terms is None else terms):
+                rendering = self._confirmed(term)
+                if rendering:
+                    pairs[term] = rendering
+            return pairs
+    
+    def learn(self, source_text, translation, terminology):
+        """从一块的原文和译文中学习译名（每块调用一次，每个术语只取第一处标注)
+        
+        Returns:
+            dict: 本块新确认的 {术语: 译名}
+        """
+        present = get_term_matcher(terminology).counts(source_text)
+        if not present:
+            return {}
+        by_folded = {term.casefold(): term for term in present}
+        annotated = {}
+        for match in TERM_ANNOTATION_RE.finditer(translation):
+            term = by_folded.get(match.group(1).strip().casefold())
+            run = annotated_rendering(translation[:match.start()]) if term and term not in annotated else ""
+            if run:
+                annotated[term] = run
+        
+        newly_confirmed = {}
+        with self._lock:
+            for term, run in annotated.items():
+                counts = self._renderings.setdefault(term, {})
+                before = self._confirmed(term)
+                counts[run] = counts.get(run, 0) + 1
+                after = self._confirmed(term)
+                if after and after != before:
+                    newly_confirmed[term] = after
+        return newly_confirmed
+    
+    def check(self, chunk_id, source_text, translation, terminology):
+        """一致性检查：原文出现了已确认的术语，但译文没有使用确认的译名（不区分大小写)
+        
+        Returns:
+            list: [{'chunk_id', 'term', 'expected', 'found'}]，found 为译文中出现的其他已知译名
+        """
+        issues = []
+        present = get_term_matcher(terminology).counts(source_text)
+        text = translation.lower()
+        with self._lock:
+            for term in present:
+                expected = self._confirmed(term)
+                if not expected or expected in text:
+                    continue
+                found = [r for r in self._renderings[term] if r != expected and r in text]
+                issues.append({'chunk_id': chunk_id, 'term': term, 'expected': expected, 'found': found})
+        return issues
+
+
+def load_terminology_db():
+    """加载精选术语数据库"""
+    term_file = Path(__file__).parent / 'terminology_curated.json'
+    
+    if term_file.exists():
+        with open(term_file, 'r', encoding='utf-8') as f:
+            terminology = json.load(f)
+        
+        all_terms = []
+        for category, terms in terminology.items():
+            all_terms.extend(terms)
+        
+        return all_terms
+    return None
+
+
+# 动态提取时检测的常见技术词汇
+TECH_KEYWORDS = [
+    'AI', 'ML', 'API', 'GPU', 'CPU', 'DNA', 'RNA', 'AGI',
+    'artificial intelligence', 'machine learning', 'deep learning',
+    'neural network', 'algorithm', 'model', 'dataset', 'training',
+    'inference', 'transformer', 'attention', 'backpropagation',
+    'reinforcement learning', 'supervised learning', 'unsupervised learning',
+    'natural language processing', 'computer vision', 'robotics',
+    'blockchain', 'cryptocurrency', 'quantum computing',
+    'biotechnology', 'synthetic biology', 'gene editing', 'CRISPR'
+]
+
+
+def extract_terminology_from_chunk(translation_text, source_text):
+    """从翻译块中提取新术语（动态提取)"""
+    import re
+    
+    # 1. 提取专有名词（大写开头的词组)
+    proper_nouns = re.findall(r'\b[A-Z][A-Za-z]+(?:\s+[A-Z][A-Za-z]+){0,3}\b', source_text)
+    
+    # 过滤常见词
+    common_words = {
+        'The', 'This', 'That', 'These', 'Those', 'Chapter', 'Part', 'Section',
+        'And', 'But', 'For', 'With', 'When', 'Where', 'Which', 'What', 'How',
+        'Figure', 'Table', 'Some', 'Many', 'Most', 'All', 'Each', 'Every',
+        'First', 'Second', 'Third', 'Last', 'Next', 'Previous', 'Introduction',
+        'Conclusion', 'Summary', 'Overview', 'Today', 'Tomorrow', 'Yesterday'
+    }
+    proper_nouns = [t for t in set(proper_nouns) if t not in common_words and len(t) > 2]
+    
+    # 2. 检测技术术语（常见技术词汇在源文本中出现，自动机单次扫描)
+    found_tech = list(get_term_matcher(TECH_KEYWORDS).scan(source_text))
+    
+    # 合并并去重
+    extracted_terms = list(set(proper_nouns + found_tech))
+    
+    return extracted_terms
+
+
+def get_context_from_previous(prev_translation):
+    """从前一块翻译末尾提取上下文"""
+    if not prev_translation:
+        return ""
+    
+    paragraphs = [p.strip() for p in prev_translation.split('\n\n') if p.strip()]
+    context_paras = paragraphs[-CONTEXT_PARAGRAPHS:] if len(paragraphs) >= CONTEXT_PARAGRAPHS else paragraphs
+    context = '\n\n'.join(context_paras)
+    
+    return context
+
+
+class TranslationCancelled(Exception):
+    """任务已取消（其他块失败），当前块提前结束"""
+
+
+def is_retryable_error(error):
+    """判断 LLM 调用异常是否值得重试
+    
+    有 HTTP 状态码时按状态码判断（429、5xx 等可重试；鉴权失败、请求过长等
+    其他 4xx 为致命错误)，否则按异常类型判断网络/超时类错误。
+    """
+    if isinstance(error, TranslationCancelled):
+        return False
+    status = getattr(error, 'status_code', None)
+    if isinstance(status, int):
+        return status in RETRYABLE_STATUS_CODES
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    return type(error).__name__ in RETRYABLE_ERROR_NAMES
+
+
+def is_model_specific_error(error):
+    """判断不可重试的异常是否只针对当前模型（换回退链中的下一个模型可能成功)
+    
+    模型不存在（404)、额度或价格限制（402)、超出该模型上下文窗口或输出上限（413、
+    ContextWindowExceededError、提示匹配 CONTEXT_LIMIT_ERROR_RE 的 400)属于此类；
+    鉴权失败（401/403)、其他请求错误、任务取消等对所有模型都一样的错误不属于。
+    """
+    if isinstance(error, TranslationCancelled):
+        return False
+    if type(error).__name__ in MODEL_SPECIFIC_ERROR_NAMES:
+        return True
+    status = getattr(error, 'status_code', None)
+    if status == 400:
+        return CONTEXT_LIMIT_ERROR_RE.search(str(error)) is not None
+    return status in MODEL_SPECIFIC_STATUS_CODES
+
+
+def retry_delay(attempt):
+    """第 attempt 次失败后的等待秒数：指数退避，带 50% 随机抖动（避免多块同时重试)"""
+    delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** (attempt - 1)))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def recoverable_prefix(text):
+    """断流后可保留的译文：截到最后一个完整段落，过短则放弃续写"""
+    if len(text) < RETRY_MIN_RECOVER_CHARS:
+        return ""
+    cut = text.rfind('\n\n')
+    if cut < RETRY_MIN_RECOVER_CHARS:
+        return ""
+    return text[:cut + 2]
+
+
+def join_continuation(partial, parts):
+    """拼接续写前的译文和本次收到的片段"""
+    text = ''.join(parts)
+    return partial + text.lstrip() if partial else text
+
+
+def build_continuation_messages(messages, partial):
+    """续写请求：把已收到的译文作为 assistant 消息，要求模型从下一段继续"""
+    return messages + [
+        {"role": "assistant", "content": partial},
+        {"role": "user", "content": (
+            "The response was interrupted. Continue the translation exactly where it stopped, "
+            "starting from the next paragraph. Do not repeat text that was already translated "
+            "and do not add any commentary."
+        )}
+    ]
+
+
+def build_chunk_messages(chunk_id, total_chunks, chunk_content, language, prev_context="",
+                         terminology=None, context_is_source=False, renderings=None):
+    """构造单块翻译的 system / user 消息
+    
+    terminology 为已按本块选出的术语，renderings 为其中已确认的译名 {术语: 译名}。
+    """
+    system_prompt = f"""You are a professional book translator. Translate the following book excerpt from English to {language}.
+
+CRITICAL REQUIREMENTS:
+1. **Preserve ALL markdown formatting**: headers (#, ##, ###), lists, quotes (>), code blocks, links
+2. **Maintain structure**: Keep all chapters, sections, paragraphs exactly as structured
+3. **Preserve names**: Keep all person names, company names, book titles in original English
+4. **Technical terms**: Translate technical terms accurately, add English in parentheses for first occurrence if needed
+5. **Natural language**: Use native {language} expression, not word-by-word translation
+6. **Completeness**: Translate EVERY sentence, don't skip any content
+7. **Consistency**: Maintain consistent terminology throughout the book
+
+CONTEXT: This is chunk {chunk_id}/{total_chunks} of the complete book.
+"""
+    
+    context_info = ""
+    if prev_context and context_is_source:
+        context_info = f"""
+<previous_context>
+For continuity, here are the last paragraphs of the previous chunk in the original English (its translation is not available yet, do NOT translate them again):
+{prev_context}
+</previous_context>
+"""
+    elif prev_context:
+        context_info = f"""
+<previous_context>
+For continuity, here are the last paragraphs from the previous chunk:
+{prev_context}
+</previous_context>
+"""
+    
+    term_info = ""
     if terminology:
+        renderings = renderings or {}
+        terms = [f"{term} → {renderings[term]}" if term in renderings else term for term in terminology]
+        established = (
+            "\nTerms marked with → already have an established translation in this book; use it exactly."
+            if renderings else ""
+        )
         term_info = f"""
 <key_terminology>
-Important terms to maintain consistency:
-{', '.join(terminology[:25])}
+Important terms in this section (keep their translations consistent):
+{', '.join(terms)}{established}
 </key_terminology>
 """
     
     user_prompt = f"""{context_info}{term_info}
 
-Now translate this section to {language}:
+Now translate this section to {language}:
+
+---BEGIN CONTENT---
+
+{chunk_content}
+
+---END CONTENT---"""
+
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+
+
+class ChunkAttempts:
+    """单块翻译的尝试状态：选模型、失败重试、断流续写（线程和 asyncio 引擎共用)"""
+    
+    def __init__(self, task, chunk_id, messages, expected_chars, output_tokens):
+        self.task = task
+        self.chunk_id = chunk_id
+        self.messages = messages
+        self.expected_chars = expected_chars
+        self.output_tokens = output_tokens
+        self.start_time = time.time()
+        self.partial = ""  # 断流前已收到、可续写的译文
+        self.parts = []
+        self.attempt = 0
+        self.model_key = None
+        self.breaker = None
+        self.rejected_models = set()  # 本块因模型相关错误放弃的模型
+    
+    def next_attempt(self):
+        """开始下一次尝试：选择模型，返回本次请求的消息"""
+        self.attempt += 1
+        self.parts = []
+        if self.partial:
+            self.task.record_metric('recovered_chars', len(self.partial))
+        self.model_key = select_model(self.rejected_models)
+        if self.model_key != ACTIVE_MODEL:
+            self.task.emit_log(f"🔀 Chunk {self.chunk_id}: {ACTIVE_MODEL} unavailable, routing to {self.model_key}", 'warning')
+        self.breaker = circuit_breakers[self.model_key]
+        return build_continuation_messages(self.messages, self.partial) if self.partial else self.messages
+    
+    def succeeded(self, first_token_latency):
+        """本次尝试成功，返回完整译文"""
+        self.breaker.record_success(first_token_latency)
+        return join_continuation(self.partial, self.parts)
+    
+    def failed(self, error):
+        """本次尝试失败：不可重试或次数用完时抛出原异常，否则返回重试前的等待秒数
+        
+        只针对当前模型的错误不重试该模型，立即改用回退链中的下一个模型。
+        """
+        task, chunk_id = self.task, self.chunk_id
+        if not is_retryable_error(error):
+            if is_model_specific_error(error):
+                self.rejected_models.add(self.model_key)
+            if (self.model_key not in self.rejected_models or self.attempt >= CHUNK_MAX_ATTEMPTS
+                    or self.rejected_models.issuperset(MODEL_FALLBACK_CHAIN)):
+                task.record_metric('fatal_errors')
+                raise error
+            task.record_metric('model_errors')
+            self.partial = recoverable_prefix(join_continuation(self.partial, self.parts))
+            task.emit_log(f"↪️  Chunk {chunk_id}: {self.model_key} rejected the request "
+                          f"({type(error).__name__}: {error}), switching to the next model", 'warning')
+            return 0
+        self.breaker.record_failure()
+        task.record_metric('retryable_errors')
+        retry_after = None
+        if getattr(error, 'status_code', None) == 429:
+            # 限流：暂停该模型和提供商的额度，所有任务一起等待
+            retry_after = retry_after_seconds(error)
+            for limiter in model_rate_limiters(self.model_key):
+                limiter.penalize(retry_after)
+            task.record_metric('rate_limited')
+        if self.attempt >= CHUNK_MAX_ATTEMPTS:
+            task.emit_log(f"🛑 Chunk {chunk_id}: giving up after {self.attempt} attempts", 'error')
+            raise error
+        
+        self.partial = recoverable_prefix(join_continuation(self.partial, self.parts))
+        delay = max(retry_delay(self.attempt), retry_after or 0)
+        task.record_metric('retries')
+        resume_note = f", resuming after {len(self.partial):,} characters" if self.partial else ""
+        task.emit_log(f"🔁 Chunk {chunk_id}: attempt {self.attempt}/{CHUNK_MAX_ATTEMPTS} on {self.model_key} failed "
+                      f"({type(error).__name__}: {error}), retrying in {delay:.1f}s{resume_note}", 'warning')
+        return delay
+
+
+def prepare_chunk(task, chunk_id, total_chunks, chunk_content, language, prev_context="",
+                  terminology=None, context_is_source=False):
+    """记录开始日志并查翻译记忆
+    
+    Returns:
+        tuple: (命中的译文, None) 或 (None, ChunkAttempts)
+    """
+    task.emit_log(f"━━━━━━━━━━━━━━━━━━━━━━━━━━━━", 'info')
+    task.emit_log(f"🔄 Starting chunk {chunk_id}/{total_chunks}", 'info')
+    task.emit_log(f"📝 Input size: {len(chunk_content):,} characters", 'info')
+    
+    # Demo 优化：快速显示开始信息
+    if DEMO_MODE:
+        task.emit_log(f"⚡ Demo mode: Using small chunks for quick demonstration", 'info')
+    
+    # 翻译记忆：原文、语言、模型、提示词版本完全相同时直接复用（回退链上的模型一次查完，按顺序取第一个)
+    if translation_memory is not None:
+        models = {TranslationMemory.make_key(chunk_content, language, MODEL_CONFIGS[key]['name']): MODEL_CONFIGS[key]['name']
+                  for key in MODEL_FALLBACK_CHAIN}
+        found = translation_memory.lookup(models)
+        if found is not None:
+            cache_key, cached = found
+            task.record_chunk_model(chunk_id, models[cache_key])
+            task.update_chunk_progress(chunk_id, 100)
+            task.emit_log(f"♻️  Chunk {chunk_id}: translation memory hit, {len(cached):,} characters (no API call)", 'success')
+            return cached, None
+    
+    # 只把本块出现的术语放进提示词
+    chunk_terms = select_chunk_terms(terminology, chunk_content)
+    renderings = task.glossary.confirmed(chunk_terms) if task.glossary is not None else {}
+    if terminology:
+        task.emit_log(f"📚 Using {len(chunk_terms)}/{len(terminology)} terms found in this chunk"
+                      f" ({len(renderings)} with established translations)", 'info')
+    
+    messages = build_chunk_messages(chunk_id, total_chunks, chunk_content, language,
+                                    prev_context, chunk_terms, context_is_source, renderings)
+    expected_chars = len(chunk_content) * 1.5
+    output_tokens = int(estimate_tokens(chunk_content) * TARGET_TOKEN_RATIOS.get(language, DEFAULT_TARGET_TOKEN_RATIO))
+    return None, ChunkAttempts(task, chunk_id, messages, expected_chars, output_tokens)
+
+
+def finish_chunk(task, chunk_id, chunk_content, language, attempts, translated_text):
+    """块翻译成功：记录实际模型、写入翻译记忆、输出完成日志"""
+    model_name = MODEL_CONFIGS[attempts.model_key]['name']
+    task.record_chunk_model(chunk_id, model_name)
+    if attempts.model_key != ACTIVE_MODEL:
+        task.record_metric('fallback_chunks')
+    
+    elapsed = time.time() - attempts.start_time
+    speed = len(translated_text) / elapsed if elapsed > 0 else 0
+    
+    if translation_memory is not None and translated_text.strip():
+        translation_memory.put(TranslationMemory.make_key(chunk_content, language, model_name),
+                               translated_text, model_name, language)
+    
+    task.update_chunk_progress(chunk_id, 100)
+    retry_note = f", {attempts.attempt} attempts" if attempts.attempt > 1 else ""
+    task.emit_log(f"✅ Chunk {chunk_id} completed: {len(translated_text):,} characters ({speed:.0f} c/s, {elapsed:.0f}s{retry_note})", 'success')
+    return translated_text
+
+
+def translate_chunk_web(task, chunk_id, total_chunks, chunk_content, language, 
+                        prev_context="", terminology=None, context_is_source=False):
+    """Web版翻译单块（带实时日志，在调用线程中同步流式接收)
+    
+    Args:
+        context_is_source: prev_context 是否为上一块的原文（并发翻译时上一块译文尚未完成）
+    """
+    cached, attempts = prepare_chunk(task, chunk_id, total_chunks, chunk_content, language,
+                                     prev_context, terminology, context_is_source)
+    if cached is not None:
+        return cached
+    
+    try:
+        while True:
+            request_messages = attempts.next_attempt()
+            try:
+                first_token_latency = stream_chunk_translation(
+                    task, chunk_id, attempts.model_key, request_messages, attempts.parts,
+                    received_chars=len(attempts.partial), expected_chars=attempts.expected_chars,
+                    output_tokens=attempts.output_tokens
+                )
+                translated_text = attempts.succeeded(first_token_latency)
+                break
+            except TranslationCancelled:
+                raise
+            except Exception as e:
+                delay = attempts.failed(e)
+                if task.cancel_event.wait(delay):
+                    raise TranslationCancelled(f"Chunk {chunk_id} cancelled")
+        
+        return finish_chunk(task, chunk_id, chunk_content, language, attempts, translated_text)
+        
+    except TranslationCancelled:
+        task.emit_log(f"⏹️  Chunk {chunk_id} stopped", 'warning')
+        raise
+    except Exception as e:
+        task.emit_log(f"❌ Chunk {chunk_id} translation failed: {str(e)}", 'error')
+        raise
+
+
+def completion_request(model_key, messages):
+    """completion / acompletion 的流式请求参数
+    
+    max_tokens 不超过模型上下文窗口扣除本次输入后的剩余（回退模型的 max_tokens 可能等于整个窗口)。
+    """
+    config = MODEL_CONFIGS[model_key]
+    available = config['context_window'] - request_tokens(messages) - REQUEST_TOKEN_MARGIN
+    return {
+        'model': f"openrouter/{config['name']}",
+        'messages': messages,
+        'api_key': OPENROUTER_API_KEY,
+        'max_tokens': max(1, min(config['max_tokens'], available)),
+        'temperature': config['temperature'],
+        'timeout': TIMEOUT,
+        'stream': True,
+        'extra_headers': {
+            "HTTP-Referer": "https://github.com/Polly2014",
+            "X-Title": "Master Translator Web"
+        }
+    }
+
+
+def request_tokens(messages, output_tokens=0):
+    """估算一次请求占用的 token（输入 + 预计输出)，用于 tpm 限速"""
+    return sum(estimate_tokens(m['content']) for m in messages) + output_tokens
+
+
+def note_rate_limit_wait(task, chunk_id, model_key, waited):
+    if waited >= 1:
+        task.record_metric('rate_limit_wait_seconds', round(waited, 1))
+        task.emit_log(f"⏳ Chunk {chunk_id}: waited {waited:.0f}s for {model_key} rate limit", 'info')
+
+
+class StreamProgress:
+    """流式接收一块译文：收集片段，按时间或新增字符数节流更新进度（推送本身由 task.events 异步合并)"""
+    
+    def __init__(self, task, chunk_id, parts, received_chars=0, expected_chars=0):
+        self.task = task
+        self.chunk_id = chunk_id
+        self.parts = parts
+        self.received_chars = received_chars
+        self.expected_chars = expected_chars
+        self.update_interval = 1 if DEMO_MODE else 5
+        self.chars_threshold = 2000 if DEMO_MODE else 10000
+        self.start_time = time.time()
+        self.last_update = self.start_time
+        self.first_token_latency = None
+        self.stream_chars = 0
+        self.last_reported_chars = 0
+    
+    def add(self, chunk):
+        """处理一个流式响应块（任务已取消时抛出 TranslationCancelled)"""
+        task, chunk_id = self.task, self.chunk_id
+        if task.cancel_event.is_set():
+            raise TranslationCancelled(f"Chunk {chunk_id} cancelled")
+        if not (hasattr(chunk, 'choices') and len(chunk.choices) > 0):
+            return
+        delta = chunk.choices[0].delta
+        if not (hasattr(delta, 'content') and delta.content):
+            return
+        if self.first_token_latency is None:
+            self.first_token_latency = time.time() - self.start_time
+        self.parts.append(delta.content)
+        self.stream_chars += len(delta.content)
+        
+        now = time.time()
+        if now - self.last_update > self.update_interval or self.stream_chars - self.last_reported_chars >= self.chars_threshold:
+            elapsed = now - self.start_time
+            speed = self.stream_chars / elapsed if elapsed > 0 else 0
+            total_chars = self.received_chars + self.stream_chars
+            chunk_progress = min(95, int(total_chars / self.expected_chars * 100)) if self.expected_chars else 95
+            
+            task.update_chunk_progress(chunk_id, chunk_progress)
+            # 使用 update_last=True 按分块更新进度消息而不是追加
+            task.emit_log(f"📥 Chunk {chunk_id}: receiving translation... {total_chars:,} characters ({speed:.0f} c/s)", 'progress',
+                          update_last=True, update_key=f"chunk-{chunk_id}")
+            self.last_update = now
+            self.last_reported_chars = self.stream_chars
+    
+    def latency(self):
+        """首个 token 的延迟秒数（未收到内容时为总耗时)"""
+        return self.first_token_latency if self.first_token_latency is not None else time.time() - self.start_time
+
+
+def stream_chunk_translation(task, chunk_id, model_key, messages, parts, received_chars=0, expected_chars=0,
+                             output_tokens=0):
+    """用指定模型流式翻译，译文片段追加到 parts
+    
+    出错时异常直接抛出，parts 中保留已收到的部分供续写。
+    
+    Args:
+        model_key: MODEL_CONFIGS 中的模型（决定模型名、max_tokens、temperature)
+        received_chars: 之前尝试已收到的字符数（续写时用于进度显示)
+        expected_chars: 预计译文长度（用于估算块进度)
+        output_tokens: 预计输出 token 数（计入 tpm 限速)
+        
+    Returns:
+        float: 首个 token 的延迟秒数（未收到内容时为总耗时)
+    """
+    # 限速：额度不足时等待
+    waited = acquire_rate_limit(model_key, request_tokens(messages, output_tokens), task.cancel_event)
+    note_rate_limit_wait(task, chunk_id, model_key, waited)
+    
+    task.record_metric('api_calls')
+    progress = StreamProgress(task, chunk_id, parts, received_chars, expected_chars)
+    response = completion(**completion_request(model_key, messages))
+    for chunk in response:
+        progress.add(chunk)
+    
+    return progress.latency()
+
+
+# ============ asyncio 翻译引擎 ============
+
+class StreamTimeout(TimeoutError):
+    """流式响应超过 STREAM_IDLE_TIMEOUT 没有新内容（可重试)"""
+
+
+class AsyncTranslationEngine:
+    """在一个事件循环线程中运行所有块的流式请求（acompletion)
+    
+    协程通过 submit() 提交，返回 concurrent.futures.Future，调度代码可以像线程池一样
+    wait() 等待结果；取消 Future 会取消对应协程（关闭流)。
+    """
+    
+    def __init__(self, max_streams=ASYNC_MAX_STREAMS):
+        self.max_streams = max_streams
+        self.active_streams = 0
+        self.peak_streams = 0
+        self._loop = None
+        self._thread = None
+        self._semaphore = None
+        self._lock = threading.Lock()
+    
+    def _ensure_loop(self):
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                # asyncio.to_thread 使用的线程池：数量固定，不随在途块数增长
+                loop.set_default_executor(ThreadPoolExecutor(max_workers=ASYNC_BLOCKING_WORKERS,
+                                                             thread_name_prefix='translation-io'))
+                self._semaphore = asyncio.Semaphore(self.max_streams)
+                self._thread = threading.Thread(target=loop.run_forever, name='translation-event-loop', daemon=True)
+                self._thread.start()
+                self._loop = loop
+            return self._loop
+    
+    def submit(self, coro):
+        """在事件循环中运行协程，返回 concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_loop())
+    
+    def run(self, coro, timeout=None):
+        """在事件循环中运行协程并阻塞等待结果（供同步代码调用)"""
+        return self.submit(coro).result(timeout)
+    
+    @contextlib.asynccontextmanager
+    async def stream_slot(self):
+        """占用一个流名额（所有任务共享 max_streams 个)"""
+        async with self._semaphore:
+            self.active_streams += 1
+            self.peak_streams = max(self.peak_streams, self.active_streams)
+            try:
+                yield
+            finally:
+                self.active_streams -= 1
+    
+    def stats(self):
+        return {
+            'engine': TRANSLATION_ENGINE,
+            'running': self._thread is not None and self._thread.is_alive(),
+            'active_streams': self.active_streams,
+            'peak_streams': self.peak_streams,
+            'max_streams': self.max_streams
+        }
+
 
----BEGIN CONTENT---
+async_engine = AsyncTranslationEngine()
 
-{chunk_content}
 
----END CONTENT---"""
+async def wait_cancelled(cancel_event, delay):
+    """协程版 cancel_event.wait(delay)：按小段休眠，期间任务取消时返回 True"""
+    deadline = time.time() + delay
+    while not cancel_event.is_set():
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return False
+        await asyncio.sleep(min(remaining, 0.5))
+    return True
+
+
+async def acquire_rate_limit_async(model_key, tokens, cancel_event=None):
+    """acquire_rate_limit 的协程版：等待额度时让出事件循环"""
+    start = time.time()
+    for limiter in model_rate_limiters(model_key):
+        while True:
+            wait_seconds = limiter.try_acquire(tokens)
+            if wait_seconds <= 0:
+                break
+            if cancel_event is not None and await wait_cancelled(cancel_event, min(wait_seconds, 5)):
+                raise TranslationCancelled(f"Cancelled while waiting for rate limit {limiter.name}")
+            if cancel_event is None:
+                await asyncio.sleep(min(wait_seconds, 5))
+    return time.time() - start
+
 
+async def astream_chunk_translation(task, chunk_id, model_key, messages, parts, received_chars=0,
+                                    expected_chars=0, output_tokens=0):
+    """stream_chunk_translation 的协程版（acompletion)
+    
+    打开流和每次等待新内容最多 STREAM_IDLE_TIMEOUT 秒，超时抛出 StreamTimeout。
+    """
+    waited = await acquire_rate_limit_async(model_key, request_tokens(messages, output_tokens), task.cancel_event)
+    note_rate_limit_wait(task, chunk_id, model_key, waited)
+    
+    async with async_engine.stream_slot():
+        task.record_metric('api_calls')
+        progress = StreamProgress(task, chunk_id, parts, received_chars, expected_chars)
+        try:
+            response = await asyncio.wait_for(acompletion(**completion_request(model_key, messages)),
+                                              STREAM_IDLE_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise StreamTimeout(f"Chunk {chunk_id}: no response from {model_key} in {STREAM_IDLE_TIMEOUT}s")
+        
+        stream = response.__aiter__()
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(stream.__anext__(), STREAM_IDLE_TIMEOUT)
+                except StopAsyncIteration:
+                    break
+                except asyncio.TimeoutError:
+                    raise StreamTimeout(f"Chunk {chunk_id}: stream from {model_key} idle for {STREAM_IDLE_TIMEOUT}s")
+                progress.add(chunk)
+        finally:
+            close = getattr(stream, 'aclose', None)
+            if close is not None:
+                try:
+                    await close()
+                except Exception:
+                    pass
+    
+    return progress.latency()
+
+
+async def atranslate_chunk_web(task, chunk_id, total_chunks, chunk_content, language,
+                               prev_context="", terminology=None, context_is_source=False):
+    """translate_chunk_web 的协程版（在 async_engine 的事件循环中运行)
+    
+    参数、返回值、日志和重试行为与 translate_chunk_web 相同；重试等待和限速等待都不占用线程，
+    任务取消时在下一个响应块或下一次休眠时退出。翻译记忆读写（SQLite)和术语扫描在默认线程池中执行，
+    不阻塞事件循环上的其他流。
+    """
+    cached, attempts = await asyncio.to_thread(prepare_chunk, task, chunk_id, total_chunks, chunk_content,
+                                               language, prev_context, terminology, context_is_source)
+    if cached is not None:
+        return cached
+    
     try:
-        start_time = time.time()
-        translated_text = ""
-        last_update = start_time
-        
-        response = completion(
-            model=f"openrouter/{MODEL}",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            api_key=OPENROUTER_API_KEY,
-            max_tokens=MAX_TOKENS,
-            temperature=TEMPERATURE,
-            timeout=TIMEOUT,
-            stream=True,
-            extra_headers={
-                "HTTP-Referer": "https://github.com/Polly2014",
-                "X-Title": "Master Translator Web"
-            }
-        )
+        while True:
+            request_messages = attempts.next_attempt()
+            try:
+                first_token_latency = await astream_chunk_translation(
+                    task, chunk_id, attempts.model_key, request_messages, attempts.parts,
+                    received_chars=len(attempts.partial), expected_chars=attempts.expected_chars,
+                    output_tokens=attempts.output_tokens
+                )
+                translated_text = attempts.succeeded(first_token_latency)
+                break
+            except TranslationCancelled:
+                raise
+            except Exception as e:
+                delay = attempts.failed(e)
+                if await wait_cancelled(task.cancel_event, delay):
+                    raise TranslationCancelled(f"Chunk {chunk_id} cancelled")
         
-        for chunk in response:
-            if hasattr(chunk, 'choices') and len(chunk.choices) > 0:
-                delta = chunk.choices[0].delta
-                if hasattr(delta, 'content') and delta.content:
-                    translated_text += delta.content
-                    
-                    # Demo 模式：更频繁更新（每1seconds)，生产模式：每5seconds
-                    update_interval = 1 if DEMO_MODE else 5
-                    chars_threshold = 2000 if DEMO_MODE else 10000
-                    
-                    now = time.time()
-                    if now - last_update > update_interval or len(translated_text) % chars_threshold < 100:
-                        elapsed = now - start_time
-                        speed = len(translated_text) / elapsed if elapsed > 0 else 0
-                        chunk_progress = min(95, int((len(translated_text) / (len(chunk_content) * 1.5)) * 100))
-                        
-                        task.emit_progress(
-                            progress=int(((chunk_id - 1) + chunk_progress / 100) / total_chunks * 100),
-                            chunk_progress=chunk_progress
-                        )
-                        # 使用 update_last=True 更新进度消息而不是追加
-                        task.emit_log(f"📥 Receiving translation... {len(translated_text):,} characters ({speed:.0f} c/s)", 'progress', update_last=True)
-                        last_update = now
-        
-        elapsed = time.time() - start_time
-        speed = len(translated_text) / elapsed if elapsed > 0 else 0
-        
-        task.emit_log(f"✅ Chunk {chunk_id} completed: {len(translated_text):,} characters ({speed:.0f} c/s, {elapsed:.0f}s)", 'success')
-        
-        return translated_text
+        return await asyncio.to_thread(finish_chunk, task, chunk_id, chunk_content, language,
+                                       attempts, translated_text)
         
+    except (TranslationCancelled, asyncio.CancelledError):
+        task.emit_log(f"⏹️  Chunk {chunk_id} stopped", 'warning')
+        raise
     except Exception as e:
         task.emit_log(f"❌ Chunk {chunk_id} translation failed: {str(e)}", 'error')
         raise
 
 
+def translate_chunks_concurrently(task, chunks, terminology, on_chunk_done, completed=None):
+    """并发翻译所有块（滑动窗口调度)
+    
+    同时最多有 task.max_concurrency 个块在翻译，每完成一块就按顺序补充下一块。
+    TRANSLATION_ENGINE 为 'asyncio' 时块在 async_engine 的事件循环中运行，否则使用线程池。
+    上一块译文已完成时用译文末尾作为上下文，否则退回使用上一块原文末尾。
+    
+    Args:
+        chunks: 按顺序排列的块列表
+        terminology: 术语列表（提交时拷贝快照，完成回调中可扩充)
+        on_chunk_done: 回调 (chunk, translation)，在调度线程中按完成顺序调用
+        completed: 已完成（从检查点恢复）的块 chunk_id -> 上下文尾部，这些块会被跳过
+        
+    Returns:
+        dict: chunk_id -> 译文（仅本次翻译的块)
+    """
+    results = {}
+    contexts = dict(completed or {})  # chunk_id -> 译文末尾上下文
+    pending = {}  # future -> chunk
+    todo = [i for i, c in enumerate(chunks) if c['id'] not in contexts]
+    next_todo = 0
+    max_workers = max(1, min(task.max_concurrency, len(todo)))
+    use_async = TRANSLATION_ENGINE == 'asyncio'
+    executor = None if use_async else ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"chunk-{task.task_id}")
+    
+    def submit_next():
+        nonlocal next_todo
+        if next_todo >= len(todo):
+            return False
+        index = todo[next_todo]
+        chunk = chunks[index]
+        prev_chunk = chunks[index - 1] if index > 0 else None
+        next_todo += 1
+        
+        prev_context = ""
+        context_is_source = False
+        if prev_chunk is not None:
+            if prev_chunk['id'] in contexts:
+                prev_context = contexts[prev_chunk['id']]
+            else:
+                prev_context = get_context_from_previous(task.chunk_content(prev_chunk))
+                context_is_source = True
+        
+        kwargs = dict(
+            task=task,
+            chunk_id=chunk['id'],
+            total_chunks=task.total_chunks,
+            chunk_content=task.chunk_content(chunk),
+            language=task.language,
+            prev_context=prev_context,
+            terminology=list(terminology) if terminology is not None else None,
+            context_is_source=context_is_source
+        )
+        if use_async:
+            # asyncio 引擎：块作为协程在共享事件循环中运行，不占用线程
+            future = async_engine.submit(atranslate_chunk_web(**kwargs))
+        else:
+            future = executor.submit(translate_chunk_web, **kwargs)
+        pending[future] = chunk
+        return True
+    
+    try:
+        for _ in range(max_workers):
+            submit_next()
+        
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            batch = sorted(done, key=lambda f: pending[f]['id'])
+            # 同一批中有块失败时，其他成功的块照常回调（保存检查点)，处理完整批再抛出异常
+            error = next((f.exception() for f in batch if f.exception() is not None), None)
+            for future in batch:
+                chunk = pending.pop(future)
+                if future.exception() is not None:
+                    continue
+                translation = future.result()
+                results[chunk['id']] = translation
+                contexts[chunk['id']] = get_context_from_previous(translation)
+                on_chunk_done(chunk, translation)
+                if error is None:
+                    submit_next()
+            if error is not None:
+                raise error
+    except BaseException:
+        # 任一块失败：通知正在翻译的块停止，取消未开始的块
+        task.cancel_event.set()
+        raise
+    finally:
+        for future in pending:
+            future.cancel()
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+    
+    return results
+
+
 def translate_book_task(task):
     """执行翻译任务（后台线程)"""
     try:
         task.status = 'translating'
         task.start_time = datetime.now()
+        persist_task(task)
         task.emit_log(f"🚀 Starting translation task", 'info')
         task.emit_log(f"📚 File: {task.filename}", 'info')
         task.emit_log(f"🌍 Target language: {LANGUAGES.get(task.language, task.language)}", 'info')
@@ -600,36 +3304,62 @@ def translate_book_task(task):
         else:
             task.emit_log(f"ℹ️  User chose not to use terminology database", 'info')
         
-        # 翻译所有块
-        all_translations = []
-        prev_context = ""
+        # 翻译所有块（并发调度，结果按块顺序保存)
+        # all_translations 只保存元数据，译文在段文件中
+        all_translations = {}
+        output_file = app.config['OUTPUT_FOLDER'] / f"{task.task_id}_{task.language}.md"
         
-        for chunk in task.chunks_info:
-            task.current_chunk = chunk['id']
-            
-            translation = translate_chunk_web(
-                task=task,
-                chunk_id=chunk['id'],
-                total_chunks=task.total_chunks,
-                chunk_content=chunk['content'],
-                language=task.language,
-                prev_context=prev_context,
-                terminology=terminology
-            )
-            
-            all_translations.append({
+        # 双语术语表：从译文学习术语译名（续传时从检查点恢复)
+        task.glossary = BilingualGlossary(task.language)
+        term_issues = []
+        
+        # 断点续传：恢复已完成块的术语状态和上下文
+        completed_contexts = {}
+        if task.resume_checkpoints:
+            for chunk_id, checkpoint in task.resume_checkpoints.items():
+                all_translations[chunk_id] = {
+                    'chunk_id': chunk_id,
+                    'chars': checkpoint['chars'],
+                    'chapters': checkpoint['chapters'],
+                    'model': checkpoint.get('model')
+                }
+                completed_contexts[chunk_id] = checkpoint['context_tail']
+                task.chunk_progress[chunk_id] = 100
+                if checkpoint.get('model'):
+                    task.record_chunk_model(chunk_id, checkpoint['model'])
+            latest = task.resume_checkpoints[max(task.resume_checkpoints)]
+            if terminology is not None and latest.get('terminology') is not None:
+                terminology = list(latest['terminology'])
+            saved_glossary = checkpoint_store.load_glossary(task.task_id)
+            if saved_glossary and saved_glossary.get('language') == task.language:
+                task.glossary = BilingualGlossary.from_dict(saved_glossary)
+            task.emit_log(f"♻️  Resumed from checkpoints: {len(all_translations)}/{task.total_chunks} chunks already translated", 'success')
+        
+        checkpoint_store.save_task(task)
+        task.emit_log(f"⚡ Concurrency: up to {task.max_concurrency} chunks in parallel", 'info')
+        
+        chunk_ids = [c['id'] for c in task.chunks_info]
+        writer = IncrementalOutputWriter(
+            output_file, chunk_ids,
+            lambda chunk_id: checkpoint_store.segment_path(task.task_id, chunk_id)
+        )
+        
+        def on_chunk_done(chunk, translation):
+            all_translations[chunk['id']] = {
                 'chunk_id': chunk['id'],
-                'translation': translation,
-                'chapters': chunk['chapters']
-            })
+                'chars': len(translation),
+                'chapters': chunk['chapters'],
+                'model': chunk.get('model')
+            }
             
             # 🔥 关键：从第一块提取新术语（混合模式)
             if chunk['id'] == 1 and terminology is not None:
                 task.emit_log(f"🔍 Extracting new terms from first chunk...", 'info')
-                extracted_terms = extract_terminology_from_chunk(translation, chunk['content'])
+                extracted_terms = extract_terminology_from_chunk(translation, task.chunk_content(chunk))
                 
                 # 过滤已存在的术语
-                new_terms = [t for t in extracted_terms if t not in terminology]
+                known = set(terminology)
+                new_terms = [t for t in extracted_terms if t not in known]
                 
                 if new_terms:
                     terminology.extend(new_terms)
@@ -641,25 +3371,66 @@ def translate_book_task(task):
                 else:
                     task.emit_log(f"✅ First chunk terms already covered, no supplement needed", 'success')
             
-            # 更新上下文
-            prev_context = get_context_from_previous(translation)
+            # 双语术语表：学习本块译名，检查已确认译名是否沿用
+            if terminology:
+                source_text = task.chunk_content(chunk)
+                learned = task.glossary.learn(source_text, translation, terminology)
+                if learned:
+                    pairs = ', '.join(f"{term} → {rendering}" for term, rendering in list(learned.items())[:5])
+                    task.emit_log(f"🔤 Confirmed {len(learned)} term translations: {pairs}", 'info')
+                issues = task.glossary.check(chunk['id'], source_text, translation, terminology)
+                for issue in issues[:3]:
+                    task.emit_log(f"⚠️  Chunk {chunk['id']}: '{issue['term']}' not translated as '{issue['expected']}'", 'warning')
+                term_issues.extend(issues)
+                checkpoint_store.save_glossary(task.task_id, task.glossary, term_issues)
+            
+            # 检查点：持久化本块译文段文件、当前术语状态和上下文尾部
+            checkpoint_store.save_chunk(
+                task.task_id, chunk, translation,
+                terminology=list(terminology) if terminology is not None else None,
+                context_tail=get_context_from_previous(translation)
+            )
             
-            # 增量保存
-            output_file = app.config['OUTPUT_FOLDER'] / f"{task.task_id}_{task.language}.md"
-            with open(output_file, 'w', encoding='utf-8') as f:
-                for t in all_translations:
-                    f.write(f"\n\n<!-- Chunk {t['chunk_id']}: {', '.join(t['chapters'])} -->\n\n")
-                    f.write(t['translation'])
+            # 增量保存：只追加连续完成的前缀，每块只写一次
+            writer.append_ready(all_translations)
             
-            task.emit_log(f"💾 Progress saved ({chunk['id']}/{task.total_chunks})", 'info')
+            task.emit_log(f"💾 Progress saved ({len(all_translations)}/{task.total_chunks})", 'info')
+        
+        try:
+            writer.append_ready(all_translations)  # 续传时先写入已完成的前缀
+            translate_chunks_concurrently(task, task.chunks_info, terminology, on_chunk_done,
+                                          completed=completed_contexts)
+        finally:
+            writer.close()
         
-        # 最终合并
-        final_translation = '\n\n'.join(t['translation'] for t in all_translations)
+        # 译名一致性复查：用最终确认的译名重新检查所有块（包括确认前已完成的块)
+        if terminology:
+            term_issues = []
+            for chunk in task.chunks_info:
+                term_issues.extend(task.glossary.check(
+                    chunk['id'], task.chunk_content(chunk),
+                    checkpoint_store.read_segment(task.task_id, chunk['id']), terminology
+                ))
+            checkpoint_store.save_glossary(task.task_id, task.glossary, term_issues)
+            task.metrics['term_inconsistencies'] = len(term_issues)
+            confirmed = len(task.glossary.confirmed())
+            if term_issues:
+                task.emit_log(f"🔤 Glossary: {confirmed} confirmed terms, {len(term_issues)} inconsistent renderings "
+                              f"(see /api/glossary/{task.task_id})", 'warning')
+            else:
+                task.emit_log(f"🔤 Glossary: {confirmed} confirmed terms, renderings consistent", 'success')
         
-        # 保存最终结果
+        # 最终合并：按顺序流式拼接段文件
         output_file = app.config['OUTPUT_FOLDER'] / f"{task.task_id}_{task.language}_final.md"
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write(final_translation)
+        assemble_final_output(
+            output_file,
+            [checkpoint_store.segment_path(task.task_id, chunk_id) for chunk_id in chunk_ids]
+        )
+        total_chars = sum(t['chars'] for t in all_translations.values())
+        try:
+            build_download_artifacts(output_file)
+        except OSError as e:
+            print(f"⚠️  Failed to pre-compress {output_file.name}, will retry on download: {e}")
         
         task.result_file = str(output_file)
         task.status = 'completed'
@@ -668,14 +3439,511 @@ def translate_book_task(task):
         
         elapsed = (task.end_time - task.start_time).total_seconds()
         task.emit_log(f"🎉 Translation completed!", 'success')
-        task.emit_log(f"📊 Total: {len(final_translation):,} characters", 'success')
+        task.emit_log(f"📊 Total: {total_chars:,} characters", 'success')
         task.emit_log(f"⏱️  Time elapsed: {elapsed:.0f} seconds", 'success')
         task.emit_progress(100, 100)
+        persist_task(task, chunks=True)  # 结果文件和每块实际模型
         
     except Exception as e:
         task.status = 'failed'
         task.error = str(e)
         task.emit_log(f"💥 translation failed: {str(e)}", 'error')
+        task.emit_log(f"💾 Finished chunks are checkpointed, use resume to continue", 'info')
+        persist_task(task)
+
+
+# ============ 翻译任务队列 ============
+
+class QueueFullError(Exception):
+    """翻译队列已满"""
+
+
+class TranslationJobQueue:
+    """固定大小的翻译工作线程池 + 有界排队队列
+    
+    取代每个请求启动一个线程：最多 workers 本书同时翻译，其余按提交顺序排队，
+    排队数达到 max_queued 时拒绝新任务。工作线程在第一次提交时启动。
+    """
+    def __init__(self, workers=TRANSLATION_WORKERS, max_queued=TRANSLATION_QUEUE_LIMIT):
+        self.workers = workers
+        self.max_queued = max_queued
+        self._cond = threading.Condition()
+        self._queue = deque()
+        self._threads = []
+        self.running = {}  # task_id -> 开始翻译时间
+        self._recent_waits = deque(maxlen=50)
+
+    def submit(self, task):
+        """任务入队，返回排队位置（1 表示下一个开始)
+        
+        Raises:
+            QueueFullError: 排队数已达上限
+        """
+        with self._cond:
+            if len(self._queue) >= self.max_queued:
+                raise QueueFullError(f"Translation queue is full ({len(self._queue)} waiting)")
+            task.status = 'queued'
+            task.queued_at = time.time()
+            self._queue.append(task)
+            self._ensure_workers()
+            self._cond.notify()
+            return len(self._queue)
+
+    def owns(self, task_id):
+        """任务是否在本进程排队或翻译中"""
+        with self._cond:
+            return task_id in self.running or any(task.task_id == task_id for task in self._queue)
+
+    def position(self, task_id):
+        """任务在队列中的位置（1 开始)，不在队列中返回 0"""
+        with self._cond:
+            for i, task in enumerate(self._queue, 1):
+                if task.task_id == task_id:
+                    return i
+        return 0
+
+    def stats(self):
+        """队列状态（/api/status 返回)"""
+        with self._cond:
+            now = time.time()
+            return {
+                'workers': self.workers,
+                'running': len(self.running),
+                'queued': len(self._queue),
+                'max_queued': self.max_queued,
+                'oldest_wait_seconds': round(now - self._queue[0].queued_at, 1) if self._queue else 0,
+                'avg_wait_seconds': round(sum(self._recent_waits) / len(self._recent_waits), 1) if self._recent_waits else 0
+            }
+
+    def _ensure_workers(self):
+        """（持有锁时调用)补足工作线程"""
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._work, daemon=True,
+                                      name=f"translation-worker-{len(self._threads) + 1}")
+            self._threads.append(thread)
+            thread.start()
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                task = self._queue.popleft()
+                task.queue_wait = time.time() - task.queued_at
+                self._recent_waits.append(task.queue_wait)
+                self.running[task.task_id] = time.time()
+            try:
+                if task.queue_wait >= 1:
+                    task.emit_log(f"▶️  Left queue after {task.queue_wait:.0f}s", 'info')
+                translate_book_task(task)
+            except Exception as e:
+                print(f"❌ Worker error for task {task.task_id}: {e}")
+            finally:
+                with self._cond:
+                    self.running.pop(task.task_id, None)
+
+
+translation_queue = TranslationJobQueue()
+
+
+def enqueue_translation(task):
+    """提交翻译任务并记录排队日志，返回排队位置（队列已满时抛出 QueueFullError)"""
+    position = translation_queue.submit(task)
+    if position > 1 or len(translation_queue.running) >= translation_queue.workers:
+        task.emit_log(f"⏳ Queued for translation (position {position})", 'info')
+    return position
+
+
+def queue_full_response():
+    """队列已满：429 + Retry-After"""
+    response = jsonify({
+        'error': '翻译队列已满，请稍后重试',
+        'queue': translation_queue.stats()
+    })
+    response.headers['Retry-After'] = str(QUEUE_FULL_RETRY_AFTER)
+    return response, 429
+
+
+# ============ 上传存储（按内容寻址)============
+
+def store_upload(stream, ext):
+    """把上传内容流式写入对象目录，边写边计算 SHA-256
+    
+    相同内容只保存一份（objects/<sha256>.<ext>)，重复上传直接复用已有对象。
+    
+    Returns:
+        tuple: (digest, object_path, reused)
+    """
+    objects = app.config['UPLOAD_OBJECTS_FOLDER']
+    tmp_path = objects / f".{uuid.uuid4().hex}.upload"
+    sha = hashlib.sha256()
+    try:
+        with open(tmp_path, 'wb') as f:
+            while True:
+                block = stream.read(UPLOAD_HASH_BLOCK_SIZE)
+                if not block:
+                    break
+                sha.update(block)
+                f.write(block)
+        digest = sha.hexdigest()
+        object_path = objects / f"{digest}.{ext}"
+        try:
+            os.link(tmp_path, object_path)
+            reused = False
+        except FileExistsError:
+            reused = True
+        except OSError:
+            # 文件系统不支持硬链接
+            reused = object_path.exists()
+            if not reused:
+                os.replace(tmp_path, object_path)
+        return digest, object_path, reused
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+def link_upload(object_path, link_path):
+    """让任务文件名指向对象文件（硬链接，不支持时复制)；目标已存在时抛出 FileExistsError"""
+    try:
+        os.link(object_path, link_path)
+    except FileExistsError:
+        raise
+    except OSError:
+        with open(object_path, 'rb') as src, open(link_path, 'xb') as dst:
+            shutil.copyfileobj(src, dst)
+
+
+def new_task_id(filename):
+    """任务 ID：时间戳 + 随机后缀 + 文件名（同一秒内上传同名文件也不会冲突)"""
+    stem = filename.rsplit('.', 1)[0]
+    return f"{int(time.time())}_{uuid.uuid4().hex[:12]}_{stem}"
+
+
+def create_upload_task(filename, object_path):
+    """分配任务 ID，并以 {task_id}_{filename} 链接到上传对象
+    
+    链接以独占方式创建，万一 ID 冲突会重新生成。
+    
+    Returns:
+        tuple: (task_id, filepath)
+    """
+    while True:
+        task_id = new_task_id(filename)
+        filepath = app.config['UPLOAD_FOLDER'] / f"{task_id}_{filename}"
+        try:
+            link_upload(object_path, filepath)
+            return task_id, filepath
+        except FileExistsError:
+            continue
+
+
+def upload_manifest_path(task_id):
+    return app.config['UPLOAD_MANIFEST_FOLDER'] / f"{task_id}.json"
+
+
+def write_upload_manifest(task_id, manifest):
+    """上传时写入清单：task_id -> 原始文件、转换后的 Markdown 和元数据"""
+    write_json_atomic(upload_manifest_path(task_id), manifest)
+
+
+def load_upload_manifest(task_id):
+    """按 task_id 直接读取上传清单（不扫描上传目录)，不存在时返回 None"""
+    if not task_id or Path(task_id).name != task_id:
+        return None
+    try:
+        with open(upload_manifest_path(task_id), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def markdown_stats(path):
+    """Markdown 文件的字符数和词数"""
+    with open(path, 'r', encoding='utf-8') as f:
+        content = f.read()
+    return {'chars': len(content), 'words': len(content.split())}
+
+
+# ============ 分块计划缓存 ============
+
+def plan_cache_path(content, budget):
+    """分块计划缓存文件：按 Markdown 内容哈希 + 分块预算（模型、语言、块大小)区分"""
+    content_digest = hashlib.sha256(content.encode('utf-8')).hexdigest()
+    params = json.dumps(budget, sort_keys=True) + PLAN_CACHE_VERSION
+    params_digest = hashlib.sha256(params.encode('utf-8')).hexdigest()[:16]
+    return app.config['PLAN_CACHE_FOLDER'] / f"{content_digest}_{params_digest}.json"
+
+
+def plan_document(content, language):
+    """建立结构索引并规划分块；同一内容、同一预算的计划直接从缓存读取
+    
+    Returns:
+        tuple: (md_index, chunks, budget, cached)
+    """
+    budget = plan_chunk_budget(content, language)
+    cache_path = plan_cache_path(content, budget)
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            cached = json.load(f)
+        return cached['md_index'], cached['chunks'], budget, True
+    except (OSError, ValueError, KeyError):
+        pass
+    
+    # 单次扫描建立结构索引，分块和预览共用
+    md_index = index_markdown(content)
+    chapters = extract_chapters(content, md_index)
+    chunks = plan_chunks(chapters, content, budget, md_index)
+    try:
+        write_json_atomic(cache_path, {'md_index': md_index, 'chunks': chunks})
+    except OSError as e:
+        print(f"[WARN] Failed to cache chunk plan: {e}")
+    return md_index, chunks, budget, False
+
+
+# ============ 分页预览 ============
+
+class PreviewDocument:
+    """可分页预览的文档：原文缓冲 + 结构索引（按需建立) + 缓存校验信息
+    
+    version 标识文档内容的版本（文件路径、修改时间和大小)，用于生成 ETag；
+    每页只切出请求的字符范围，不必把整本书放进一个 JSON。
+    """
+    
+    def __init__(self, buffer, version, last_modified=None, md_index=None):
+        self.buffer = buffer
+        self.version = version
+        self.last_modified = last_modified
+        self._md_index = md_index
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def from_file(cls, path, buffer=None, md_index=None):
+        stat = os.stat(path)
+        return cls(
+            buffer if buffer is not None else SourceBuffer.open(path),
+            f"{Path(path).resolve()}:{stat.st_mtime_ns}:{stat.st_size}",
+            datetime.fromtimestamp(stat.st_mtime, timezone.utc).replace(microsecond=0),
+            md_index
+        )
+    
+    @property
+    def md_index(self):
+        with self._lock:
+            if self._md_index is None:
+                self._md_index = index_markdown(self.buffer.text())
+            return self._md_index
+    
+    def etag(self, *parts):
+        key = ':'.join(str(part) for part in (self.version, *parts))
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+    
+    def chapter_range(self, chapter):
+        """第 chapter 个标题（从 1 开始，与完整大纲顺序一致)的整节范围；不存在时返回 None"""
+        headings = self.md_index['headings']
+        if not 1 <= chapter <= len(headings):
+            return None
+        return headings[chapter - 1]['start_pos'], headings[chapter - 1]['end_pos']
+    
+    def page(self, offset=None, limit=PREVIEW_PAGE_CHARS, start=0, end=None):
+        """切出 [start, end) 范围内从 offset 开始的一页
+        
+        页尾尽量落在换行处（不在段落中间截断)，next_offset 为下一页的起点，最后一页为 None。
+        """
+        total = len(self.buffer)
+        end = total if end is None else min(end, total)
+        offset = start if offset is None else min(max(offset, start), end)
+        stop = min(offset + limit, end)
+        content = self.buffer[offset:stop]
+        if stop < end:
+            cut = content.rfind('\n', len(content) // 2)
+            if cut >= 0:
+                content = content[:cut + 1]
+                stop = offset + cut + 1
+        return {
+            'content': content,
+            'offset': offset,
+            'next_offset': stop if stop < end else None,
+            'has_more': stop < end,
+            'range_start': start,
+            'range_end': end,
+            'total_chars': total
+        }
+
+
+_preview_documents = OrderedDict()
+_preview_documents_lock = threading.Lock()
+
+
+def open_preview_document(path):
+    """打开预览文件（按路径缓存；文件修改后自动重新打开)"""
+    key = str(Path(path).resolve())
+    stat = os.stat(key)
+    version = f"{key}:{stat.st_mtime_ns}:{stat.st_size}"
+    with _preview_documents_lock:
+        doc = _preview_documents.get(key)
+        if doc is not None and doc.version == version:
+            _preview_documents.move_to_end(key)
+            return doc
+    
+    doc = PreviewDocument.from_file(key)
+    with _preview_documents_lock:
+        _preview_documents[key] = doc
+        _preview_documents.move_to_end(key)
+        while len(_preview_documents) > PREVIEW_CACHE_SIZE:
+            _preview_documents.popitem(last=False)
+    return doc
+
+
+def task_preview_document(task):
+    """任务原文的预览文档（复用任务已加载的原文缓冲和结构索引)"""
+    if task.source_path and Path(task.source_path).exists():
+        return PreviewDocument.from_file(task.source_path, task.source, task.md_index)
+    return PreviewDocument(task.source, f"{task.task_id}:{len(task.source)}", md_index=task.md_index)
+
+
+def preview_page_args():
+    """解析分页参数 offset / limit / chapter
+    
+    缺省值在这里补齐（offset 为 0，limit 为 PREVIEW_PAGE_CHARS)，同一页的不同写法得到相同的 ETag。
+    
+    Returns:
+        (dict, None) 或 (None, 错误响应)
+    """
+    values = {}
+    for name in ('offset', 'limit', 'chapter'):
+        value = request.args.get(name)
+        if value is None or value == '':
+            values[name] = None
+        elif value.isdecimal():
+            values[name] = int(value)
+        else:
+            return None, (jsonify({'error': f'分页参数 {name} 必须是非负整数'}), 400)
+    offset, limit, chapter = values['offset'] or 0, values['limit'] or PREVIEW_PAGE_CHARS, values['chapter']
+    return {'offset': offset, 'limit': min(limit, PREVIEW_MAX_PAGE_CHARS), 'chapter': chapter}, None
+
+
+def conditional_json(etag, last_modified, build):
+    """带 ETag / Last-Modified 的 JSON 响应；客户端缓存仍有效时直接返回 304，不生成内容"""
+    if request.if_none_match:
+        fresh = request.if_none_match.contains(etag)
+    else:
+        fresh = bool(last_modified and request.if_modified_since
+                     and last_modified <= request.if_modified_since)
+    response = app.response_class(status=304) if fresh else jsonify(build())
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    response.cache_control.no_cache = True  # 每次使用前向服务器验证
+    return response
+
+
+def paged_preview(doc, args, kind, **fields):
+    """按分页参数返回文档的一页（整本或某一章)，第一页附带完整大纲"""
+    start, end = 0, None
+    if args['chapter'] is not None:
+        section = doc.chapter_range(args['chapter'])
+        if section is None:
+            return jsonify({'error': f"章节 {args['chapter']} 不存在"}), 404
+        start, end = section
+    
+    def build():
+        page = doc.page(args['offset'], args['limit'], start, end)
+        body = {'success': True, **page, **fields}
+        if page['offset'] == 0:
+            body['outline'] = build_outline(doc.md_index)
+        return body
+    
+    # 按实际起点计算 ETag（章节内 offset 会被夹到章节范围内)
+    offset = min(max(args['offset'], start), len(doc.buffer) if end is None else end)
+    etag = doc.etag(kind, offset, args['limit'], args['chapter'])
+    return conditional_json(etag, doc.last_modified, build)
+
+# ============ 下载产物（预压缩 + 内容哈希)============
+
+def download_manifest_path(result_file):
+    return Path(f"{result_file}.download.json")
+
+
+def build_download_artifacts(result_file):
+    """单次读取结果文件：计算 SHA-256，同时生成 gzip（安装 brotli 时还有 br)预压缩文件
+    
+    压缩后不比原文件小的版本不保留。清单记录结果文件的大小和修改时间，
+    结果文件被重写（如续传后重新合并)时据此判断需要重建。
+    
+    Returns:
+        dict: {'sha256', 'size', 'mtime_ns', 'encodings': {编码: 文件名}}
+    """
+    result_file = Path(result_file)
+    stat = result_file.stat()
+    targets = {'gzip': Path(f"{result_file}.gz")}
+    if brotli is not None:
+        targets['br'] = Path(f"{result_file}.br")
+    token = uuid.uuid4().hex[:8]
+    tmp_paths = {encoding: path.with_name(f"{path.name}.{token}.tmp") for encoding, path in targets.items()}
+    digest = hashlib.sha256()
+    encodings = {}
+    
+    try:
+        with contextlib.ExitStack() as stack:
+            source = stack.enter_context(open(result_file, 'rb'))
+            gz = stack.enter_context(gzip.GzipFile(
+                filename='', mode='wb', compresslevel=DOWNLOAD_GZIP_LEVEL, mtime=0,
+                fileobj=stack.enter_context(open(tmp_paths['gzip'], 'wb'))
+            ))
+            br_out = stack.enter_context(open(tmp_paths['br'], 'wb')) if 'br' in targets else None
+            compressor = brotli.Compressor(quality=DOWNLOAD_BROTLI_QUALITY) if br_out else None
+            for block in iter(lambda: source.read(UPLOAD_HASH_BLOCK_SIZE), b''):
+                digest.update(block)
+                gz.write(block)
+                if compressor:
+                    br_out.write(compressor.process(block))
+            if compressor:
+                br_out.write(compressor.finish())
+        
+        for encoding, path in targets.items():
+            if tmp_paths[encoding].stat().st_size < stat.st_size:
+                os.replace(tmp_paths[encoding], path)
+                encodings[encoding] = path.name
+            else:
+                path.unlink(missing_ok=True)
+    finally:
+        for tmp_path in tmp_paths.values():
+            tmp_path.unlink(missing_ok=True)
+    
+    manifest = {
+        'sha256': digest.hexdigest(),
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'encodings': encodings
+    }
+    manifest_path = download_manifest_path(result_file)
+    tmp_manifest = manifest_path.with_name(f"{manifest_path.name}.{token}.tmp")
+    tmp_manifest.write_text(json.dumps(manifest), encoding='utf-8')
+    os.replace(tmp_manifest, manifest_path)
+    return manifest
+
+
+def download_artifacts(result_file):
+    """读取下载清单；缺失、过期或压缩文件丢失时重新生成"""
+    stat = os.stat(result_file)
+    try:
+        manifest = json.loads(download_manifest_path(result_file).read_text(encoding='utf-8'))
+        fresh = (manifest['size'] == stat.st_size and manifest['mtime_ns'] == stat.st_mtime_ns
+                 and all((Path(result_file).parent / name).exists() for name in manifest['encodings'].values()))
+    except (OSError, ValueError, KeyError):
+        fresh = False
+    return manifest if fresh else build_download_artifacts(result_file)
+
+
+def negotiate_encoding(encodings):
+    """按 Accept-Encoding 的 q 值选择预压缩版本；都不接受时返回 None（发送原文件)"""
+    accept = request.accept_encodings
+    candidates = [
+        (accept.quality(encoding), -rank, encoding)
+        for rank, encoding in enumerate(DOWNLOAD_ENCODINGS)
+        if encoding in encodings and accept.quality(encoding) > 0
+    ]
+    return max(candidates)[2] if candidates else None
 
 
 # ============ Flask 路由 ============
@@ -701,37 +3969,56 @@ def upload_file():
     if file_ext not in ['md', 'docx']:
         return jsonify({'error': '只支持 Markdown (.md) 和 Word (.docx) 文件'}), 400
     
-    # 保存文件
+    # 保存文件（按内容哈希去重，任务文件链接到同一份对象)
     filename = secure_filename(file.filename)
-    task_id = f"{int(time.time())}_{filename.rsplit('.', 1)[0]}"
-    filepath = app.config['UPLOAD_FOLDER'] / f"{task_id}_{filename}"
-    file.save(filepath)
+    digest, object_path, reused = store_upload(file.stream, file_ext)
+    task_id, filepath = create_upload_task(filename, object_path)
     
     # 读取内容
     try:
         if file_ext == 'docx':
-            # 转换 DOCX 为 Markdown
-            content = convert_docx_to_markdown(filepath)
-            # 保存转换后的 Markdown 版本
+            # 转换 DOCX 为 Markdown（按文档顺序流式写入)，相同文件只转换一次
+            converted_object = app.config['UPLOAD_OBJECTS_FOLDER'] / f"{digest}.converted.md"
+            if converted_object.exists():
+                stats = markdown_stats(converted_object)
+                conversion_note = "♻️ Identical Word document uploaded before, reusing converted Markdown"
+            else:
+                stats = convert_docx_to_markdown_file(filepath, converted_object)
+                conversion_note = "✅ Word document converted to Markdown automatically"
             md_filepath = app.config['UPLOAD_FOLDER'] / f"{task_id}_converted.md"
-            with open(md_filepath, 'w', encoding='utf-8') as f:
-                f.write(content)
-            conversion_note = "✅ Word document converted to Markdown automatically"
+            link_upload(converted_object, md_filepath)
         else:
             # 直接读取 Markdown
-            with open(filepath, 'r', encoding='utf-8') as f:
-                content = f.read()
+            md_filepath = None
+            stats = markdown_stats(filepath)
             conversion_note = None
+        
+        # 上传清单：分析和预览按 task_id 直接定位文件
+        write_upload_manifest(task_id, {
+            'task_id': task_id,
+            'filename': filename,
+            'file_type': file_ext,
+            'sha256': digest,
+            'source': str(filepath),
+            'converted': str(md_filepath) if md_filepath else None,
+            'markdown': str(md_filepath or filepath),
+            'chars': stats['chars'],
+            'words': stats['words'],
+            'deduplicated': reused,
+            'uploaded_at': datetime.now().isoformat()
+        })
     except Exception as e:
         return jsonify({'error': f'File processing failed: {str(e)}'}), 500
     
     response_data = {
         'task_id': task_id,
         'filename': filename,
-        'size': len(content),
-        'chars': len(content),
-        'words': len(content.split()),
-        'file_type': file_ext
+        'size': stats['chars'],
+        'chars': stats['chars'],
+        'words': stats['words'],
+        'file_type': file_ext,
+        'sha256': digest,
+        'deduplicated': reused
     }
     
     if conversion_note:
@@ -746,32 +4033,30 @@ def analyze_file(task_id):
     data = request.json
     language = data.get('language', 'Japanese')
     
-    # 查找上传的文件（优先查找转换后的 .md 文件）
-    converted_file = app.config['UPLOAD_FOLDER'] / f"{task_id}_converted.md"
-    if converted_file.exists():
-        filepath = converted_file
-    else:
-        files = list(app.config['UPLOAD_FOLDER'].glob(f"{task_id}_*"))
-        if not files:
-            return jsonify({'error': '文件不存在'}), 404
-        filepath = files[0]
+    # 从上传清单定位文件（Word 文档使用转换后的 .md 文件）
+    manifest = load_upload_manifest(task_id)
+    if manifest is None or not Path(manifest['markdown']).exists():
+        return jsonify({'error': '文件不存在'}), 404
+    filepath = Path(manifest['markdown'])
     
     # 读取内容
     with open(filepath, 'r', encoding='utf-8') as f:
         content = f.read()
     
-    # 分析章节和分块
-    chapters = extract_chapters(content)
-    chunks = plan_chunks(chapters, content)
+    # 分析章节和分块（相同内容和预算的计划从缓存读取)
+    md_index, chunks, budget, plan_cached = plan_document(content, language)
     
     # 创建任务
-    task = TranslationTask(task_id, filepath.name, language)
-    task.source_content = content
+    task = TranslationTask(task_id, manifest['filename'], language)
+    task.source = SourceBuffer.open(filepath, content)  # 大文件 mmap，请求结束后不再持有整篇字符串
+    task.source_path = str(filepath)
+    task.md_index = md_index
     task.total_chunks = len(chunks)
     task.chunks_info = chunks
     task.status = 'analyzed'
     
     tasks[task_id] = task
+    persist_task(task, chunks=True)
     
     # 返回分块信息
     chunks_summary = []
@@ -781,13 +4066,24 @@ def analyze_file(task_id):
             'size': chunk['size'],
             'chapters': chunk['chapters'],
             'has_prologue': chunk.get('has_prologue', False),
-            'has_epilogue': chunk.get('has_epilogue', False)
+            'has_epilogue': chunk.get('has_epilogue', False),
+            'source_tokens': chunk['source_tokens'],
+            'output_tokens': chunk['output_tokens'],
+            'exceeds_budget': chunk['exceeds_budget']
         })
     
     return jsonify({
         'task_id': task_id,
         'total_chunks': len(chunks),
         'total_chars': len(content),
+        'total_headings': len(md_index['headings']),
+        'code_blocks': len(md_index['code_blocks']),
+        'plan_cached': plan_cached,
+        'token_plan': {
+            **budget,
+            'total_source_tokens': sum(c['source_tokens'] for c in chunks),
+            'total_output_tokens': sum(c['output_tokens'] for c in chunks)
+        },
         'chunks': chunks_summary
     })
 
@@ -795,34 +4091,107 @@ def analyze_file(task_id):
 @app.route('/api/translate/<task_id>', methods=['POST'])
 def start_translation(task_id):
     """开始翻译"""
-    if task_id not in tasks:
+    task = get_task(task_id)
+    if task is None:
         return jsonify({'error': '任务不存在'}), 404
     
-    task = tasks[task_id]
-    
     if task.status != 'analyzed':
         return jsonify({'error': '任务状态错误'}), 400
     
-    # 获取配置选项
+    # 获取配置选项（占用成功后才写到任务上)
+    data = request.json or {}
+    options = {'use_terminology': bool(data.get('use_terminology', True))}
+    
+    concurrency = data.get('concurrency')
+    if concurrency is not None:
+        try:
+            options['max_concurrency'] = max(1, min(int(concurrency), MAX_CONCURRENCY_LIMIT))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'concurrency 必须是整数'}), 400
+    
+    # 占用任务（其他进程可能同时收到同一任务的请求)，选项与状态一起写入仓库
+    if not claim_task(task, 'analyzed', 'queued', **options):
+        return jsonify({'error': '任务状态错误'}), 400
+    tasks[task_id] = task
+    
+    # 进入翻译队列，由固定数量的工作线程执行
+    try:
+        position = enqueue_translation(task)
+    except QueueFullError:
+        task.status = 'analyzed'
+        persist_task(task)
+        return queue_full_response()
+    
+    return jsonify({'status': 'queued', 'task_id': task_id, 'queue_position': position})
+
+
+@app.route('/api/resume/<task_id>', methods=['POST'])
+def resume_translation(task_id):
+    """从检查点恢复翻译任务，只翻译缺失的块"""
     data = request.json or {}
-    task.use_terminology = data.get('use_terminology', True)
+    concurrency = data.get('concurrency')
+    if concurrency is not None:
+        try:
+            concurrency = max(1, min(int(concurrency), MAX_CONCURRENCY_LIMIT))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'concurrency 必须是整数'}), 400
+    
+    existing = get_task(task_id, with_source=False)
+    if existing and existing.status in ('queued', 'translating'):
+        return jsonify({'error': '任务正在翻译中'}), 400
+    if existing and existing.status == 'completed':
+        return jsonify({'error': '任务已完成，无需恢复'}), 400
+    
+    # 先占用任务再恢复检查点：同时到达的恢复请求（可能在不同进程)只有一个能通过
+    previous_status = existing.status if existing else None
+    if existing and not claim_task(existing, previous_status, 'queued'):
+        return jsonify({'error': '任务正在翻译中'}), 400
+    
+    def release():
+        """恢复失败，退回占用前的状态"""
+        if existing:
+            existing.status = previous_status
+            persist_task(existing)
+    
+    try:
+        task = restore_task_from_checkpoint(task_id)
+    except SourceUnavailableError as e:
+        release()
+        return jsonify({'error': f'源文件已不存在，无法恢复: {str(e)}'}), 409
+    if task is None:
+        release()
+        return jsonify({'error': '没有可恢复的检查点'}), 404
+    
+    if concurrency is not None:
+        task.max_concurrency = concurrency
+    if existing:
+        task.continue_logs_from(existing)
     
-    # 在后台线程中执行翻译
-    thread = threading.Thread(target=translate_book_task, args=(task,))
-    thread.daemon = True
-    thread.start()
+    try:
+        position = enqueue_translation(task)
+    except QueueFullError:
+        release()
+        return queue_full_response()
+    tasks[task_id] = task
+    persist_task(task, chunks=True)
     
-    return jsonify({'status': 'started', 'task_id': task_id})
+    completed = len(task.resume_checkpoints)
+    return jsonify({
+        'status': 'resumed',
+        'task_id': task_id,
+        'completed_chunks': completed,
+        'remaining_chunks': task.total_chunks - completed,
+        'queue_position': position
+    })
 
 
 @app.route('/api/status/<task_id>')
 def get_status(task_id):
-    """获取任务状态"""
-    if task_id not in tasks:
+    """获取任务状态（本进程没有该任务时读取任务仓库)"""
+    task = get_task(task_id, with_source=False)
+    if task is None:
         return jsonify({'error': '任务不存在'}), 404
     
-    task = tasks[task_id]
-    
     return jsonify({
         'task_id': task_id,
         'status': task.status,
@@ -830,71 +4199,103 @@ def get_status(task_id):
         'current_chunk': task.current_chunk,
         'total_chunks': task.total_chunks,
         'result_file': task.result_file,
-        'error': task.error
+        'error': task.error,
+        'last_log_seq': task.log_seq,
+        'metrics': dict(task.metrics),
+        'queue': {
+            'position': translation_queue.position(task_id),
+            'wait_seconds': round(task.queue_wait if task.queue_wait is not None
+                                  else time.time() - task.queued_at, 1) if task.queued_at else None,
+            **translation_queue.stats()
+        }
     })
 
 
 @app.route('/api/download/<task_id>')
 def download_result(task_id):
-    """下载翻译结果"""
-    if task_id not in tasks:
+    """下载翻译结果（gzip/br 协商、断点续传、强 ETag)"""
+    task = get_task(task_id, with_source=False)
+    if task is None:
         return jsonify({'error': '任务不存在'}), 404
     
-    task = tasks[task_id]
-    
     if task.status != 'completed' or not task.result_file:
         return jsonify({'error': '翻译未完成'}), 400
     
-    return send_file(
-        task.result_file,
+    try:
+        artifacts = download_artifacts(task.result_file)
+    except OSError as e:
+        return jsonify({'error': f'读取文件失败: {str(e)}'}), 500
+    
+    # 预压缩版本按内容协商；每种编码有自己的强 ETag，Range / If-Range / 304 由 send_file 处理
+    encoding = negotiate_encoding(artifacts['encodings'])
+    path = Path(task.result_file)
+    if encoding:
+        path = path.parent / artifacts['encodings'][encoding]
+    response = send_file(
+        path,
+        mimetype='text/markdown',
         as_attachment=True,
-        download_name=f"{task.filename.split('.')[0]}_{task.language}.md"
+        download_name=f"{task.filename.split('.')[0]}_{task.language}.md",
+        conditional=True,
+        etag=f"{artifacts['sha256']}-{encoding}" if encoding else artifacts['sha256'],
+        max_age=0
     )
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
 
 
 @app.route('/api/preview/<task_id>')
 def preview_result(task_id):
     """预览翻译结果内容"""
-    if task_id not in tasks:
+    task = get_task(task_id, with_source=False)
+    if task is None:
         return jsonify({'error': '任务不存在'}), 404
     
-    task = tasks[task_id]
-    
     if task.status != 'completed' or not task.result_file:
         return jsonify({'error': '翻译未完成'}), 400
     
+    args, error = preview_page_args()
+    if error:
+        return error
+    
     try:
-        with open(task.result_file, 'r', encoding='utf-8') as f:
-            content = f.read()
-        
-        return jsonify({
-            'success': True,
-            'content': content,
-            'filename': f"{task.filename.split('.')[0]}_{task.language}.md",
-            'language': task.language
-        })
+        doc = open_preview_document(task.result_file)
+        return paged_preview(
+            doc, args, 'result',
+            filename=f"{task.filename.split('.')[0]}_{task.language}.md",
+            language=task.language
+        )
     except Exception as e:
         return jsonify({'error': f'读取文件失败: {str(e)}'}), 500
 
 
 @app.route('/api/preview-source/<task_id>')
 def preview_source(task_id):
-    """预览上传的源文件内容"""
-    if task_id not in tasks:
-        return jsonify({'error': '任务不存在'}), 404
+    """预览上传的源文件内容（分页；尚未分析的任务从上传清单读取)"""
+    args, error = preview_page_args()
+    if error:
+        return error
     
-    task = tasks[task_id]
+    task = get_task(task_id)
+    if task is None:
+        manifest = load_upload_manifest(task_id)
+        if manifest is None or not Path(manifest['markdown']).exists():
+            return jsonify({'error': '任务不存在'}), 404
+        return paged_preview(
+            open_preview_document(manifest['markdown']), args, 'source',
+            filename=manifest['filename'], language='English (source)'
+        )
     
-    if not task.source_content:
+    if not task.source:
         return jsonify({'error': '源文件内容不可用'}), 400
     
     try:
-        return jsonify({
-            'success': True,
-            'content': task.source_content,
-            'filename': task.filename,
-            'language': 'English (source)'
-        })
+        return paged_preview(
+            task_preview_document(task), args, 'source',
+            filename=task.filename, language='English (source)'
+        )
     except Exception as e:
         return jsonify({'error': f'读取源文件失败: {str(e)}'}), 500
 
@@ -902,11 +4303,10 @@ def preview_source(task_id):
 @app.route('/api/preview-chunk/<task_id>/<int:chunk_id>')
 def preview_chunk(task_id, chunk_id):
     """预览特定 chunk 的内容"""
-    if task_id not in tasks:
+    task = get_task(task_id)
+    if task is None:
         return jsonify({'error': '任务不存在'}), 404
     
-    task = tasks[task_id]
-    
     if not task.chunks_info:
         return jsonify({'error': 'Chunk 信息不可用，请先分析文件'}), 400
     
@@ -920,30 +4320,64 @@ def preview_chunk(task_id, chunk_id):
     if not chunk_data:
         return jsonify({'error': f'Chunk {chunk_id} 不存在'}), 404
     
+    args, error = preview_page_args()
+    if error:
+        return error
+    
     try:
-        # 获取 chunk 的完整内容
-        content = chunk_data.get('content', '')
+        source_doc = task_preview_document(task)
+        spans = json.dumps([chunk_data.get(key) for key in ('spans', 'start_pos', 'end_pos')])
         
-        if not content:
-            # 如果没有保存内容，尝试从源文件中提取
-            if chunk_data.get('start_pos') is not None and chunk_data.get('end_pos') is not None:
-                content = task.source_content[chunk_data['start_pos']:chunk_data['end_pos']]
-            else:
+        def build():
+            # 获取 chunk 的完整内容（按偏移从原文切出)
+            content = task.chunk_content(chunk_data)
+            if not content.strip():
                 content = f"# Chunk {chunk_id}\n\nContent not available"
+            chunk_doc = PreviewDocument(SourceBuffer.from_text(content), source_doc.version)
+            page = chunk_doc.page(args['offset'], args['limit'])
+            
+            # 该 chunk 范围内的标题（来自分析时建立的结构索引)
+            headings = []
+            if task.md_index and chunk_data.get('start_pos') is not None:
+                headings = build_outline(
+                    task.md_index,
+                    start_pos=chunk_data['start_pos'],
+                    end_pos=chunk_data['end_pos']
+                )
+            
+            return {
+                'success': True,
+                **page,
+                'headings': headings,
+                'chunk_id': chunk_id,
+                'chapters': chunk_data.get('chapters', []),
+                'size': chunk_data.get('size', 0),
+                'has_prologue': chunk_data.get('has_prologue', False),
+                'has_epilogue': chunk_data.get('has_epilogue', False)
+            }
         
-        return jsonify({
-            'success': True,
-            'content': content,
-            'chunk_id': chunk_id,
-            'chapters': chunk_data.get('chapters', []),
-            'size': chunk_data.get('size', 0),
-            'has_prologue': chunk_data.get('has_prologue', False),
-            'has_epilogue': chunk_data.get('has_epilogue', False)
-        })
+        etag = source_doc.etag('chunk', chunk_id, spans, args['offset'], args['limit'])
+        return conditional_json(etag, source_doc.last_modified, build)
     except Exception as e:
         return jsonify({'error': f'读取 Chunk 失败: {str(e)}'}), 500
 
 
+@app.route('/api/glossary/<task_id>')
+def get_task_glossary(task_id):
+    """任务的双语术语表：已确认的译名、候选译名和译名不一致的位置"""
+    saved = checkpoint_store.load_glossary(task_id)
+    if saved is None:
+        return jsonify({'error': '该任务还没有双语术语表'}), 404
+    glossary = BilingualGlossary.from_dict(saved)
+    return jsonify({
+        'success': True,
+        'language': saved['language'],
+        'confirmed': glossary.confirmed(),
+        'candidates': saved.get('renderings', {}),
+        'issues': saved.get('issues', [])
+    })
+
+
 @app.route('/api/terminology')
 def get_terminology():
     """获取术语数据库（包含动态提取说明)"""
@@ -1012,6 +4446,26 @@ def get_models_list():
         }), 500
 
 
+@app.route('/api/translation-memory')
+def get_translation_memory_stats():
+    """获取翻译记忆统计信息"""
+    if translation_memory is None:
+        return jsonify({'success': False, 'enabled': False})
+    
+    try:
+        return jsonify({
+            'success': True,
+            'enabled': True,
+            'prompt_version': PROMPT_VERSION,
+            'stats': translation_memory.stats()
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
 # ============ WebSocket 事件 ============
 
 @socketio.on('connect')
@@ -1030,14 +4484,38 @@ def handle_disconnect():
 
 @socketio.on('join')
 def handle_join(data):
-    """加入任务房间"""
+    """加入任务房间
+    
+    可携带 last_seq（客户端已收到的最后一条日志 seq)，
+    加入后只向该客户端补发错过的日志和当前进度。
+    """
     task_id = data.get('task_id')
     if task_id:
         # 使用 Flask-SocketIO 的 join_room
         from flask_socketio import join_room
         join_room(task_id)
         print(f"📥 Client joined room: {task_id}")
-        return {'status': 'joined', 'task_id': task_id}
+        
+        last_seq = 0
+        task = tasks.get(task_id)
+        if task is not None:
+            try:
+                last_seq = max(0, int(data.get('last_seq') or 0))
+            except (TypeError, ValueError):
+                last_seq = 0
+            if last_seq > task.log_seq:
+                last_seq = 0  # 服务端已重启或任务已重建，游标失效，全部补发
+            missed = task.logs_since(last_seq)
+            # 只发给当前客户端；与房间广播重复的条目由客户端按 seq 去重
+            emit('task_events', {
+                'logs': missed,
+                'progress': task.progress_snapshot(),
+                'replay': True,
+                'last_seq': task.log_seq
+            })
+            if missed:
+                print(f"🔁 Replayed {len(missed)} log entries to client in room {task_id}")
+        return {'status': 'joined', 'task_id': task_id, 'last_seq': task.log_seq if task else 0}
     return {'status': 'error', 'message': 'No task_id provided'}
 
 
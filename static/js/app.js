@@ -5,6 +5,7 @@ console.log('[MTW] Loading app.js version', MTW_BUILD_VERSION);
 
 let socket = null;
 let currentTaskId = null;
+let lastLogSeq = 0;  // 已显示的最后一条日志 seq，重连时用于补发
 let currentLanguage = 'Japanese';
 
 // ============ 初始化 ============
@@ -25,6 +26,10 @@ function initializeSocketIO() {
     socket.on('connect', () => {
         console.log('✅ WebSocket 已连接');
         updateLogStatus('Connected', 'green');
+        // 断线重连：重新加入房间，服务端补发错过的日志
+        if (currentTaskId) {
+            joinTaskRoom();
+        }
     });
     
     socket.on('disconnect', () => {
@@ -32,15 +37,29 @@ function initializeSocketIO() {
         updateLogStatus('Disconnected', 'red');
     });
     
-    socket.on('log', (data) => {
-        appendLog(data.message, data.level, data.timestamp, data.update_last || false);
-    });
-    
-    socket.on('progress', (data) => {
-        updateProgress(data.overall, data.chunk, data.current_chunk, data.total_chunks);
+    // 批量事件：服务端按频率合并的日志和最新进度（加入房间时也用于补发)
+    socket.on('task_events', (data) => {
+        if (data.replay && data.last_seq < lastLogSeq) {
+            lastLogSeq = 0;  // 服务端任务已重建，游标失效
+        }
+        (data.logs || []).forEach((log) => {
+            if (log.seq) {
+                if (log.seq <= lastLogSeq) return;  // 补发与广播重复
+                lastLogSeq = log.seq;
+            }
+            appendLog(log.message, log.level, log.timestamp, log.update_last || false, log.update_key || '');
+        });
+        if (data.progress) {
+            const p = data.progress;
+            updateProgress(p.overall, p.chunk, p.current_chunk, p.total_chunks);
+        }
     });
 }
 
+function joinTaskRoom() {
+    socket.emit('join', { task_id: currentTaskId, last_seq: lastLogSeq });
+}
+
 function updateLogStatus(status, color) {
     const statusEl = document.getElementById('logStatus');
     statusEl.textContent = status;
@@ -110,6 +129,7 @@ async function handleFileUpload(file) {
         
         const data = await response.json();
         currentTaskId = data.task_id;
+        lastLogSeq = 0;
         
         // 显示文件信息
         document.getElementById('fileInfo').classList.remove('hidden');
@@ -133,7 +153,7 @@ async function handleFileUpload(file) {
         appendLog(`📊 Size: ${formatBytes(data.size)} | Characters: ${formatNumber(data.chars)}`, 'info');
         
         // 加入 WebSocket 房间
-        socket.emit('join', { task_id: currentTaskId });
+        joinTaskRoom();
         
     } catch (error) {
         appendLog(`❌ Upload failed: ${error.message}`, 'error');
@@ -225,11 +245,21 @@ function initializeButtons() {
                 })
             });
             
+            if (response.status === 429) {
+                const data = await response.json();
+                throw new Error(`${data.error} (${data.queue.queued} tasks waiting)`);
+            }
+
             if (!response.ok) {
                 throw new Error('启动翻译失败');
             }
-            
-            appendLog('✅ Translation task started', 'success');
+
+            const data = await response.json();
+            if (data.queue_position > 1) {
+                appendLog(`⏳ Translation queued (position ${data.queue_position})`, 'info');
+            } else {
+                appendLog('✅ Translation task started', 'success');
+            }
             
         } catch (error) {
             appendLog(`❌ Failed to start: ${error.message}`, 'error');
@@ -282,6 +312,9 @@ function displayChunks(chunks) {
         if (chunk.has_epilogue) {
             badges += '<span class="text-xs px-2 py-0.5 bg-purple-500/20 rounded border border-purple-500/50">Epilogue</span>';
         }
+        if (chunk.exceeds_budget) {
+            badges += '<span class="text-xs px-2 py-0.5 bg-red-500/20 rounded border border-red-500/50 ml-1">Over token budget</span>';
+        }
         
         const chaptersText = chunk.chapters.slice(0, 2).join(', ') + (chunk.chapters.length > 2 ? '...' : '');
         
@@ -290,6 +323,7 @@ function displayChunks(chunks) {
                 <span class="font-bold text-blue-400">Chunk ${chunk.id}</span>
                 <div class="flex items-center gap-2">
                     <span class="text-xs text-gray-400">${formatNumber(chunk.size)} chars</span>
+                    ${chunk.output_tokens ? `<span class="text-xs text-gray-500">~${formatNumber(chunk.output_tokens)} tokens out</span>` : ''}
                     <span class="text-xs text-gray-500">👁️ Click to preview</span>
                 </div>
             </div>
@@ -307,7 +341,7 @@ function displayChunks(chunks) {
 }
 
 // ============ 日志系统 ============
-function appendLog(message, level = 'info', timestamp = null, updateLast = false) {
+function appendLog(message, level = 'info', timestamp = null, updateLast = false, updateKey = '') {
     const logContainer = document.getElementById('logContainer');
     
     // 清除初始提示
@@ -315,19 +349,16 @@ function appendLog(message, level = 'info', timestamp = null, updateLast = false
         logContainer.innerHTML = '';
     }
     
-    // 如果是更新模式，并且消息类型相同，更新最后一条
-    if (updateLast && logContainer.children.length > 0) {
-        const lastEntry = logContainer.lastElementChild;
-        // 检查是否是进度消息（包含"已接收"或"📥"）
-        if (lastEntry.textContent.includes('📥') || lastEntry.textContent.includes('已接收')) {
+    // 更新模式：按 update_key（每个分块一个）原地更新该分块的进度行，避免并发分块互相覆盖
+    if (updateLast) {
+        const existing = Array.from(logContainer.querySelectorAll('.log-entry[data-update-key]'))
+            .find((el) => el.dataset.updateKey === updateKey);
+        if (existing) {
             const time = timestamp || new Date().toLocaleTimeString('zh-CN', { hour12: false });
-            let color = 'text-gray-400';
-            let icon = '📥';
-            
-            lastEntry.innerHTML = `
+            existing.innerHTML = `
                 <span class="text-gray-500 text-xs">[${time}]</span>
-                <span>${icon}</span>
-                <span class="${color} flex-1">${escapeHtml(message)}</span>
+                <span>📥</span>
+                <span class="text-gray-400 flex-1">${escapeHtml(message)}</span>
             `;
             return;
         }
@@ -335,6 +366,9 @@ function appendLog(message, level = 'info', timestamp = null, updateLast = false
     
     const logEntry = document.createElement('div');
     logEntry.className = 'log-entry flex gap-2 mb-2';
+    if (updateLast) {
+        logEntry.dataset.updateKey = updateKey;
+    }
     
     const time = timestamp || new Date().toLocaleTimeString('zh-CN', { hour12: false });
     
@@ -604,10 +638,53 @@ function hidePreviewModal() {
     modal.classList.add('hidden');
 }
 
+// 分页预览：接口每次只返回一页，"Load more" 从 next_offset 继续加载
+let previewPage = null;  // { url, content, nextOffset, statsSuffix }
+
+function showPreviewPage(url, data, statsSuffix = '') {
+    const append = previewPage && previewPage.url === url && data.offset > 0;
+    const content = append ? previewPage.content + data.content : data.content;
+    previewPage = { url, content, nextOffset: data.next_offset, statsSuffix };
+    
+    // 设置原始内容
+    const rawPre = document.getElementById('previewRawContent').querySelector('pre');
+    rawPre.textContent = content;
+    
+    // 渲染 Markdown
+    const renderedHtml = marked.parse(content);
+    document.getElementById('previewRenderedContent').innerHTML = `<div class="markdown-content">${renderedHtml}</div>`;
+    
+    // 更新统计信息
+    const wordCount = content.split(/\s+/).length;
+    const charCount = data.has_more
+        ? `${content.length.toLocaleString()} of ${data.total_chars.toLocaleString()}`
+        : content.length.toLocaleString();
+    document.getElementById('previewStats').textContent = `📊 ${wordCount.toLocaleString()} words • ${charCount} characters${statsSuffix}`;
+    
+    document.getElementById('previewMoreBtn').classList.toggle('hidden', !data.has_more);
+}
+
+async function loadMorePreview() {
+    if (!previewPage || previewPage.nextOffset === null) return;
+    const moreBtn = document.getElementById('previewMoreBtn');
+    moreBtn.disabled = true;
+    
+    try {
+        const { url, nextOffset, statsSuffix } = previewPage;
+        const response = await fetch(`${url}?offset=${nextOffset}`);
+        if (!response.ok) {
+            throw new Error('Failed to load more content');
+        }
+        showPreviewPage(url, await response.json(), statsSuffix);
+    } catch (error) {
+        alert(error.message);
+    } finally {
+        moreBtn.disabled = false;
+    }
+}
+
 async function loadPreviewContent(taskId, previewType = 'translation') {
-    const rawContent = document.getElementById('previewRawContent');
     const renderedContent = document.getElementById('previewRenderedContent');
-    const statsEl = document.getElementById('previewStats');
     const titleEl = document.getElementById('previewTitle');
     const iconEl = document.getElementById('previewIcon');
     
@@ -631,7 +708,8 @@ async function loadPreviewContent(taskId, previewType = 'translation') {
     `;
     
     try {
-        const response = await fetch(`/api/preview/${taskId}`);
+        const url = `/api/preview/${taskId}`;
+        const response = await fetch(url);
         
         if (!response.ok) {
             throw new Error('Failed to load preview');
@@ -639,18 +717,8 @@ async function loadPreviewContent(taskId, previewType = 'translation') {
         
         const data = await response.json();
         
-        // 设置原始内容
-        const rawPre = rawContent.querySelector('pre');
-        rawPre.textContent = data.content;
-        
-        // 渲染 Markdown
-        const renderedHtml = marked.parse(data.content);
-        renderedContent.innerHTML = `<div class="markdown-content">${renderedHtml}</div>`;
-        
-        // 更新统计信息
-        const wordCount = data.content.split(/\s+/).length;
-        const charCount = data.content.length;
-        statsEl.textContent = `📊 ${wordCount.toLocaleString()} words • ${charCount.toLocaleString()} characters`;
+        // 显示第一页（其余按需加载)
+        showPreviewPage(url, data);
         
         // 设置下载按钮 (只对翻译结果显示)
         const downloadBtn = document.getElementById('downloadFromPreview');
@@ -680,9 +748,7 @@ async function previewSource() {
     
     const titleEl = document.getElementById('previewTitle');
     const iconEl = document.getElementById('previewIcon');
-    const rawContent = document.getElementById('previewRawContent');
     const renderedContent = document.getElementById('previewRenderedContent');
-    const statsEl = document.getElementById('previewStats');
     
     titleEl.textContent = 'Uploaded File Preview';
     iconEl.textContent = '📄';
@@ -698,7 +764,8 @@ async function previewSource() {
     `;
     
     try {
-        const response = await fetch(`/api/preview-source/${currentTaskId}`);
+        const url = `/api/preview-source/${currentTaskId}`;
+        const response = await fetch(url);
         
         if (!response.ok) {
             throw new Error('Failed to load source file');
@@ -706,18 +773,8 @@ async function previewSource() {
         
         const data = await response.json();
         
-        // 设置原始内容
-        const rawPre = rawContent.querySelector('pre');
-        rawPre.textContent = data.content;
-        
-        // 渲染 Markdown
-        const renderedHtml = marked.parse(data.content);
-        renderedContent.innerHTML = `<div class="markdown-content">${renderedHtml}</div>`;
-        
-        // 更新统计信息
-        const wordCount = data.content.split(/\s+/).length;
-        const charCount = data.content.length;
-        statsEl.textContent = `📊 ${wordCount.toLocaleString()} words • ${charCount.toLocaleString()} characters`;
+        // 显示第一页（其余按需加载)
+        showPreviewPage(url, data);
         
         // 隐藏下载按钮
         document.getElementById('downloadFromPreview').classList.add('hidden');
@@ -739,9 +796,7 @@ async function previewChunk(chunkId) {
     
     const titleEl = document.getElementById('previewTitle');
     const iconEl = document.getElementById('previewIcon');
-    const rawContent = document.getElementById('previewRawContent');
     const renderedContent = document.getElementById('previewRenderedContent');
-    const statsEl = document.getElementById('previewStats');
     
     titleEl.textContent = `Chunk ${chunkId} Preview`;
     iconEl.textContent = '✂️';
@@ -757,7 +812,8 @@ async function previewChunk(chunkId) {
     `;
     
     try {
-        const response = await fetch(`/api/preview-chunk/${currentTaskId}/${chunkId}`);
+        const url = `/api/preview-chunk/${currentTaskId}/${chunkId}`;
+        const response = await fetch(url);
         
         if (!response.ok) {
             throw new Error(`Failed to load chunk ${chunkId}`);
@@ -765,19 +821,9 @@ async function previewChunk(chunkId) {
         
         const data = await response.json();
         
-        // 设置原始内容
-        const rawPre = rawContent.querySelector('pre');
-        rawPre.textContent = data.content;
-        
-        // 渲染 Markdown
-        const renderedHtml = marked.parse(data.content);
-        renderedContent.innerHTML = `<div class="markdown-content">${renderedHtml}</div>`;
-        
-        // 更新统计信息
-        const wordCount = data.content.split(/\s+/).length;
-        const charCount = data.content.length;
+        // 显示第一页（其余按需加载)
         const chunkInfo = data.chapters ? ` • ${data.chapters.join(', ')}` : '';
-        statsEl.textContent = `📊 ${wordCount.toLocaleString()} words • ${charCount.toLocaleString()} characters${chunkInfo}`;
+        showPreviewPage(url, data, chunkInfo);
         
         // 隐藏下载按钮
         document.getElementById('downloadFromPreview').classList.add('hidden');
@@ -804,6 +850,9 @@ function initializePreviewModal() {
     // 关闭按钮
     closeBtn.addEventListener('click', hidePreviewModal);
     
+    // 加载下一页
+    document.getElementById('previewMoreBtn').addEventListener('click', loadMorePreview);
+    
     // 点击背景关闭
     modal.addEventListener('click', (e) => {
         if (e.target === modal) {
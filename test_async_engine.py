@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+测试 asyncio 翻译引擎（acompletion 流式请求共享一个事件循环)
+"""
+
+import sys
+import time
+import asyncio
+import threading
+from pathlib import Path
+
+# 添加项目路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+import app
+from app import AsyncTranslationEngine, StreamTimeout, translate_chunks_concurrently
+from testing_helpers import FakeAPIError, delta, fake_stream, make_task, reset_breakers
+
+
+class use_async_engine:
+    """用假 acompletion 替换 LLM 调用，并使用独立的引擎实例"""
+    def __init__(self, fake_acompletion, **overrides):
+        self.values = {
+            'acompletion': fake_acompletion,
+            'async_engine': AsyncTranslationEngine(max_streams=overrides.pop('max_streams', 256)),
+            'TRANSLATION_ENGINE': 'asyncio',
+            'translation_memory': None,
+            'rate_limiters': {},  # 不限速
+            'RETRY_BASE_DELAY': 0,
+            **overrides
+        }
+
+    def __enter__(self):
+        self.originals = {name: getattr(app, name) for name in self.values}
+        for name, value in self.values.items():
+            setattr(app, name, value)
+        reset_breakers()
+        return app.async_engine
+
+    def __exit__(self, *exc):
+        for name, value in self.originals.items():
+            setattr(app, name, value)
+        reset_breakers()
+
+
+def test_hundreds_of_streams_on_one_loop():
+    """200 个块同时在途，全部在同一个事件循环线程中完成"""
+    stream_threads = set()
+
+    async def fake_acompletion(**kwargs):
+        stream_threads.add(threading.current_thread().name)
+        content = kwargs['messages'][1]['content'].split('---BEGIN CONTENT---')[1]
+        chunk_text = content.split('chunk ')[1].split('.')[0]
+        return fake_stream([f"译文 ", chunk_text], delay=0.2)
+
+    task = make_task(200, 200, 'test_async_many')
+    threads_before = threading.active_count()
+    with use_async_engine(fake_acompletion) as engine:
+        start = time.time()
+        results = translate_chunks_concurrently(task, task.chunks_info, None, lambda c, t: None)
+        elapsed = time.time() - start
+        stats = engine.stats()
+    assert results == {i: f"译文 {i}" for i in range(1, 201)}
+    assert stream_threads == {'translation-event-loop'}, stream_threads
+    assert stats['peak_streams'] >= 150, stats
+    assert threading.active_count() - threads_before < 10, "chunks must not get their own threads"
+    assert elapsed < 5, f"200 concurrent streams took {elapsed:.1f}s"
+    assert all(chunk['model'] for chunk in task.chunks_info)
+    print(f"✅ Test 1: 200 streams on one loop in {elapsed:.2f}s (peak {stats['peak_streams']}) - PASSED")
+
+
+def test_stream_limit_respected():
+    """同时打开的流不超过 max_streams"""
+    async def fake_acompletion(**kwargs):
+        return fake_stream(["译文"], delay=0.05)
+
+    task = make_task(12, 12, 'test_async_limit')
+    with use_async_engine(fake_acompletion, max_streams=3) as engine:
+        translate_chunks_concurrently(task, task.chunks_info, None, lambda c, t: None)
+        assert engine.peak_streams == 3, engine.stats()
+        assert engine.active_streams == 0
+    print("✅ Test 2: stream limit respected - PASSED")
+
+
+def test_failure_cancels_inflight_streams():
+    """一块遇到致命错误时，其他在途的流被协作取消，任务失败"""
+    streams_finished = []
+
+    async def slow_stream():
+        for _ in range(100):
+            await asyncio.sleep(0.05)
+            yield delta("字")
+        streams_finished.append(True)
+
+    async def fake_acompletion(**kwargs):
+        if 'chunk 3.' in kwargs['messages'][1]['content'].split('---BEGIN CONTENT---')[1]:
+            await asyncio.sleep(0.1)
+            raise FakeAPIError(401)
+        return slow_stream()
+
+    task = make_task(6, 6, 'test_async_cancel')
+    with use_async_engine(fake_acompletion) as engine:
+        start = time.time()
+        try:
+            translate_chunks_concurrently(task, task.chunks_info, None, lambda c, t: None)
+            assert False, "expected FakeAPIError"
+        except FakeAPIError:
+            pass
+        deadline = time.time() + 2
+        while engine.active_streams and time.time() < deadline:
+            time.sleep(0.01)
+        assert engine.active_streams == 0, "cancelled streams must be closed"
+    assert time.time() - start < 2, "failure must not wait for other streams"
+    assert task.cancel_event.is_set()
+    assert not streams_finished
+    assert task.metrics['fatal_errors'] == 1
+    print("✅ Test 3: failure cancels in-flight streams - PASSED")
+
+
+def test_idle_stream_times_out_and_retries():
+    """流长时间没有新内容时超时，按可重试错误重新请求"""
+    calls = []
+
+    async def stalled_stream():
+        yield delta("部分")
+        await asyncio.sleep(10)
+        yield delta("永远不会到达")
+
+    async def fake_acompletion(**kwargs):
+        calls.append(kwargs['model'])
+        if len(calls) == 1:
+            return stalled_stream()
+        return fake_stream(["完整译文"])
+
+    assert issubclass(StreamTimeout, TimeoutError) and app.is_retryable_error(StreamTimeout("idle"))
+    task = make_task(1, 1, 'test_async_timeout')
+    with use_async_engine(fake_acompletion, STREAM_IDLE_TIMEOUT=0.2) as engine:
+        start = time.time()
+        result = engine.run(app.atranslate_chunk_web(task, 1, 1, "Source", "Chinese"), timeout=5)
+    assert result == "完整译文"
+    assert len(calls) == 2
+    assert time.time() - start < 2
+    assert task.metrics['retries'] == 1 and task.metrics['api_calls'] == 2
+    print("✅ Test 4: idle stream timeout retried - PASSED")
+
+
+class RecordingMemory:
+    """记录调用线程的假翻译记忆"""
+    def __init__(self):
+        self.threads = []
+
+    def lookup(self, keys):
+        self.threads.append(threading.current_thread().name)
+        return None
+
+    def put(self, key, translation, model, language):
+        self.threads.append(threading.current_thread().name)
+
+
+def test_blocking_work_runs_off_loop():
+    """翻译记忆读写和术语扫描不在事件循环线程中执行"""
+    memory = RecordingMemory()
+    scan_threads = []
+    original_select = app.select_chunk_terms
+
+    def recording_select(terminology, chunk_content):
+        scan_threads.append(threading.current_thread().name)
+        return original_select(terminology, chunk_content)
+
+    async def fake_acompletion(**kwargs):
+        return fake_stream(["译文"])
+
+    task = make_task(20, 20, 'test_async_offload')
+    app.select_chunk_terms = recording_select
+    try:
+        with use_async_engine(fake_acompletion, translation_memory=memory):
+            results = translate_chunks_concurrently(task, task.chunks_info, ['Chapter'], lambda c, t: None)
+    finally:
+        app.select_chunk_terms = original_select
+    assert results == {i: "译文" for i in range(1, 21)}
+    assert len(memory.threads) == 40 and len(scan_threads) == 20
+    assert all(name.startswith('translation-io') for name in memory.threads + scan_threads)
+    print("✅ Test 5: blocking work runs off the event loop - PASSED")
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("🧪 Testing Async Translation Engine")
+    print("=" * 60)
+    test_hundreds_of_streams_on_one_loop()
+    test_stream_limit_respected()
+    test_failure_cancels_inflight_streams()
+    test_idle_stream_times_out_and_retries()
+    test_blocking_work_runs_off_loop()
+    print("=" * 60)
+    print("✅ All tests passed!")
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+测试双语术语表（从译文学习译名、写入后续提示词、译名一致性检查)
+"""
+
+import sys
+import json
+import asyncio
+import tempfile
+from pathlib import Path
+
+# 添加项目路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+import app
+from app import (BilingualGlossary, TranslationTask, CheckpointStore, TaskStore, AsyncTranslationEngine,
+                 annotated_rendering, prepare_chunk, translate_book_task)
+from testing_helpers import delta
+
+TERMS = ['containment', 'wave', 'coming wave']
+
+
+def test_learns_rendering_from_annotations():
+    """取标注前的整段文字，两个块的标注共有的最长后缀即译名"""
+    assert annotated_rendering("我们必须实现遏制") == '我们必须实现遏制'
+    assert annotated_rendering("很难。遏制") == '遏制'
+    assert annotated_rendering("使用 GPU 训练") == '训练'
+    assert annotated_rendering("Il a dit. La vague qui vient ") == 'la vague qui vient'
+
+    glossary = BilingualGlossary('Chinese')
+    assert glossary.learn("We must achieve containment.", "我们必须实现遏制（containment）。", TERMS) == {}
+    assert glossary.learn("Containment is hard.", "遏制（containment）很难。", TERMS) == {'containment': '遏制'}
+    assert glossary.to_dict()['renderings'] == {'containment': {'我们必须实现遏制': 1, '遏制': 1}}
+    print("✅ Test 1: learns rendering from annotations - PASSED")
+
+
+def test_overlapping_terms_and_latin_targets():
+    """共享后缀的术语各自学到完整译名；空格分词的译文按词学习，检查时不区分大小写"""
+    terms = ['machine learning', 'deep learning']
+    glossary = BilingualGlossary('Chinese')
+    glossary.learn("Machine learning and deep learning both matter.",
+                   "机器学习（machine learning）和深度学习（deep learning）都很重要。", terms)
+    learned = glossary.learn("We study machine learning. Deep learning is harder.",
+                             "我们研究机器学习（machine learning）。深度学习（deep learning）更难。", terms)
+    assert learned == {'machine learning': '机器学习', 'deep learning': '深度学习'}, learned
+
+    french = BilingualGlossary('French')
+    assert french.learn("The coming wave. The coming wave is here.",
+                        "Il a dit. La vague qui vient (coming wave). La vague qui vient est là.", TERMS) == {}
+    learned = french.learn("Here is the coming wave.", "Voici enfin la vague qui vient (coming wave).", TERMS)
+    assert learned == {'coming wave': 'vague qui vient'}, learned
+    assert french.check(3, "The coming wave.", "La vague qui vient.", TERMS) == []
+    assert french.check(4, "The coming wave.", "La vague à venir.", TERMS)[0]['expected'] == 'vague qui vient'
+    print("✅ Test 2: overlapping terms and Latin targets - PASSED")
+
+
+def test_latin_renderings_skip_articles():
+    """冠词、省音冠词和前面的词不算进译名：取最短的、词数不少于术语的候选（法语 / 西班牙语)"""
+    terms = ['machine learning']
+    french = BilingualGlossary('French')
+    french.learn("We love machine learning.", "Nous aimons l'apprentissage automatique (machine learning).", terms)
+    learned = french.learn("Machine learning works.", "L'apprentissage automatique (machine learning) marche.", terms)
+    assert learned == {'machine learning': 'apprentissage automatique'}, learned
+
+    again = BilingualGlossary('French')
+    for _ in range(2):
+        again.learn("We love machine learning.", "Nous aimons l'apprentissage automatique (machine learning).", terms)
+    assert again.confirmed() == {'machine learning': 'apprentissage automatique'}, again.confirmed()
+
+    spanish = BilingualGlossary('Spanish')
+    spanish.learn("Machine learning matters.", "El aprendizaje automático (machine learning) importa.", terms)
+    learned = spanish.learn("We use machine learning.", "Usamos el aprendizaje automático (machine learning).", terms)
+    assert learned == {'machine learning': 'aprendizaje automático'}, learned
+    print("✅ Test 3: Latin renderings skip articles - PASSED")
+
+
+def test_confirmation_needs_support():
+    """只统计标注处的译名，且要在两个块中出现才确认"""
+    glossary = BilingualGlossary('Chinese')
+    assert glossary.learn("The wave arrives. The wave again.", "浪潮（wave）来了。浪潮（wave）又来了。", TERMS) == {}
+    assert glossary.confirmed() == {}
+    assert glossary.learn("Another wave.", "又一次浪潮。", TERMS) == {}, "unannotated mentions do not count"
+    assert glossary.learn("A new wave.", "新的浪潮（wave）。", TERMS) == {'wave': '浪潮'}
+    assert glossary.learn("No terms here.", "这里没有术语。", TERMS) == {}
+
+    restored = BilingualGlossary.from_dict(json.loads(json.dumps(glossary.to_dict())))
+    assert restored.confirmed(['wave', 'containment']) == {'wave': '浪潮'}
+    print("✅ Test 4: confirmation needs support - PASSED")
+
+
+def test_check_flags_drift_and_prompt_uses_pairs():
+    """原文出现已确认术语但译文用了别的译名时报告；提示词写入已确认的译名"""
+    glossary = BilingualGlossary('Chinese', {'containment': {'遏制': 4, '控制': 1}})
+    issues = glossary.check(7, "Containment failed.", "控制失败了。", TERMS)
+    assert issues == [{'chunk_id': 7, 'term': 'containment', 'expected': '遏制', 'found': ['控制']}]
+    assert glossary.check(8, "Containment worked.", "遏制成功了。", TERMS) == []
+
+    task = TranslationTask('test_glossary_prompt', 'book.md', 'Chinese')
+    task.glossary = glossary
+    original_memory = app.translation_memory
+    app.translation_memory = None
+    try:
+        _, attempts = prepare_chunk(task, 2, 3, "The wave and containment.", 'Chinese', terminology=TERMS)
+    finally:
+        app.translation_memory = original_memory
+    prompt = attempts.messages[1]['content']
+    assert 'containment → 遏制' in prompt and 'wave' in prompt and 'established translation' in prompt
+    print("✅ Test 5: drift flagged and prompt uses confirmed pairs - PASSED")
+
+
+CHUNKS = {
+    1: ("## Chapter 1\n\nContainment is hard. Without containment, the wave gets loose. Containment matters.",
+        "## 第1章\n\n遏制（containment）很难。没有遏制，浪潮会失控。遏制很重要。"),
+    2: ("## Chapter 2\n\nWe need containment again.", "## 第2章\n\n我们再次需要遏制（containment）。"),
+    3: ("## Chapter 3\n\nContainment failed.", "## 第3章\n\n控制（containment）失败了。"),
+}
+
+
+def test_translation_task_learns_and_reports():
+    """完整翻译流程：前两块确认的译名写入第 3 块提示词，第 3 块的不一致被记录"""
+    prompts = {}
+
+    async def fake_stream(text):
+        await asyncio.sleep(0)
+        yield delta(text)
+
+    async def fake_acompletion(**kwargs):
+        content = kwargs['messages'][1]['content']
+        chunk_id = int(content.split('---BEGIN CONTENT---')[1].split('Chapter ')[1][0])
+        prompts[chunk_id] = content
+        return fake_stream(CHUNKS[chunk_id][1])
+
+    tmp_dir = Path(tempfile.mkdtemp(prefix='glossary_test_'))
+    overrides = {
+        'acompletion': fake_acompletion,
+        'async_engine': AsyncTranslationEngine(),
+        'TRANSLATION_ENGINE': 'asyncio',
+        'translation_memory': None,
+        'rate_limiters': {},
+        'checkpoint_store': CheckpointStore(tmp_dir / 'checkpoints'),
+        'task_store': TaskStore(tmp_dir / 'tasks.sqlite3'),
+    }
+    originals = {name: getattr(app, name) for name in overrides}
+    original_output = app.app.config['OUTPUT_FOLDER']
+    for name, value in overrides.items():
+        setattr(app, name, value)
+    app.app.config['OUTPUT_FOLDER'] = tmp_dir
+    try:
+        task = TranslationTask('test_glossary_task', 'book.md', 'Chinese')
+        task.max_concurrency = 1
+        task.chunks_info = [{'id': i, 'chapters': [f'Chapter {i}'], 'content': CHUNKS[i][0]} for i in CHUNKS]
+        task.total_chunks = len(CHUNKS)
+        translate_book_task(task)
+        assert task.status == 'completed', task.error
+
+        response = app.app.test_client().get(f'/api/glossary/{task.task_id}').get_json()
+        missing = app.app.test_client().get('/api/glossary/no_such_task')
+    finally:
+        for name, value in originals.items():
+            setattr(app, name, value)
+        app.app.config['OUTPUT_FOLDER'] = original_output
+
+    assert '→' not in prompts[1] and '→' not in prompts[2]
+    assert 'containment → 遏制' in prompts[3]
+    assert response['confirmed'] == {'containment': '遏制'}
+    assert response['issues'] == [{'chunk_id': 3, 'term': 'containment', 'expected': '遏制', 'found': ['控制']}]
+    assert response['candidates']['containment']['控制'] == 1
+    assert task.metrics['term_inconsistencies'] == 1
+    assert missing.status_code == 404
+    print("✅ Test 6: translation task learns and reports - PASSED")
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("🧪 Testing Bilingual Glossary")
+    print("=" * 60)
+    test_learns_rendering_from_annotations()
+    test_overlapping_terms_and_latin_targets()
+    test_latin_renderings_skip_articles()
+    test_confirmation_needs_support()
+    test_check_flags_drift_and_prompt_uses_pairs()
+    test_translation_task_learns_and_reports()
+    print("=" * 60)
+    print("✅ All tests passed!")
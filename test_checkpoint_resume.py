@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+测试分块检查点与断点续传
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+
+# 添加项目路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+import app
+from app import (TranslationTask, CheckpointStore, IncrementalOutputWriter, TaskStore,
+                 SourceUnavailableError, translate_book_task, restore_task_from_checkpoint)
+
+
+class use_tmp_environment:
+    """输出目录、检查点目录和任务仓库指向临时目录（退出时恢复)"""
+    def __enter__(self):
+        self.originals = (app.app.config['OUTPUT_FOLDER'], app.checkpoint_store, app.task_store)
+        tmp_dir = Path(tempfile.mkdtemp(prefix='resume_test_'))
+        app.app.config['OUTPUT_FOLDER'] = tmp_dir
+        app.checkpoint_store = CheckpointStore(tmp_dir / 'checkpoints')
+        app.task_store = TaskStore(tmp_dir / 'tasks.sqlite3')
+        source = tmp_dir / 'book.md'
+        source.write_text(''.join(f"## Chapter {i}\n\nBody {i}.\n\n" for i in range(1, 6)), encoding='utf-8')
+        return tmp_dir, source
+
+    def __exit__(self, *exc):
+        app.app.config['OUTPUT_FOLDER'], app.checkpoint_store, app.task_store = self.originals
+
+
+def make_task(task_id, source):
+    task = TranslationTask(task_id, source.name, "Chinese")
+    task.source_path = str(source)
+    task.use_terminology = False
+    task.max_concurrency = 1
+    task.chunks_info = [
+        {'id': i, 'chapters': [f'Chapter {i}'], 'content': f'## Chapter {i}\n\nBody {i}.'}
+        for i in range(1, 6)
+    ]
+    task.total_chunks = 5
+    return task
+
+
+def test_failed_task_resumes_only_missing_chunks():
+    """第 4 块失败后恢复，只翻译第 4、5 块"""
+    with use_tmp_environment() as (tmp_dir, source):
+        translated = []
+
+        def flaky_translate(task, chunk_id, total_chunks, chunk_content, language, **kwargs):
+            if chunk_id == 4 and not translated.count('failed'):
+                translated.append('failed')
+                raise RuntimeError("502 Bad Gateway")
+            translated.append(chunk_id)
+            return f"译文 {chunk_id}"
+
+        original = app.translate_chunk_web, app.TRANSLATION_ENGINE
+        app.translate_chunk_web, app.TRANSLATION_ENGINE = flaky_translate, 'threads'  # 同步假函数走线程池
+        try:
+            task = make_task('resume_test', source)
+            translate_book_task(task)
+            assert task.status == 'failed'
+            assert sorted(app.checkpoint_store.load_chunks('resume_test')) == [1, 2, 3]
+
+            # 模拟进程重启：从检查点重建任务
+            restored = restore_task_from_checkpoint('resume_test')
+            assert restored is not None
+            assert sorted(restored.resume_checkpoints) == [1, 2, 3]
+            assert restored.source_content.startswith('## Chapter 1')
+
+            translated.clear()
+            translated.append('failed')  # 第二次不再失败
+            translate_book_task(restored)
+        finally:
+            app.translate_chunk_web, app.TRANSLATION_ENGINE = original
+
+        assert restored.status == 'completed', restored.error
+        assert translated[1:] == [4, 5], translated
+        final = Path(restored.result_file).read_text(encoding='utf-8')
+        assert final == '\n\n'.join(f"译文 {i}" for i in range(1, 6))
+        partial = (tmp_dir / 'resume_test_Chinese.md').read_text(encoding='utf-8')
+        assert partial.count('<!-- Chunk') == 5
+        assert partial.index('译文 1') < partial.index('译文 4') < partial.index('译文 5')
+    print("✅ Test 1: resume translates only missing chunks - PASSED")
+
+
+def test_checkpoint_contents():
+    """检查点包含译文、术语状态和上下文尾部"""
+    with use_tmp_environment():
+        store = app.checkpoint_store
+        chunk = {'id': 7, 'chapters': ['Chapter 7']}
+        store.save_chunk('cp_test', chunk, "第一段\n\n第二段", ['AI', 'AGI'], "第二段")
+        checkpoint = store.load_chunks('cp_test')[7]
+        assert store.read_segment('cp_test', 7) == "第一段\n\n第二段"
+        assert checkpoint['chars'] == len("第一段\n\n第二段")
+        assert checkpoint['terminology'] == ['AI', 'AGI']
+        assert checkpoint['context_tail'] == "第二段"
+        assert not list(store.task_dir('cp_test').glob('*.tmp')), "temporary files left behind"
+    print("✅ Test 2: checkpoint contents - PASSED")
+
+
+def test_incremental_writer_appends_each_chunk_once():
+    """乱序完成时按顺序追加，每块只写一次"""
+    with use_tmp_environment() as (tmp_dir, _):
+        segments = {}
+        for chunk_id in (1, 2, 3):
+            segments[chunk_id] = tmp_dir / f"seg_{chunk_id}.md"
+            segments[chunk_id].write_text(f"段落 {chunk_id}", encoding='utf-8')
+
+        output = tmp_dir / 'partial.md'
+        writer = IncrementalOutputWriter(output, [1, 2, 3], segments.__getitem__)
+        done = {}
+        done[2] = {'chapters': ['B']}
+        assert writer.append_ready(done) == 0, "chunk 2 must wait for chunk 1"
+        done[1] = {'chapters': ['A']}
+        assert writer.append_ready(done) == 2
+        assert writer.append_ready(done) == 0, "nothing is written twice"
+        done[3] = {'chapters': ['C']}
+        assert writer.append_ready(done) == 1
+        writer.close()
+
+        text = output.read_text(encoding='utf-8')
+        assert text.count('段落 1') == text.count('段落 2') == text.count('段落 3') == 1
+        assert text.index('段落 1') < text.index('段落 2') < text.index('段落 3')
+    print("✅ Test 3: incremental writer - PASSED")
+
+
+def test_no_checkpoint_returns_none():
+    """没有检查点时无法恢复"""
+    with use_tmp_environment():
+        assert restore_task_from_checkpoint('missing_task') is None
+    print("✅ Test 4: missing checkpoint - PASSED")
+
+
+def test_missing_source_is_not_resumed():
+    """原文文件被删除后，按偏移保存的未完成块无法恢复：不能用空原文"翻译"缺失的块"""
+    with use_tmp_environment() as (tmp_dir, source):
+        text = source.read_text(encoding='utf-8')
+        starts = [text.index(f"## Chapter {i}") for i in range(1, 6)] + [len(text)]
+        task = make_task('resume_missing_source', source)
+        for chunk, start, end in zip(task.chunks_info, starts, starts[1:]):
+            del chunk['content']
+            chunk['spans'] = [[start, end]]
+
+        def failing_translate(task, chunk_id, total_chunks, chunk_content, language, **kwargs):
+            if chunk_id == 3:
+                raise RuntimeError("401 Unauthorized")
+            return f"译文 {chunk_id}"
+
+        original = app.translate_chunk_web, app.TRANSLATION_ENGINE
+        app.translate_chunk_web, app.TRANSLATION_ENGINE = failing_translate, 'threads'
+        app.task_store.save(task)
+        try:
+            translate_book_task(task)
+        finally:
+            app.translate_chunk_web, app.TRANSLATION_ENGINE = original
+        assert task.status == 'failed'
+
+        source.unlink()
+        try:
+            restore_task_from_checkpoint('resume_missing_source')
+            assert False, "expected SourceUnavailableError"
+        except SourceUnavailableError:
+            pass
+        response = app.app.test_client().post('/api/resume/resume_missing_source', json={})
+        assert response.status_code == 409, response.get_json()
+        assert app.task_store.get_status('resume_missing_source')['status'] == 'failed'
+    print("✅ Test 5: missing source is not resumed - PASSED")
+
+
+def test_resume_claims_task_first():
+    """恢复前先在仓库中占用任务：已被其他进程占用时拒绝；队列已满时退回原状态"""
+    with use_tmp_environment() as (tmp_dir, source):
+        task = make_task('resume_claim_task', source)
+
+        def failing_translate(task, chunk_id, total_chunks, chunk_content, language, **kwargs):
+            if chunk_id == 2:
+                raise RuntimeError("401 Unauthorized")
+            return f"译文 {chunk_id}"
+
+        original = app.translate_chunk_web, app.TRANSLATION_ENGINE
+        app.translate_chunk_web, app.TRANSLATION_ENGINE = failing_translate, 'threads'
+        app.task_store.save(task)
+        try:
+            translate_book_task(task)
+        finally:
+            app.translate_chunk_web, app.TRANSLATION_ENGINE = original
+        assert task.status == 'failed'
+        client = app.app.test_client()
+
+        def full_queue(task):
+            raise app.QueueFullError("full")
+
+        original_submit = app.translation_queue.submit
+        app.translation_queue.submit = full_queue
+        try:
+            assert client.post('/api/resume/resume_claim_task', json={}).status_code == 429
+        finally:
+            app.translation_queue.submit = original_submit
+        assert app.task_store.get_status(task.task_id)['status'] == 'failed'
+
+        # 另一个进程刚刚占用了任务，本进程的内存副本还是 failed
+        other = TaskStore(tmp_dir / 'tasks.sqlite3')
+        assert other.claim(other.load(task.task_id, with_source=False), 'failed', 'queued')
+        restored = []
+        original_get, original_restore = app.get_task, app.restore_task_from_checkpoint
+        app.get_task = lambda task_id, with_source=True: task
+        app.restore_task_from_checkpoint = lambda task_id: restored.append(task_id)
+        try:
+            response = client.post('/api/resume/resume_claim_task', json={})
+        finally:
+            app.get_task, app.restore_task_from_checkpoint = original_get, original_restore
+        assert response.status_code == 400 and restored == []
+    print("✅ Test 6: resume claims task first - PASSED")
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("🧪 Testing Checkpoint Resume")
+    print("=" * 60)
+    test_failed_task_resumes_only_missing_chunks()
+    test_checkpoint_contents()
+    test_incremental_writer_appends_each_chunk_once()
+    test_no_checkpoint_returns_none()
+    test_missing_source_is_not_resumed()
+    test_resume_claims_task_first()
+    print("=" * 60)
+    print("✅ All tests passed!")
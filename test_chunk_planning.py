@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+测试分块规划（token 预算、超大章节切分、无标题文档分段)
+"""
+
+import sys
+from pathlib import Path
+
+# 添加项目路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+import app
+from app import (estimate_tokens, plan_chunk_budget, plan_chunks, extract_chapters,
+                 index_markdown, split_oversized_range, chunk_text)
+
+
+def make_book(num_chapters, paragraphs_per_chapter=20):
+    """生成多章节英文测试文本"""
+    paragraph = "The model reads the whole passage before it writes a single word of output. " * 6
+    return ''.join(
+        f"## Chapter {i}\n\n" + (paragraph + "\n\n") * paragraphs_per_chapter
+        for i in range(1, num_chapters + 1)
+    )
+
+
+def test_estimate_tokens():
+    """英文约 4 字符/token，CJK 约 1 字/token"""
+    assert estimate_tokens("") == 0
+    english = estimate_tokens("a" * 4000)
+    chinese = estimate_tokens("中" * 1000)
+    assert 950 <= english <= 1050, english
+    assert 950 <= chinese <= 1050, chinese
+    print("✅ Test 1: token estimation - PASSED")
+
+
+def test_budget_respects_model_output_limit():
+    """预计译文 token 不超过模型 max_tokens（含安全余量)"""
+    content = make_book(5)
+    original = app.CHUNK_TARGET_SIZE
+    app.CHUNK_TARGET_SIZE = 110000
+    try:
+        for model_key, config in app.MODEL_CONFIGS.items():
+            budget = plan_chunk_budget(content, 'Chinese', model_key)
+            expected_output = budget['max_source_tokens'] * budget['token_ratio']
+            assert expected_output <= config['max_tokens'], (model_key, budget)
+            assert budget['max_source_tokens'] * (1 + budget['token_ratio']) <= config['context_window']
+    finally:
+        app.CHUNK_TARGET_SIZE = original
+    print("✅ Test 2: budget within model limits - PASSED")
+
+
+def test_cjk_targets_get_smaller_chunks():
+    """膨胀系数越大的目标语言，块越小"""
+    content = make_book(5)
+    original = app.CHUNK_TARGET_SIZE
+    app.CHUNK_TARGET_SIZE = 110000
+    try:
+        french = plan_chunk_budget(content, 'French', 'deepseek-free')['target_chars']
+        chinese = plan_chunk_budget(content, 'Chinese', 'deepseek-free')['target_chars']
+        hindi = plan_chunk_budget(content, 'Hindi', 'deepseek-free')['target_chars']
+    finally:
+        app.CHUNK_TARGET_SIZE = original
+    assert french > chinese > hindi, (french, chinese, hindi)
+    print("✅ Test 3: language-aware budget - PASSED")
+
+
+def test_chunks_carry_token_estimates():
+    """每块标注原文/译文 token 数"""
+    content = make_book(6)
+    budget = plan_chunk_budget(content, 'Japanese', 'deepseek-free')
+    chunks = plan_chunks(extract_chapters(content), content, budget)
+    for chunk in chunks:
+        assert chunk['source_tokens'] > 0
+        assert chunk['output_tokens'] == int(chunk['source_tokens'] * budget['token_ratio'])
+        assert 'exceeds_budget' in chunk
+    print("✅ Test 4: per-chunk token estimates - PASSED")
+
+
+def fixed_budget(target_chars):
+    """固定字符预算（不依赖模型配置)"""
+    return {'target_chars': target_chars, 'token_ratio': 1.5, 'max_output_tokens': 10 ** 9}
+
+
+def test_oversized_chapter_splits_at_subheadings():
+    """超大章节优先在 ### 标题处切分，块大小在目标附近"""
+    section = "### Section {i}\n\n" + ("A sentence about the topic at hand. " * 30 + "\n\n") * 5
+    content = "## Huge Chapter\n\n" + ''.join(section.format(i=i) for i in range(40))
+    target = 20000
+    chunks = plan_chunks(extract_chapters(content), content, fixed_budget(target))
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert chunk['size'] <= target, chunk['size']
+        assert chunk['size'] >= target * 0.5, chunk['size']
+        assert chunk_text(content, chunk).startswith('##'), chunk_text(content, chunk)[:40]
+    assert chunks[0]['chapters'][0].startswith('Huge Chapter (part 1/')
+    assert ''.join(chunk_text(content, c) for c in chunks) == content
+    print("✅ Test 5: split at subheadings - PASSED")
+
+
+def test_oversized_chapter_splits_at_paragraphs():
+    """没有子标题时在空行段落处切分"""
+    content = "## Long Chapter\n\n" + ("Plain paragraph text goes here and on. " * 20 + "\n\n") * 200
+    target = 15000
+    chunks = plan_chunks(extract_chapters(content), content, fixed_budget(target))
+    assert len(chunks) > 1
+    for chunk in chunks[:-1]:
+        assert chunk_text(content, chunk).endswith('\n\n'), repr(chunk_text(content, chunk)[-20:])
+        assert target * 0.5 <= chunk['size'] <= target
+    assert ''.join(chunk_text(content, c) for c in chunks) == content
+    print("✅ Test 6: split at paragraphs - PASSED")
+
+
+def test_code_blocks_and_tables_are_never_cut():
+    """围栏代码块和表格不会被切开"""
+    code = "```python\n" + "\n\n".join(f"x_{i} = {i}  # value" for i in range(300)) + "\n```\n\n"
+    table = "| Name | Value |\n| --- | --- |\n" + ''.join(f"| row {i} | {i} |\n" for i in range(300)) + "\n"
+    filler = ("Some explanatory prose. " * 20 + "\n\n") * 10
+    content = "## Chapter\n\n" + filler + code + filler + table + filler
+    index = index_markdown(content)
+    assert len(index['code_blocks']) == 1 and len(index['tables']) == 1
+    pieces = split_oversized_range(content, 0, len(content), 4000, index)
+    protected = [(b['start_pos'], b['end_pos']) for b in index['code_blocks'] + index['tables']]
+    for piece_start, _ in pieces[1:]:
+        for block_start, block_end in protected:
+            assert not (block_start < piece_start < block_end), "cut inside protected block"
+    assert pieces[0][0] == 0 and pieces[-1][1] == len(content)
+    assert all(a[1] == b[0] for a, b in zip(pieces, pieces[1:]))
+    print("✅ Test 7: code blocks and tables kept whole - PASSED")
+
+
+def test_headingless_document_snaps_to_boundaries():
+    """无标题文档：切点落在段落/句子边界，不切断单词"""
+    sentence = "Every sentence in this document ends with a full stop. "
+    content = ''.join((sentence * (5 + i % 7)).strip() + "\n\n" for i in range(400))
+    target = 6000
+    chunks = plan_chunks(extract_chapters(content), content, fixed_budget(target))
+    assert len(chunks) > 1
+    assert ''.join(chunk_text(content, c) for c in chunks) == content
+    for chunk in chunks[:-1]:
+        assert chunk_text(content, chunk).endswith('\n\n') or chunk_text(content, chunk).endswith('. '), repr(chunk_text(content, chunk)[-20:])
+        assert target * 0.5 <= chunk['size'] <= target
+    # 与章节路径相同的元数据结构
+    for key in ('id', 'chapters', 'start_pos', 'end_pos', 'size', 'spans', 'source_tokens', 'output_tokens'):
+        assert key in chunks[0], key
+    assert chunks[0]['chapters'] == ['Segment 1']
+    print("✅ Test 8: heading-less segmentation - PASSED")
+
+
+def test_headingless_without_paragraphs_uses_sentences():
+    """无空行的长文本退回到句子边界"""
+    content = "One long run-on paragraph keeps going. " * 1000
+    target = 5000
+    chunks = plan_chunks([], content, fixed_budget(target))
+    assert ''.join(chunk_text(content, c) for c in chunks) == content
+    for chunk in chunks[:-1]:
+        assert chunk_text(content, chunk).endswith('going. '), repr(chunk_text(content, chunk)[-20:])
+    print("✅ Test 9: sentence fallback - PASSED")
+
+
+def test_demo_files_keep_one_chapter_per_chunk():
+    """Demo 配置下，两个 Demo 文件都是每章一块（章节略大于目标大小时不切分)"""
+    if not app.DEMO_MODE:
+        print("⏭️  Test 10: demo files (DEMO_MODE off) - SKIPPED")
+        return
+    for name in ('Mustafa_Book_Quick_Demo.md', 'Mustafa_Book_Demo.md'):
+        content = (Path(__file__).parent / 'demo_files' / name).read_text(encoding='utf-8')
+        chunks = plan_chunks(extract_chapters(content), content)
+        assert len(chunks) == 3, (name, [c['size'] for c in chunks])
+        assert all(len(c['chapters']) == 1 and 'part' not in c['chapters'][0] for c in chunks)
+    print("✅ Test 10: demo files keep one chapter per chunk - PASSED")
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("🧪 Testing Chunk Planning")
+    print("=" * 60)
+    test_estimate_tokens()
+    test_budget_respects_model_output_limit()
+    test_cjk_targets_get_smaller_chunks()
+    test_chunks_carry_token_estimates()
+    test_oversized_chapter_splits_at_subheadings()
+    test_oversized_chapter_splits_at_paragraphs()
+    test_code_blocks_and_tables_are_never_cut()
+    test_headingless_document_snaps_to_boundaries()
+    test_headingless_without_paragraphs_uses_sentences()
+    test_demo_files_keep_one_chapter_per_chunk()
+    print("=" * 60)
+    print("✅ All tests passed!")
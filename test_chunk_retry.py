@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+测试分块翻译失败重试（指数退避、错误分类、断流续写)
+"""
+
+import sys
+from pathlib import Path
+
+# 添加项目路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+import app
+from app import TranslationTask, is_retryable_error, retry_delay, recoverable_prefix
+from testing_helpers import FakeAPIError, delta, reset_breakers
+
+
+def run_chunk(scripted_attempts):
+    """按脚本依次模拟每次 completion 调用：(输出片段列表, 流结束后抛出的异常或 None)"""
+    calls = []
+
+    def fake_completion(**kwargs):
+        calls.append(kwargs['messages'])
+        pieces, error = scripted_attempts[len(calls) - 1]
+
+        def stream():
+            for piece in pieces:
+                yield delta(piece)
+            if error is not None:
+                raise error
+        return stream()
+
+    task = TranslationTask('test_retry_task', 'book.md', 'Chinese')
+    task.total_chunks = 1
+    reset_breakers()
+    originals = (app.completion, app.translation_memory, app.RETRY_BASE_DELAY, app.rate_limiters)
+    app.completion, app.translation_memory, app.RETRY_BASE_DELAY = fake_completion, None, 0
+    app.rate_limiters = {}  # 不限速
+    try:
+        result = app.translate_chunk_web(task, 1, 1, "Source text", "Chinese")
+        error = None
+    except Exception as e:
+        result, error = None, e
+    finally:
+        app.completion, app.translation_memory, app.RETRY_BASE_DELAY, app.rate_limiters = originals
+    return task, result, error, calls
+
+
+def test_error_classification():
+    """429/5xx/网络错误可重试，其他 4xx 为致命错误"""
+    assert is_retryable_error(FakeAPIError(502))
+    assert is_retryable_error(FakeAPIError(429))
+    assert not is_retryable_error(FakeAPIError(401))
+    assert not is_retryable_error(FakeAPIError(400))
+    assert is_retryable_error(ConnectionResetError())
+    assert is_retryable_error(TimeoutError())
+    assert is_retryable_error(type('RemoteProtocolError', (Exception,), {})())
+    assert not is_retryable_error(ValueError("bad"))
+    assert not is_retryable_error(app.TranslationCancelled())
+    print("✅ Test 1: error classification - PASSED")
+
+
+def test_backoff_grows_with_jitter():
+    """退避时间指数增长，带抖动且不超过上限"""
+    for attempt in range(1, 10):
+        cap = min(app.RETRY_MAX_DELAY, app.RETRY_BASE_DELAY * 2 ** (attempt - 1))
+        for _ in range(20):
+            delay = retry_delay(attempt)
+            assert cap / 2 <= delay <= cap
+    print("✅ Test 2: jittered exponential backoff - PASSED")
+
+
+def test_transient_error_is_retried():
+    """瞬时 502 后重试成功，日志和统计记录重试"""
+    task, result, error, calls = run_chunk([
+        ([], FakeAPIError(502, "Bad Gateway")),
+        (["译文完成"], None),
+    ])
+    assert error is None and result == "译文完成"
+    assert len(calls) == 2
+    assert task.metrics['retries'] == 1 and task.metrics['api_calls'] == 2
+    assert any('🔁' in log['message'] for log in task.logs)
+    print("✅ Test 3: transient error retried - PASSED")
+
+
+def test_fatal_error_not_retried():
+    """鉴权失败等致命错误不重试"""
+    task, result, error, calls = run_chunk([([], FakeAPIError(401, "Unauthorized"))])
+    assert isinstance(error, FakeAPIError) and len(calls) == 1
+    assert task.metrics['fatal_errors'] == 1 and task.metrics['retries'] == 0
+    print("✅ Test 4: fatal error not retried - PASSED")
+
+
+def test_gives_up_after_max_attempts():
+    """超过最大尝试次数后抛出异常"""
+    attempts = [([], FakeAPIError(503))] * app.CHUNK_MAX_ATTEMPTS
+    task, result, error, calls = run_chunk(attempts)
+    assert isinstance(error, FakeAPIError)
+    assert len(calls) == app.CHUNK_MAX_ATTEMPTS
+    assert task.metrics['retries'] == app.CHUNK_MAX_ATTEMPTS - 1
+    print("✅ Test 5: gives up after max attempts - PASSED")
+
+
+def test_partial_stream_is_continued():
+    """断流时保留完整段落，续写请求带上已收到的译文"""
+    first = "第一段。" * 60 + "\n\n"
+    broken = "第二段写到一半"
+    task, result, error, calls = run_chunk([
+        ([first, broken], ConnectionResetError("stream reset")),
+        (["\n\n第二段完整。"], None),
+    ])
+    assert error is None
+    assert result == first + "第二段完整。"
+    assert calls[1][-2] == {"role": "assistant", "content": first}
+    assert task.metrics['recovered_chars'] == len(first)
+    print("✅ Test 6: partial stream continued - PASSED")
+
+
+def test_short_partial_restarts():
+    """已收到的译文太短时整块重译"""
+    assert recoverable_prefix("短\n\n") == ""
+    task, result, error, calls = run_chunk([
+        (["开头"], ConnectionResetError()),
+        (["完整译文"], None),
+    ])
+    assert result == "完整译文"
+    assert len(calls[1]) == 2, "retry should resend the original prompt only"
+    print("✅ Test 7: short partial restarts - PASSED")
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("🧪 Testing Chunk Retry")
+    print("=" * 60)
+    test_error_classification()
+    test_backoff_grows_with_jitter()
+    test_transient_error_is_retried()
+    test_fatal_error_not_retried()
+    test_gives_up_after_max_attempts()
+    test_partial_stream_is_continued()
+    test_short_partial_restarts()
+    print("=" * 60)
+    print("✅ All tests passed!")
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+测试并发分块翻译调度
+"""
+
+import sys
+import time
+import threading
+from concurrent import futures
+from pathlib import Path
+
+# 添加项目路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+import app
+from app import translate_chunks_concurrently
+from testing_helpers import make_task
+
+
+def run_with_fake_translator(task, delays, terminology=None):
+    """用假翻译函数替换 LLM 调用，记录调用参数"""
+    calls = {}
+    in_flight = {'now': 0, 'max': 0}
+    lock = threading.Lock()
+
+    def fake_translate(task, chunk_id, total_chunks, chunk_content, language,
+                       prev_context="", terminology=None, context_is_source=False):
+        with lock:
+            in_flight['now'] += 1
+            in_flight['max'] = max(in_flight['max'], in_flight['now'])
+            calls[chunk_id] = {'prev_context': prev_context, 'context_is_source': context_is_source}
+        time.sleep(delays.get(chunk_id, 0.05))
+        with lock:
+            in_flight['now'] -= 1
+        return f"译文 {chunk_id}"
+
+    done_order = []
+    original = app.translate_chunk_web, app.TRANSLATION_ENGINE
+    app.translate_chunk_web, app.TRANSLATION_ENGINE = fake_translate, 'threads'  # 同步假函数走线程池
+    try:
+        results = translate_chunks_concurrently(
+            task, task.chunks_info, terminology,
+            lambda chunk, translation: done_order.append(chunk['id'])
+        )
+    finally:
+        app.translate_chunk_web, app.TRANSLATION_ENGINE = original
+    return results, calls, in_flight['max'], done_order
+
+
+def test_results_keep_chunk_order():
+    """结果按块 id 完整返回，最慢的块不影响顺序"""
+    task = make_task(6, 3)
+    results, _, _, _ = run_with_fake_translator(task, {1: 0.2, 2: 0.01, 3: 0.01})
+    assert [results[c['id']] for c in task.chunks_info] == [f"译文 {i}" for i in range(1, 7)]
+    print("✅ Test 1: results keep chunk order - PASSED")
+
+
+def test_concurrency_limit_respected():
+    """同时在途的块数不超过配置的并发数"""
+    task = make_task(8, 3)
+    _, _, max_in_flight, _ = run_with_fake_translator(task, {})
+    assert max_in_flight <= 3, f"max in flight: {max_in_flight}"
+    assert max_in_flight >= 2, f"chunks did not run in parallel: {max_in_flight}"
+    print("✅ Test 2: concurrency limit respected - PASSED")
+
+
+def test_wall_clock_drops_with_concurrency():
+    """并发数为 4 时，总耗时约为串行的 1/4"""
+    delays = {i: 0.1 for i in range(1, 9)}
+    start = time.time()
+    run_with_fake_translator(make_task(8, 1), delays)
+    serial = time.time() - start
+
+    start = time.time()
+    run_with_fake_translator(make_task(8, 4), delays)
+    parallel = time.time() - start
+
+    assert parallel < serial / 2.5, f"serial {serial:.2f}s, parallel {parallel:.2f}s"
+    print(f"✅ Test 3: wall clock {serial:.2f}s → {parallel:.2f}s - PASSED")
+
+
+def test_source_context_when_previous_not_ready():
+    """上一块译文未完成时，使用上一块原文末尾作为上下文"""
+    task = make_task(3, 3)
+    _, calls, _, _ = run_with_fake_translator(task, {1: 0.1, 2: 0.1, 3: 0.1})
+    assert calls[1]['prev_context'] == ""
+    assert calls[2]['context_is_source'] is True
+    assert 'Source paragraph of chunk 1' in calls[2]['prev_context']
+    print("✅ Test 4: source context fallback - PASSED")
+
+
+def test_translation_context_when_previous_ready():
+    """串行调度时，始终使用上一块译文作为上下文"""
+    task = make_task(3, 1)
+    _, calls, _, _ = run_with_fake_translator(task, {})
+    assert calls[2]['context_is_source'] is False
+    assert calls[2]['prev_context'] == "译文 1"
+    print("✅ Test 5: translation context - PASSED")
+
+
+def test_failure_cancels_task():
+    """任一块失败时任务被取消并抛出异常"""
+    task = make_task(5, 2)
+
+    def failing_translate(task, chunk_id, **kwargs):
+        if chunk_id == 2:
+            raise RuntimeError("boom")
+        time.sleep(0.05)
+        return f"译文 {chunk_id}"
+
+    original = app.translate_chunk_web, app.TRANSLATION_ENGINE
+    app.translate_chunk_web, app.TRANSLATION_ENGINE = failing_translate, 'threads'
+    try:
+        translate_chunks_concurrently(task, task.chunks_info, None, lambda c, t: None)
+        assert False, "expected RuntimeError"
+    except RuntimeError:
+        pass
+    finally:
+        app.translate_chunk_web, app.TRANSLATION_ENGINE = original
+    assert task.cancel_event.is_set()
+    print("✅ Test 6: failure cancels task - PASSED")
+
+
+def test_failure_keeps_finished_siblings():
+    """第 2 块失败、第 3 块在同一批完成时，第 3 块仍然回调保存；失败后不再提交新块"""
+    task = make_task(5, 3)
+    called = []
+
+    def failing_translate(task, chunk_id, **kwargs):
+        called.append(chunk_id)
+        if chunk_id == 2:
+            raise RuntimeError("boom")
+        return f"译文 {chunk_id}"
+
+    # 等到三块都结束再返回，让失败块和成功块落在同一批
+    def wait_all(fs, return_when=None):
+        return futures.wait(fs, return_when=futures.ALL_COMPLETED)
+
+    done = []
+    original = app.translate_chunk_web, app.TRANSLATION_ENGINE, app.wait
+    app.translate_chunk_web, app.TRANSLATION_ENGINE, app.wait = failing_translate, 'threads', wait_all
+    try:
+        translate_chunks_concurrently(task, task.chunks_info, None, lambda c, t: done.append(c['id']))
+        assert False, "expected RuntimeError"
+    except RuntimeError:
+        pass
+    finally:
+        app.translate_chunk_web, app.TRANSLATION_ENGINE, app.wait = original
+    assert done == [1, 3]
+    assert sorted(called) == [1, 2, 3], called
+    assert task.cancel_event.is_set()
+    print("✅ Test 7: finished siblings of a failed chunk are kept - PASSED")
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("🧪 Testing Concurrent Chunk Scheduler")
+    print("=" * 60)
+    test_results_keep_chunk_order()
+    test_concurrency_limit_respected()
+    test_wall_clock_drops_with_concurrency()
+    test_source_context_when_previous_not_ready()
+    test_translation_context_when_previous_ready()
+    test_failure_cancels_task()
+    test_failure_keeps_finished_siblings()
+    print("=" * 60)
+    print("✅ All tests passed!")
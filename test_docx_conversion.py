@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+测试 DOCX 流式转换（按文档顺序输出标题、段落、列表和表格)
+"""
+
+import sys
+import zipfile
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+from docx import Document
+from docx.enum.style import WD_STYLE_TYPE
+
+# 添加项目路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+from app import convert_docx_to_markdown, convert_docx_to_markdown_file
+
+
+def new_tmp_dir():
+    return Path(tempfile.mkdtemp(prefix='docx_test_'))
+
+
+def build_sample_docx(path):
+    doc = Document()
+    doc.add_heading('The Book', level=0)
+    doc.add_heading('Chapter 1', level=1)
+    doc.add_paragraph('First paragraph.')
+    table = doc.add_table(rows=2, cols=2)
+    table.cell(0, 0).text = 'Name'
+    table.cell(0, 1).text = 'Value | unit'
+    table.cell(1, 0).text = 'Alpha'
+    table.cell(1, 1).text = '1'
+    doc.add_paragraph('After the table.')
+    doc.add_paragraph('Apples', style='List Bullet')
+    doc.add_paragraph('Pears', style='List Bullet')
+    doc.add_paragraph('Step one', style='List Number')
+    doc.add_paragraph('Step two', style='List Number')
+    doc.add_heading('Section 1.1', level=2)
+    doc.add_heading('Detail', level=3)
+    doc.add_paragraph('')
+    doc.add_paragraph('Last paragraph.')
+    doc.save(path)
+
+
+def test_document_order_and_structure():
+    """表格留在原位置，标题、列表按样式转换"""
+    path = new_tmp_dir() / 'sample.docx'
+    build_sample_docx(path)
+    markdown = convert_docx_to_markdown(path)
+    expected = "\n".join([
+        "# The Book",
+        "",
+        "# Chapter 1",
+        "",
+        "First paragraph.",
+        "",
+        "| Name | Value \\| unit |",
+        "| --- | --- |",
+        "| Alpha | 1 |",
+        "",
+        "After the table.",
+        "",
+        "- Apples",
+        "- Pears",
+        "1. Step one",
+        "2. Step two",
+        "",
+        "## Section 1.1",
+        "",
+        "### Detail",
+        "",
+        "Last paragraph.",
+    ])
+    assert markdown == expected, markdown
+    print("✅ Test 1: document order and structure - PASSED")
+
+
+def test_custom_heading_style_inherits_level():
+    """基于 Heading 2 的自定义样式按二级标题输出"""
+    path = new_tmp_dir() / 'styles.docx'
+    doc = Document()
+    custom = doc.styles.add_style('Part Title', WD_STYLE_TYPE.PARAGRAPH)
+    custom.base_style = doc.styles['Heading 2']
+    doc.add_paragraph('Part One', style='Part Title')
+    doc.add_paragraph('Body text.')
+    doc.save(path)
+    assert convert_docx_to_markdown(path) == "## Part One\n\nBody text."
+    print("✅ Test 2: custom heading style - PASSED")
+
+
+def write_large_docx(path, paragraphs):
+    """直接写 document.xml，快速生成大文档"""
+    body = ''.join(
+        f'<w:p><w:r><w:t>Paragraph {i} of a long manuscript with some filler text to make it realistic.</w:t></w:r></w:p>'
+        for i in range(paragraphs)
+    )
+    xml = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+           '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+           f'<w:body>{body}<w:sectPr/></w:body></w:document>')
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr('word/document.xml', xml)
+
+
+def peak_conversion_memory(tmp_dir, paragraphs):
+    source = tmp_dir / f'large_{paragraphs}.docx'
+    write_large_docx(source, paragraphs)
+    target = tmp_dir / f'large_{paragraphs}.md'
+    tracemalloc.start()
+    try:
+        stats = convert_docx_to_markdown_file(source, target)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert stats['chars'] == len(target.read_text(encoding='utf-8'))
+    return peak
+
+
+def test_streaming_memory_is_bounded():
+    """转换到文件时峰值内存不随段落数增长"""
+    tmp_dir = new_tmp_dir()
+    small = peak_conversion_memory(tmp_dir, 2000)
+    large = peak_conversion_memory(tmp_dir, 20000)
+    assert large < small * 3, f"peak grew from {small:,} to {large:,} bytes"
+    assert not list(tmp_dir.glob('*.tmp'))
+    print(f"✅ Test 3: peak memory {small:,} -> {large:,} bytes for 10x paragraphs - PASSED")
+
+
+def test_invalid_file_reports_error():
+    """损坏的文件返回转换错误，不留下半个输出文件"""
+    tmp_dir = new_tmp_dir()
+    bad = tmp_dir / 'bad.docx'
+    bad.write_bytes(b'not a zip file')
+    try:
+        convert_docx_to_markdown_file(bad, tmp_dir / 'bad.md')
+        assert False, "expected conversion error"
+    except Exception as e:
+        assert 'DOCX conversion failed' in str(e)
+    assert not (tmp_dir / 'bad.md').exists()
+    assert not list(tmp_dir.glob('*.tmp'))
+    print("✅ Test 4: invalid file error - PASSED")
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("🧪 Testing DOCX Conversion")
+    print("=" * 60)
+    test_document_order_and_structure()
+    test_custom_heading_style_inherits_level()
+    test_streaming_memory_is_bounded()
+    test_invalid_file_reports_error()
+    print("=" * 60)
+    print("✅ All tests passed!")
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+测试翻译结果下载（预压缩、内容协商、Range 请求、强 ETag)
+"""
+
+import os
+import sys
+import gzip
+import hashlib
+import tempfile
+from pathlib import Path
+
+# 添加项目路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+import app
+from app import TaskStore, TranslationTask, build_download_artifacts, download_artifacts
+
+RESULT = "## 第一章\n\n" + "这是译文的一段内容，用来测试下载。\n" * 400
+
+
+class completed_task:
+    """临时目录中的已完成任务（任务仓库也换成临时的)"""
+    def __init__(self, text=RESULT):
+        self.text = text
+
+    def __enter__(self):
+        root = Path(tempfile.mkdtemp(prefix='download_test_'))
+        self.result_file = root / 'book_Chinese_final.md'
+        self.result_file.write_text(self.text, encoding='utf-8')
+        self.original_store = app.task_store
+        app.task_store = TaskStore(root / 'tasks.sqlite3')
+        self.task = TranslationTask('test_download_task', 'book.md', 'Chinese')
+        self.task.status, self.task.result_file = 'completed', str(self.result_file)
+        app.tasks[self.task.task_id] = self.task
+        return self
+
+    def __exit__(self, *exc):
+        app.tasks.pop(self.task.task_id, None)
+        app.task_store = self.original_store
+
+
+def test_artifacts_built_once_and_deterministic():
+    """一次读取生成哈希和 gzip；重复生成结果相同，文件变化后自动重建"""
+    with completed_task() as ctx:
+        manifest = build_download_artifacts(ctx.result_file)
+        raw = ctx.result_file.read_bytes()
+        gz_path = ctx.result_file.parent / manifest['encodings']['gzip']
+        assert manifest['sha256'] == hashlib.sha256(raw).hexdigest()
+        assert gzip.decompress(gz_path.read_bytes()) == raw
+        assert ('br' in manifest['encodings']) == (app.brotli is not None)
+        first_gz = gz_path.read_bytes()
+        assert download_artifacts(ctx.result_file) == manifest
+        build_download_artifacts(ctx.result_file)
+        assert gz_path.read_bytes() == first_gz, "gzip output must not embed a timestamp"
+
+        ctx.result_file.write_text(RESULT + "补充。\n", encoding='utf-8')
+        os.utime(ctx.result_file, (1, 1))
+        rebuilt = download_artifacts(ctx.result_file)
+        assert rebuilt['sha256'] != manifest['sha256']
+        assert gzip.decompress(gz_path.read_bytes()) == ctx.result_file.read_bytes()
+        assert not list(ctx.result_file.parent.glob('*.tmp'))
+    print("✅ Test 1: artifacts built once and deterministic - PASSED")
+
+
+def test_encoding_negotiation():
+    """接受 gzip 时发送预压缩文件，否则发送原文件；两种表示的 ETag 不同"""
+    with completed_task() as ctx:
+        client = app.app.test_client()
+        url = f'/api/download/{ctx.task.task_id}'
+        raw = ctx.result_file.read_bytes()
+        sha = hashlib.sha256(raw).hexdigest()
+
+        plain = client.get(url, headers={'Accept-Encoding': 'identity'})
+        assert plain.status_code == 200 and plain.data == raw
+        assert 'Content-Encoding' not in plain.headers
+        assert plain.headers['ETag'] == f'"{sha}"'
+        assert 'Accept-Encoding' in plain.headers['Vary']
+
+        compressed = client.get(url, headers={'Accept-Encoding': 'gzip, deflate'})
+        assert compressed.headers['Content-Encoding'] == 'gzip'
+        assert compressed.headers['ETag'] == f'"{sha}-gzip"'
+        assert gzip.decompress(compressed.data) == raw and len(compressed.data) < len(raw)
+        assert compressed.headers['Content-Disposition'].endswith('book_Chinese.md')
+        assert compressed.mimetype == 'text/markdown'
+
+        assert client.get(url, headers={'Accept-Encoding': 'gzip;q=0'}).data == raw
+    print("✅ Test 2: encoding negotiation - PASSED")
+
+
+def test_range_and_conditional_requests():
+    """Range 请求返回 206，If-None-Match 返回 304，If-Range 失配时返回完整文件"""
+    with completed_task() as ctx:
+        client = app.app.test_client()
+        url = f'/api/download/{ctx.task.task_id}'
+        raw = ctx.result_file.read_bytes()
+        etag = client.get(url).headers['ETag']
+
+        part = client.get(url, headers={'Range': 'bytes=100-199'})
+        assert part.status_code == 206 and part.data == raw[100:200]
+        assert part.headers['Content-Range'] == f'bytes 100-199/{len(raw)}'
+        assert client.get(url, headers={'Range': 'bytes=100-', 'If-Range': etag}).data == raw[100:]
+
+        cached = client.get(url, headers={'If-None-Match': etag})
+        assert cached.status_code == 304 and cached.data == b''
+
+        stale = client.get(url, headers={'Range': 'bytes=100-199', 'If-Range': '"outdated"'})
+        assert stale.status_code == 200 and stale.data == raw
+    print("✅ Test 3: range and conditional requests - PASSED")
+
+
+def test_incompressible_result_sent_as_is():
+    """压缩后不更小的结果不生成压缩版本"""
+    with completed_task(text="x") as ctx:
+        assert download_artifacts(ctx.result_file)['encodings'] == {}
+        response = app.app.test_client().get(f'/api/download/{ctx.task.task_id}',
+                                             headers={'Accept-Encoding': 'gzip'})
+        assert response.data == b'x' and 'Content-Encoding' not in response.headers
+    print("✅ Test 4: incompressible result sent as is - PASSED")
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("🧪 Testing Downloads")
+    print("=" * 60)
+    test_artifacts_built_once_and_deterministic()
+    test_encoding_negotiation()
+    test_range_and_conditional_requests()
+    test_incompressible_result_sent_as_is()
+    print("=" * 60)
+    print("✅ All tests passed!")
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+测试 WebSocket 事件批量推送与日志补发
+"""
+
+import sys
+import time
+import threading
+from pathlib import Path
+
+# 添加项目路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+import app
+from app import TaskEventBatcher, TranslationTask
+from testing_helpers import delta
+
+
+class RecordingSocketIO:
+    """记录 emit 调用的假 socketio，可模拟慢速传输"""
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.messages = []
+        self.lock = threading.Lock()
+
+    def emit(self, event, data, room=None, **kwargs):
+        time.sleep(self.delay)
+        with self.lock:
+            self.messages.append((event, data, room))
+
+
+def with_fake_socketio(fake, func):
+    original = app.socketio
+    app.socketio = fake
+    try:
+        return func()
+    finally:
+        app.socketio = original
+
+
+def wait_until(predicate, timeout=3.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_coalesces_progress_updates():
+    """大量进度日志/进度更新被合并为少量消息，只保留最新值"""
+    fake = RecordingSocketIO()
+
+    def run():
+        batcher = TaskEventBatcher('room-1', max_per_second=4)
+        batcher.push_log({'message': 'start', 'update_last': False})
+        for i in range(5000):
+            batcher.push_log({'message': f'receiving {i}', 'update_last': True})
+            batcher.push_progress({'overall': i // 50})
+        assert wait_until(lambda: fake.messages and fake.messages[-1][1]['progress'] == {'overall': 99})
+
+    start = time.time()
+    with_fake_socketio(fake, run)
+    elapsed = time.time() - start
+    assert all(event == 'task_events' and room == 'room-1' for event, _, room in fake.messages)
+    assert len(fake.messages) <= 4 * elapsed + 2, f"{len(fake.messages)} messages in {elapsed:.2f}s"
+    messages = [log['message'] for _, data, _ in fake.messages for log in data['logs']]
+    assert messages[0] == 'start' and messages[-1] == 'receiving 4999'
+    print(f"✅ Test 1: 10000 updates → {len(fake.messages)} messages - PASSED")
+
+
+def test_slow_transport_does_not_block_producer():
+    """Socket.IO 传输很慢时，push 仍然立即返回"""
+    fake = RecordingSocketIO(delay=0.3)
+
+    def run():
+        batcher = TaskEventBatcher('room-2', max_per_second=10)
+        start = time.time()
+        for i in range(2000):
+            batcher.push_log({'message': f'line {i}', 'update_last': False})
+        elapsed = time.time() - start
+        assert wait_until(lambda: sum(len(d['logs']) for _, d, _ in fake.messages) == 2000, timeout=5)
+        return elapsed
+
+    elapsed = with_fake_socketio(fake, run)
+    assert elapsed < 0.2, f"producer blocked for {elapsed:.2f}s"
+    print(f"✅ Test 2: producer not blocked ({elapsed * 1000:.1f}ms) - PASSED")
+
+
+def test_task_emits_through_batcher():
+    """TranslationTask 的日志和进度经批量推送发送，日志历史完整保留"""
+    fake = RecordingSocketIO()
+
+    def run():
+        task = TranslationTask('test_batch_task', 'book.md', 'Chinese')
+        task.total_chunks = 2
+        task.emit_log('hello', 'info')
+        task.update_chunk_progress(1, 50)
+        assert wait_until(lambda: fake.messages)
+        task.events.flush()
+        return task
+
+    task = with_fake_socketio(fake, run)
+    assert [log['message'] for log in task.logs] == ['hello']
+    logs = [log for _, data, _ in fake.messages for log in data['logs']]
+    progress = [data['progress'] for _, data, _ in fake.messages if data['progress']]
+    assert logs[0]['message'] == 'hello'
+    assert progress[-1]['overall'] == 25 and progress[-1]['total_chunks'] == 2
+    print("✅ Test 3: task emits through batcher - PASSED")
+
+
+def test_streaming_loop_throttles_progress():
+    """流式循环按时间/字符数节流，而不是逐 token 发送进度"""
+    deltas = ['字' * 10] * 3000  # 30000 字符
+
+    def fake_completion(**kwargs):
+        for text in deltas:
+            yield delta(text)
+
+    task = TranslationTask('test_stream_task', 'book.md', 'Chinese')
+    task.total_chunks = 1
+    calls = []
+    task.update_chunk_progress = lambda chunk_id, progress: calls.append(progress)
+    originals = (app.completion, app.translation_memory, app.rate_limiters)
+    app.completion, app.translation_memory, app.rate_limiters = fake_completion, None, {}
+    try:
+        result = app.translate_chunk_web(task, 1, 1, "Source " * 100, "Chinese")
+    finally:
+        app.completion, app.translation_memory, app.rate_limiters = originals
+    assert len(result) == 30000
+    # 每 2000 (Demo) 或 10000 字符最多一次，加上完成时的 100%
+    assert len(calls) <= 30000 // 2000 + 2, f"{len(calls)} progress updates"
+    assert calls[-1] == 100
+    print(f"✅ Test 4: {len(deltas)} deltas → {len(calls)} progress updates - PASSED")
+
+
+def test_log_ring_buffer_is_bounded():
+    """日志环形缓冲有上限，seq 单调递增，logs_since 只返回游标之后的条目"""
+    task = TranslationTask('test_ring_task', 'book.md', 'Chinese')
+    total = app.TASK_LOG_BUFFER_SIZE + 500
+    for i in range(total):
+        task.emit_log(f'line {i}')
+    assert len(task.logs) == app.TASK_LOG_BUFFER_SIZE
+    assert task.log_seq == total
+    seqs = [entry['seq'] for entry in task.logs]
+    assert seqs == list(range(501, total + 1))
+    assert [e['seq'] for e in task.logs_since(total - 3)] == [total - 2, total - 1, total]
+    assert task.logs_since(total) == []
+    assert len(task.logs_since(0)) == app.TASK_LOG_BUFFER_SIZE  # 已淘汰的无法补发
+    print("✅ Test 5: bounded ring buffer - PASSED")
+
+
+def test_join_replays_missed_logs():
+    """带 last_seq 加入房间时，只补发错过的日志"""
+    task = TranslationTask('test_replay_task', 'book.md', 'Chinese')
+    for i in range(10):
+        task.emit_log(f'line {i + 1}')
+    task.events.flush()
+    app.tasks[task.task_id] = task
+    replayed = []
+    original_emit = app.emit
+    app.emit = lambda event, data, **kwargs: replayed.append((event, data))
+    try:
+        client = app.socketio.test_client(app.app)
+        ack = client.emit('join', {'task_id': task.task_id, 'last_seq': 7}, callback=True)
+        assert ack['last_seq'] == 10
+        assert len(replayed) == 1 and replayed[0][0] == 'task_events'
+        assert replayed[0][1]['replay'] is True
+        assert [log['message'] for log in replayed[0][1]['logs']] == ['line 8', 'line 9', 'line 10']
+
+        # 游标超前（服务端重启)：全部补发
+        client.emit('join', {'task_id': task.task_id, 'last_seq': 999}, callback=True)
+        assert len(replayed[1][1]['logs']) == 10
+        client.disconnect()
+    finally:
+        app.emit = original_emit
+        app.tasks.pop(task.task_id, None)
+    print("✅ Test 6: join replays missed logs - PASSED")
+
+
+def test_progress_persisted_off_producer_thread():
+    """进度由推送线程按间隔写入任务仓库，产生进度的线程不做数据库写入"""
+    fake = RecordingSocketIO()
+    writers = []
+    original_persist = app.persist_task
+    app.persist_task = lambda task, chunks=False: writers.append(threading.current_thread())
+
+    def run():
+        task = TranslationTask('test_persist_task', 'book.md', 'Chinese')
+        task.total_chunks = 1
+        for progress in range(100):
+            task.update_chunk_progress(1, progress)
+        assert wait_until(lambda: writers)
+        task.events.flush()
+        return task
+
+    try:
+        with_fake_socketio(fake, run)
+    finally:
+        app.persist_task = original_persist
+    assert len(writers) == 1, "throttled to one write per interval"
+    assert writers[0] is not threading.current_thread(), "emit_progress must not persist inline"
+    print("✅ Test 7: progress persisted off producer thread - PASSED")
+
+
+def test_progress_coalesced_per_chunk():
+    """并发分块的进度日志按 update_key 各自合并，不会互相覆盖"""
+    fake = RecordingSocketIO(delay=0.2)
+
+    def run():
+        task = TranslationTask('test_batch_keys', 'book.md', 'Chinese')
+        task.emit_log('start', 'info')  # 推送线程忙于发送这条时，后续日志都留在缓冲区
+        for i in range(100):
+            for chunk_id in (1, 2):
+                task.emit_log(f'chunk {chunk_id}: {i}', 'progress', update_last=True, update_key=f'chunk-{chunk_id}')
+        task.emit_log('chunk 1 done', 'success')
+        assert wait_until(lambda: any(log['message'] == 'chunk 1 done'
+                                      for _, data, _ in fake.messages for log in data['logs']))
+
+    with_fake_socketio(fake, run)
+    messages = [log['message'] for _, data, _ in fake.messages for log in data['logs']]
+    assert messages[0] == 'start' and messages[-1] == 'chunk 1 done'
+    assert messages[-3:-1] == ['chunk 1: 99', 'chunk 2: 99'], messages
+    assert len(messages) < 20, f"{len(messages)} log entries were not coalesced"
+    print("✅ Test 8: progress coalesced per chunk - PASSED")
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("🧪 Testing Event Batcher")
+    print("=" * 60)
+    test_coalesces_progress_updates()
+    test_slow_transport_does_not_block_producer()
+    test_task_emits_through_batcher()
+    test_streaming_loop_throttles_progress()
+    test_log_ring_buffer_is_bounded()
+    test_join_replays_missed_logs()
+    test_progress_persisted_off_producer_thread()
+    test_progress_coalesced_per_chunk()
+    print("=" * 60)
+    print("✅ All tests passed!")
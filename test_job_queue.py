@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+测试翻译任务队列（固定工作线程池 + 准入控制)
+"""
+
+import sys
+import time
+import tempfile
+import threading
+from pathlib import Path
+
+# 添加项目路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+import app
+from app import TranslationTask, TranslationJobQueue, QueueFullError, TaskStore
+
+
+def make_task(task_id):
+    task = TranslationTask(task_id, 'book.md', 'Chinese')
+    task.status = 'analyzed'
+    return task
+
+
+def with_fake_translate(fake, func):
+    original = app.translate_book_task
+    app.translate_book_task = fake
+    try:
+        return func()
+    finally:
+        app.translate_book_task = original
+
+
+def wait_until_idle(queue, timeout=5):
+    """等待队列清空（恢复真实翻译函数前，避免排队任务被真实执行)"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        stats = queue.stats()
+        if not stats['running'] and not stats['queued']:
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_worker_pool_is_bounded():
+    """同时运行的任务数不超过工作线程数，所有任务最终完成"""
+    queue = TranslationJobQueue(workers=2, max_queued=10)
+    state = {'now': 0, 'max': 0}
+    lock = threading.Lock()
+    done = threading.Semaphore(0)
+
+    def fake_translate(task):
+        with lock:
+            state['now'] += 1
+            state['max'] = max(state['max'], state['now'])
+        time.sleep(0.05)
+        with lock:
+            state['now'] -= 1
+        task.status = 'completed'
+        done.release()
+
+    def run():
+        tasks = [make_task(f'test_pool_{i}') for i in range(6)]
+        for task in tasks:
+            queue.submit(task)
+        for _ in tasks:
+            assert done.acquire(timeout=5)
+        return tasks
+
+    tasks = with_fake_translate(fake_translate, run)
+    assert state['max'] == 2, state
+    assert all(task.status == 'completed' for task in tasks)
+    assert all(task.queue_wait is not None for task in tasks)
+    assert len([t for t in threading.enumerate() if t.name.startswith('translation-worker')]) >= 2
+    print("✅ Test 1: bounded worker pool - PASSED")
+
+
+def test_admission_control():
+    """排队数达到上限时拒绝，队列位置按提交顺序"""
+    queue = TranslationJobQueue(workers=1, max_queued=2)
+    release = threading.Event()
+    started = threading.Event()
+
+    def blocking_translate(task):
+        started.set()
+        release.wait(5)
+
+    def run():
+        queue.submit(make_task('test_adm_running'))
+        assert started.wait(2)
+        assert queue.submit(make_task('test_adm_1')) == 1
+        assert queue.submit(make_task('test_adm_2')) == 2
+        assert queue.position('test_adm_2') == 2
+        try:
+            queue.submit(make_task('test_adm_3'))
+            assert False, "expected QueueFullError"
+        except QueueFullError:
+            pass
+        stats = queue.stats()
+        assert stats['running'] == 1 and stats['queued'] == 2
+        release.set()
+        assert wait_until_idle(queue)
+
+    with_fake_translate(blocking_translate, run)
+    print("✅ Test 2: admission control - PASSED")
+
+
+def test_translate_endpoint_queues_and_rejects():
+    """/api/translate 入队返回位置，队列满时返回 429，/api/status 显示排队信息"""
+    release = threading.Event()
+    original_queue, original_store = app.translation_queue, app.task_store
+    app.translation_queue = TranslationJobQueue(workers=1, max_queued=1)
+    app.task_store = TaskStore(Path(tempfile.mkdtemp(prefix='queue_test_')) / 'tasks.sqlite3')
+    client = app.app.test_client()
+    ids = ['test_api_q1', 'test_api_q2', 'test_api_q3']
+    for task_id in ids:
+        app.tasks[task_id] = make_task(task_id)
+
+    def run():
+        first = client.post(f'/api/translate/{ids[0]}', json={})
+        assert first.status_code == 200 and first.get_json()['status'] == 'queued'
+        deadline = time.time() + 2
+        while not app.translation_queue.running and time.time() < deadline:
+            time.sleep(0.01)
+
+        second = client.post(f'/api/translate/{ids[1]}', json={})
+        assert second.get_json()['queue_position'] == 1
+        third = client.post(f'/api/translate/{ids[2]}', json={})
+        assert third.status_code == 429
+        assert third.headers['Retry-After'] == str(app.QUEUE_FULL_RETRY_AFTER)
+        assert app.tasks[ids[2]].status == 'analyzed'
+
+        status = client.get(f'/api/status/{ids[1]}').get_json()
+        assert status['status'] == 'queued'
+        assert status['queue']['position'] == 1 and status['queue']['queued'] == 1
+        assert status['queue']['wait_seconds'] >= 0
+        release.set()
+        assert wait_until_idle(app.translation_queue)
+
+    try:
+        with_fake_translate(lambda task: release.wait(5), run)
+    finally:
+        release.set()
+        app.translation_queue, app.task_store = original_queue, original_store
+        for task_id in ids:
+            app.tasks.pop(task_id, None)
+    print("✅ Test 3: /api/translate queue and 429 - PASSED")
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("🧪 Testing Translation Job Queue")
+    print("=" * 60)
+    test_worker_pool_is_bounded()
+    test_admission_control()
+    test_translate_endpoint_queues_and_rejects()
+    print("=" * 60)
+    print("✅ All tests passed!")
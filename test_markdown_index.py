@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+测试 Markdown 结构索引与分块规划
+"""
+
+import sys
+import time
+from pathlib import Path
+
+# 添加项目路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+from app import index_markdown, extract_chapters, plan_chunks, chunk_text
+
+DEMO_DIR = Path(__file__).parent / 'demo_files'
+
+
+def test_atx_headings_and_offsets():
+    """ATX 标题：级别、标题、字符偏移"""
+    content = "Intro\n\n# Part One\n\n## Chapter 1\n\nText\n\n### Section 1.1\n\nMore\n\n## Chapter 2\n\nEnd\n"
+    index = index_markdown(content)
+    levels = [(h['level'], h['title']) for h in index['headings']]
+    assert levels == [(1, 'Part One'), (2, 'Chapter 1'), (3, 'Section 1.1'), (2, 'Chapter 2')], levels
+    for h in index['headings']:
+        assert content[h['start_pos']:].startswith('#' * h['level'] + ' ' + h['title'])
+    print("✅ Test 1: ATX headings - PASSED")
+
+
+def test_section_ranges():
+    """标题整节范围：到下一个同级或更高级标题"""
+    content = "# A\n\n## B\n\ntext\n\n### C\n\nmore\n\n## D\n\nend"
+    headings = index_markdown(content)['headings']
+    a, b, c, d = headings
+    assert a['end_pos'] == len(content)
+    assert b['end_pos'] == d['start_pos']
+    assert c['end_pos'] == d['start_pos']
+    assert d['end_pos'] == len(content)
+    print("✅ Test 2: section ranges - PASSED")
+
+
+def test_setext_headings():
+    """Setext 标题（=== 和 ---)，空行后的 --- 仍是分隔线"""
+    content = "Book Title\n==========\n\nIntro text\n\nChapter One\n-----------\n\nBody\n\n---\n\nAfter rule\n"
+    headings = index_markdown(content)['headings']
+    assert [(h['level'], h['title'], h['setext']) for h in headings] == [
+        (1, 'Book Title', True),
+        (2, 'Chapter One', True),
+    ], headings
+    assert headings[1]['start_pos'] == content.index('Chapter One')
+    print("✅ Test 3: setext headings - PASSED")
+
+
+def test_code_blocks_are_not_chapters():
+    """围栏代码块内的 # 行不是标题"""
+    content = (
+        "## Real Chapter\n\n"
+        "```python\n# just a comment\n## also a comment\n```\n\n"
+        "~~~~\n# shell prompt\n~~~\n# still code\n~~~~\n\n"
+        "## Second Chapter\n"
+    )
+    index = index_markdown(content)
+    assert [h['title'] for h in index['headings']] == ['Real Chapter', 'Second Chapter']
+    assert len(index['code_blocks']) == 2
+    first = index['code_blocks'][0]
+    assert content[first['start_pos']:first['end_pos']].startswith('```python')
+    assert content[first['start_pos']:first['end_pos']].rstrip().endswith('```')
+    print("✅ Test 4: code blocks excluded - PASSED")
+
+
+def test_unclosed_fence_runs_to_end():
+    """未闭合的代码块延续到文末"""
+    content = "## Chapter\n\n```\n# not a heading\n"
+    index = index_markdown(content)
+    assert [h['title'] for h in index['headings']] == ['Chapter']
+    assert index['code_blocks'][0]['end_pos'] == len(content)
+    print("✅ Test 5: unclosed fence - PASSED")
+
+
+def test_plan_chunks_covers_whole_document():
+    """分块首尾相接，不丢失主章节之间的高级标题"""
+    content = "Prologue\n\n## A\n\naaa\n\n# Part II\n\n## B\n\nbbb\n"
+    chunks = plan_chunks(extract_chapters(content), content)
+    joined = '\n\n'.join(chunk_text(content, c) for c in chunks)
+    assert '# Part II' in joined
+    assert 'Prologue' in joined and 'aaa' in joined and 'bbb' in joined
+    print("✅ Test 6: full coverage - PASSED")
+
+
+def test_demo_files_chunking():
+    """Demo 文件分块不丢失任何标题"""
+    for path in sorted(DEMO_DIR.glob('*.md')):
+        content = path.read_text(encoding='utf-8')
+        chapters = extract_chapters(content)
+        chunks = plan_chunks(chapters, content)
+        assert chunks, f"{path.name}: no chunks"
+        joined = '\n\n'.join(chunk_text(content, c) for c in chunks)
+        missing = [h['title'] for h in chapters if h['title'] not in joined]
+        assert not missing, f"{path.name}: headings lost {missing}"
+        print(f"   {path.name}: {len(chapters)} headings → {len(chunks)} chunks")
+    print("✅ Test 7: demo files - PASSED")
+
+
+def test_linear_time_on_large_document():
+    """大文件（~5MB、数千个标题）索引在线性时间内完成"""
+    section = "## Chapter {i}\n\n" + ("Lorem ipsum dolor sit amet. " * 40 + "\n\n") * 4
+    content = ''.join(section.format(i=i) for i in range(1100))
+    assert len(content) > 4_500_000
+    start = time.time()
+    index = index_markdown(content)
+    elapsed = time.time() - start
+    assert len(index['headings']) == 1100
+    assert elapsed < 2.0, f"indexing took {elapsed:.2f}s"
+    print(f"✅ Test 8: {len(content):,} chars indexed in {elapsed:.3f}s - PASSED")
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("🧪 Testing Markdown Structure Index")
+    print("=" * 60)
+    test_atx_headings_and_offsets()
+    test_section_ranges()
+    test_setext_headings()
+    test_code_blocks_are_not_chapters()
+    test_unclosed_fence_runs_to_end()
+    test_plan_chunks_covers_whole_document()
+    test_demo_files_chunking()
+    test_linear_time_on_large_document()
+    print("=" * 60)
+    print("✅ All tests passed!")
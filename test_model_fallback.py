@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+测试多模型回退与熔断
+"""
+
+import sys
+import time
+import tempfile
+from pathlib import Path
+
+# 添加项目路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+import app
+from app import CircuitBreaker, TranslationTask, TranslationMemory, IncrementalOutputWriter, select_model
+from testing_helpers import FakeAPIError, stream, reset_breakers
+
+
+class ContextWindowExceededError(Exception):
+    """与 litellm 同名的异常（按类名识别)"""
+
+
+def test_breaker_opens_on_error_rate():
+    """失败率达到阈值后熔断，冷却后放行一次探测"""
+    breaker = CircuitBreaker('test-model')
+    for _ in range(app.CIRCUIT_MIN_CALLS):
+        assert breaker.allow_request()
+        breaker.record_failure()
+    assert breaker.state == 'open'
+    assert not breaker.allow_request()
+
+    breaker.opened_at = time.time() - app.CIRCUIT_COOLDOWN - 1
+    assert breaker.allow_request(), "probe should be allowed after cooldown"
+    assert breaker.state == 'half_open'
+    assert not breaker.allow_request(), "only one probe at a time"
+    breaker.record_success(latency=1.0)
+    assert breaker.state == 'closed'
+    print("✅ Test 1: breaker opens and recovers - PASSED")
+
+
+def test_slow_calls_count_as_failures():
+    """首 token 过慢的调用计入失败率"""
+    breaker = CircuitBreaker('slow-model')
+    for _ in range(app.CIRCUIT_MIN_CALLS):
+        breaker.record_success(latency=app.CIRCUIT_SLOW_SECONDS + 1)
+    assert breaker.state == 'open'
+    assert breaker.snapshot()['avg_first_token_seconds'] > app.CIRCUIT_SLOW_SECONDS
+    print("✅ Test 2: slow calls trip breaker - PASSED")
+
+
+def test_select_model_skips_open_circuits():
+    """首选模型熔断时选择回退链中下一个模型"""
+    reset_breakers()
+    chain = app.MODEL_FALLBACK_CHAIN
+    assert chain[0] == app.ACTIVE_MODEL and len(chain) == len(set(chain))
+    assert select_model() == chain[0]
+    for _ in range(app.CIRCUIT_MIN_CALLS):
+        app.circuit_breakers[chain[0]].record_failure()
+    assert select_model() == chain[1]
+    reset_breakers()
+    print("✅ Test 3: fallback selection - PASSED")
+
+
+def test_chunk_moves_to_fallback_model():
+    """首选模型持续 503 时，块自动改用下一个模型，并记录实际模型"""
+    reset_breakers()
+    chain = app.MODEL_FALLBACK_CHAIN
+    primary = app.MODEL_CONFIGS[chain[0]]['name']
+    fallback = app.MODEL_CONFIGS[chain[1]]['name']
+    models_called = []
+
+    def fake_completion(model, **kwargs):
+        models_called.append(model)
+        if model == f"openrouter/{primary}":
+            raise FakeAPIError(503)
+        config = app.MODEL_CONFIGS[chain[1]]
+        assert kwargs['max_tokens'] + app.request_tokens(kwargs['messages']) <= config['context_window']
+        return stream("回退译文")
+
+    # 其他块的失败已让首选模型接近熔断
+    for _ in range(app.CIRCUIT_MIN_CALLS - 1):
+        app.circuit_breakers[chain[0]].record_failure()
+
+    task = TranslationTask('test_fallback_task', 'book.md', 'Chinese')
+    task.chunks_info = [{'id': 1, 'chapters': ['Chapter 1']}]
+    task.total_chunks = 1
+    originals = (app.completion, app.translation_memory, app.RETRY_BASE_DELAY, app.rate_limiters)
+    app.completion, app.translation_memory, app.RETRY_BASE_DELAY = fake_completion, None, 0
+    app.rate_limiters = {}  # 不限速
+    try:
+        result = app.translate_chunk_web(task, 1, 1, "Source", "Chinese")
+    finally:
+        app.completion, app.translation_memory, app.RETRY_BASE_DELAY, app.rate_limiters = originals
+        reset_breakers()
+    assert result == "回退译文"
+    assert models_called == [f"openrouter/{primary}", f"openrouter/{fallback}"]
+    assert task.chunks_info[0]['model'] == fallback
+    assert task.metrics['fallback_chunks'] == 1
+    print("✅ Test 4: chunk falls back to next model - PASSED")
+
+
+def test_output_comment_records_model():
+    """增量输出的块注释标明实际模型"""
+    tmp_dir = Path(tempfile.mkdtemp(prefix='fallback_test_'))
+    segment = tmp_dir / 'chunk_0001.md'
+    segment.write_text("译文", encoding='utf-8')
+    writer = IncrementalOutputWriter(tmp_dir / 'out.md', [1], lambda chunk_id: segment)
+    writer.append_ready({1: {'chapters': ['Chapter 1'], 'model': 'deepseek/deepseek-chat'}})
+    writer.close()
+    output = (tmp_dir / 'out.md').read_text(encoding='utf-8')
+    assert '<!-- Chunk 1: Chapter 1 | model: deepseek/deepseek-chat -->' in output
+    print("✅ Test 5: output comment records model - PASSED")
+
+
+def test_model_specific_error_falls_through():
+    """首选模型返回 404（模型下线)时立即改用下一个模型；401 对所有模型都一样，不再尝试；翻译记忆只记一次未命中"""
+    reset_breakers()
+    chain = app.MODEL_FALLBACK_CHAIN
+    primary = app.MODEL_CONFIGS[chain[0]]['name']
+    fallback = app.MODEL_CONFIGS[chain[1]]['name']
+    models_called = []
+    status = {'code': 404}
+
+    def fake_completion(model, **kwargs):
+        models_called.append(model)
+        if model == f"openrouter/{primary}" or status['code'] == 401:
+            raise FakeAPIError(status['code'])
+        return stream("回退译文")
+
+    memory = TranslationMemory(Path(tempfile.mkdtemp(prefix='fallback_test_')) / 'tm.sqlite3')
+    originals = (app.completion, app.translation_memory, app.RETRY_BASE_DELAY, app.rate_limiters)
+    app.completion, app.translation_memory, app.RETRY_BASE_DELAY = fake_completion, memory, 0
+    app.rate_limiters = {}  # 不限速
+    try:
+        task = TranslationTask('test_model_error_task', 'book.md', 'Chinese')
+        task.chunks_info = [{'id': 1, 'chapters': ['Chapter 1']}]
+        task.total_chunks = 1
+        result = app.translate_chunk_web(task, 1, 1, "Source", "Chinese")
+        assert memory.stats()['misses'] == 1, "one lookup per chunk, whatever the chain length"
+
+        status['code'] = 401
+        denied = TranslationTask('test_auth_error_task', 'book.md', 'Chinese')
+        denied.chunks_info = [{'id': 1, 'chapters': ['Chapter 1']}]
+        denied.total_chunks = 1
+        calls_before = len(models_called)
+        try:
+            app.translate_chunk_web(denied, 1, 1, "Other source", "Chinese")
+            assert False, "401 should not fall back"
+        except FakeAPIError as e:
+            assert e.status_code == 401
+    finally:
+        app.completion, app.translation_memory, app.RETRY_BASE_DELAY, app.rate_limiters = originals
+        reset_breakers()
+    assert result == "回退译文"
+    assert models_called[:calls_before] == [f"openrouter/{primary}", f"openrouter/{fallback}"]
+    assert task.chunks_info[0]['model'] == fallback
+    assert task.metrics['model_errors'] == 1 and task.metrics['fatal_errors'] == 0
+    assert task.metrics['retries'] == 0, "model switch is immediate, no backoff"
+    assert len(models_called) == calls_before + 1 and denied.metrics['fatal_errors'] == 1
+    print("✅ Test 6: model-specific error falls through, auth error stops - PASSED")
+
+
+def test_request_fits_context_window():
+    """max_tokens 按上下文窗口扣除输入后收紧；窗口足够时仍用模型配置的 max_tokens"""
+    messages = [{'role': 'user', 'content': 'word ' * 20000}]
+    prompt_tokens = app.request_tokens(messages)
+    for model_key, config in app.MODEL_CONFIGS.items():
+        request = app.completion_request(model_key, messages)
+        assert 0 < request['max_tokens'] <= config['max_tokens']
+        assert request['max_tokens'] + prompt_tokens + app.REQUEST_TOKEN_MARGIN <= config['context_window'], model_key
+    small = app.completion_request('deepseek-free', [{'role': 'user', 'content': 'Hello'}])
+    assert small['max_tokens'] == app.MODEL_CONFIGS['deepseek-free']['max_tokens']
+    print("✅ Test 7: request fits context window - PASSED")
+
+
+def test_model_specific_error_classification():
+    """只有超出上下文窗口 / 输出上限的 400 才换模型，其他 400 仍是致命错误"""
+    specific = [
+        FakeAPIError(400, "This model's maximum context length is 64000 tokens. However, you requested 70000 tokens"),
+        FakeAPIError(400, "max_tokens is too large: 100000. This model supports at most 16384 completion tokens"),
+        FakeAPIError(400, "Invalid request: max_tokens must be less than or equal to 8192"),
+        FakeAPIError(404, "No endpoints found for deepseek/deepseek-chat"),
+        FakeAPIError(402, "Insufficient credits"),
+        ContextWindowExceededError("prompt too long"),
+    ]
+    general = [
+        FakeAPIError(400, "Invalid value for 'context': expected an object"),
+        FakeAPIError(400, "messages: text content blocks must be non-empty"),
+        FakeAPIError(401, "No auth credentials found"),
+        FakeAPIError(403, "Key disabled"),
+        app.TranslationCancelled("stop"),
+    ]
+    for error in specific:
+        assert app.is_model_specific_error(error), error
+    for error in general:
+        assert not app.is_model_specific_error(error), error
+    print("✅ Test 8: model-specific error classification - PASSED")
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("🧪 Testing Model Fallback")
+    print("=" * 60)
+    test_breaker_opens_on_error_rate()
+    test_slow_calls_count_as_failures()
+    test_select_model_skips_open_circuits()
+    test_chunk_moves_to_fallback_model()
+    test_output_comment_records_model()
+    test_model_specific_error_falls_through()
+    test_request_fits_context_window()
+    test_model_specific_error_classification()
+    print("=" * 60)
+    print("✅ All tests passed!")
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+测试分页预览接口（按偏移/章节切片，ETag / Last-Modified 条件请求)
+"""
+
+import io
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# 添加项目路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+import app
+from app import TaskStore, TranslationTask
+
+BOOK = ''.join(
+    f"## Chapter {i}\n\n" + f"Line {i} of a long chapter with some text.\n" * 40 + "\n"
+    for i in range(1, 11)
+)
+
+
+class use_tmp_storage:
+    """上传目录、计划缓存和任务仓库都换成临时目录"""
+    KEYS = ('UPLOAD_FOLDER', 'UPLOAD_OBJECTS_FOLDER', 'UPLOAD_MANIFEST_FOLDER', 'PLAN_CACHE_FOLDER')
+
+    def __enter__(self):
+        root = Path(tempfile.mkdtemp(prefix='preview_test_'))
+        self.original = ({key: app.app.config[key] for key in self.KEYS}, app.task_store, dict(app.tasks))
+        for key, sub in zip(self.KEYS, ('uploads', 'uploads/objects', 'uploads/manifests', 'plans')):
+            app.app.config[key] = root / sub
+            app.app.config[key].mkdir(parents=True, exist_ok=True)
+        app.task_store = TaskStore(root / 'tasks.sqlite3')
+        return root
+
+    def __exit__(self, *exc):
+        app.app.config.update(self.original[0])
+        app.task_store = self.original[1]
+        app.tasks.clear()
+        app.tasks.update(self.original[2])
+
+
+def upload_book(client):
+    response = client.post('/api/upload', data={'file': (io.BytesIO(BOOK.encode('utf-8')), 'book.md')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 200
+    return response.get_json()['task_id']
+
+
+def test_source_pages_cover_document():
+    """按页读取源文件，页尾落在换行处，拼起来与原文一致"""
+    with use_tmp_storage():
+        client = app.app.test_client()
+        task_id = upload_book(client)
+        pages, offset = [], 0
+        while offset is not None:
+            page = client.get(f'/api/preview-source/{task_id}?offset={offset}&limit=1000').get_json()
+            assert len(page['content']) <= 1000 and page['total_chars'] == len(BOOK)
+            assert ('outline' in page) == (offset == 0)
+            pages.append(page)
+            offset = page['next_offset']
+        assert ''.join(p['content'] for p in pages) == BOOK
+        assert all(p['content'].endswith('\n') and p['has_more'] for p in pages[:-1])
+        assert len(pages[0]['outline']) == 10 and not pages[-1]['has_more']
+    print(f"✅ Test 1: {len(pages)} source pages cover document - PASSED")
+
+
+def test_chapter_slices():
+    """chapter 参数只返回该章节；分析前后结果一致"""
+    with use_tmp_storage():
+        client = app.app.test_client()
+        task_id = upload_book(client)
+        start = BOOK.index('## Chapter 3')
+        expected = BOOK[start:BOOK.index('## Chapter 4')]
+        before = client.get(f'/api/preview-source/{task_id}?chapter=3').get_json()
+        assert before['content'] == expected and before['range_start'] == start
+
+        assert client.post(f'/api/analyze/{task_id}', json={'language': 'Chinese'}).status_code == 200
+        after = client.get(f'/api/preview-source/{task_id}?chapter=3').get_json()
+        assert after['content'] == expected and not after['has_more']
+        assert client.get(f'/api/preview-source/{task_id}?chapter=11').status_code == 404
+        assert client.get(f'/api/preview-source/{task_id}?offset=-1').status_code == 400
+        assert client.get(f'/api/preview-source/{task_id}?limit=abc').status_code == 400
+    print("✅ Test 2: chapter slices - PASSED")
+
+
+def test_result_conditional_requests():
+    """翻译结果预览带 ETag / Last-Modified，缓存有效时返回 304，文件变化后返回新内容"""
+    with use_tmp_storage() as root:
+        result_file = root / 'book_Chinese.md'
+        result_file.write_text("## 第一章\n\n译文。\n", encoding='utf-8')
+        task = TranslationTask('test_preview_result', 'book.md', 'Chinese')
+        task.status, task.result_file = 'completed', str(result_file)
+        app.tasks[task.task_id] = task
+        client = app.app.test_client()
+        url = f'/api/preview/{task.task_id}'
+
+        first = client.get(url)
+        etag, last_modified = first.headers['ETag'], first.headers['Last-Modified']
+        assert first.status_code == 200 and first.get_json()['content'] == "## 第一章\n\n译文。\n"
+        assert 'no-cache' in first.headers['Cache-Control']
+
+        cached = client.get(url, headers={'If-None-Match': etag})
+        assert cached.status_code == 304 and cached.data == b''
+        assert client.get(url, headers={'If-Modified-Since': last_modified}).status_code == 304
+        assert client.get(f'{url}?limit=5', headers={'If-None-Match': etag}).status_code == 200
+        # 缺省参数与显式写出的缺省值是同一页，共用 ETag
+        explicit = client.get(f'{url}?offset=0&limit={app.PREVIEW_PAGE_CHARS}', headers={'If-None-Match': etag})
+        assert explicit.status_code == 304 and explicit.headers['ETag'] == etag
+        assert client.get(f'{url}?offset=', headers={'If-None-Match': etag}).status_code == 304
+
+        result_file.write_text("## 第一章\n\n修订后的译文。\n", encoding='utf-8')
+        os.utime(result_file, (1, 1))
+        changed = client.get(url, headers={'If-None-Match': etag})
+        assert changed.status_code == 200 and changed.headers['ETag'] != etag
+        assert changed.get_json()['content'] == "## 第一章\n\n修订后的译文。\n"
+    print("✅ Test 3: result conditional requests - PASSED")
+
+
+def test_chunk_preview_pages():
+    """chunk 预览同样分页并支持 304"""
+    with use_tmp_storage():
+        client = app.app.test_client()
+        task_id = upload_book(client)
+        client.post(f'/api/analyze/{task_id}', json={'language': 'Chinese'})
+        task = app.tasks[task_id]
+        chunk = task.chunks_info[0]
+        full = task.chunk_content(chunk)
+
+        url = f"/api/preview-chunk/{task_id}/{chunk['id']}"
+        page = client.get(f'{url}?limit=300')
+        data = page.get_json()
+        assert data['content'] == full[:len(data['content'])] and data['has_more']
+        assert data['total_chars'] == len(full) and data['headings'][0]['title'] == 'Chapter 1'
+        rest = client.get(f"{url}?offset={data['next_offset']}&limit={len(full)}").get_json()
+        assert data['content'] + rest['content'] == full
+        assert client.get(f'{url}?limit=300', headers={'If-None-Match': page.headers['ETag']}).status_code == 304
+    print("✅ Test 4: chunk preview pages - PASSED")
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("🧪 Testing Preview API")
+    print("=" * 60)
+    test_source_pages_cover_document()
+    test_chapter_slices()
+    test_result_conditional_requests()
+    test_chunk_preview_pages()
+    print("=" * 60)
+    print("✅ All tests passed!")
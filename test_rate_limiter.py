@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+测试进程级令牌桶限速
+"""
+
+import sys
+import time
+import threading
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from pathlib import Path
+from types import SimpleNamespace
+
+# 添加项目路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+import app
+from app import RateLimiter, TranslationTask, TranslationCancelled, retry_after_seconds
+from testing_helpers import FakeAPIError, stream, reset_breakers
+
+
+class RateLimitError(FakeAPIError):
+    """带 Retry-After 响应头的假 429 异常"""
+    def __init__(self, retry_after=None):
+        super().__init__(429, "429 Too Many Requests")
+        headers = {'retry-after': str(retry_after)} if retry_after is not None else {}
+        self.response = SimpleNamespace(headers=headers)
+
+
+def test_requests_per_minute():
+    """请求额度用完后按 rpm 匀速补充"""
+    limiter = RateLimiter('rpm-test', rpm=60)
+    for _ in range(60):
+        assert limiter.try_acquire() == 0
+    wait = limiter.try_acquire()
+    assert 0.9 < wait <= 1.0, wait
+    print("✅ Test 1: requests per minute - PASSED")
+
+
+def test_tokens_per_minute():
+    """token 额度不足时等待，超过桶容量的请求按满桶处理"""
+    limiter = RateLimiter('tpm-test', tpm=6000)
+    assert limiter.try_acquire(6000) == 0
+    wait = limiter.try_acquire(600)
+    assert 5.5 < wait <= 6.0, wait
+    assert RateLimiter('big', tpm=1000).try_acquire(10 ** 6) == 0
+    print("✅ Test 2: tokens per minute - PASSED")
+
+
+def test_shared_limiter_paces_threads():
+    """多个线程共享同一额度，总吞吐受 rpm 限制"""
+    limiter = RateLimiter('shared', rpm=1200)  # 每 0.05s 一个请求
+    for _ in range(1200):
+        limiter.try_acquire()
+    start = time.time()
+    threads = [threading.Thread(target=limiter.acquire) for _ in range(10)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - start
+    assert elapsed >= 0.4, f"10 requests took only {elapsed:.2f}s"
+    print(f"✅ Test 3: 10 threads paced over {elapsed:.2f}s - PASSED")
+
+
+def test_penalize_and_cancel():
+    """429 后暂停发放额度，等待期间可被任务取消打断"""
+    limiter = RateLimiter('penalty', rpm=100)
+    limiter.penalize(30)
+    assert limiter.try_acquire() > 29
+    cancel = threading.Event()
+    threading.Timer(0.1, cancel.set).start()
+    start = time.time()
+    try:
+        limiter.acquire(cancel_event=cancel)
+        assert False, "expected TranslationCancelled"
+    except TranslationCancelled:
+        pass
+    assert time.time() - start < 2
+    print("✅ Test 4: penalize and cancel - PASSED")
+
+
+def test_retry_after_parsing():
+    """Retry-After 支持秒数和 HTTP 日期"""
+    assert retry_after_seconds(RateLimitError(12)) == 12
+    assert retry_after_seconds(RateLimitError()) is None
+    future = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=20), usegmt=True)
+    assert 15 < retry_after_seconds(RateLimitError(future)) <= 20
+    print("✅ Test 5: Retry-After parsing - PASSED")
+
+
+def test_429_pauses_shared_limiter():
+    """块收到 429 时暂停模型和提供商额度，并按 Retry-After 等待后重试"""
+    primary = app.MODEL_FALLBACK_CHAIN[0]
+    limiters = {
+        'openrouter': RateLimiter('openrouter', rpm=1000),
+        primary: RateLimiter(primary, rpm=1000),
+    }
+    calls = []
+
+    def fake_completion(**kwargs):
+        calls.append(time.time())
+        if len(calls) == 1:
+            raise RateLimitError(retry_after=0.3)
+        return stream("译文")
+
+    reset_breakers()
+    task = TranslationTask('test_rate_limit_task', 'book.md', 'Chinese')
+    task.total_chunks = 1
+    originals = (app.completion, app.translation_memory, app.RETRY_BASE_DELAY, app.rate_limiters)
+    app.completion, app.translation_memory, app.RETRY_BASE_DELAY = fake_completion, None, 0
+    app.rate_limiters = limiters
+    try:
+        result = app.translate_chunk_web(task, 1, 1, "Source", "Chinese")
+    finally:
+        app.completion, app.translation_memory, app.RETRY_BASE_DELAY, app.rate_limiters = originals
+    assert result == "译文"
+    assert calls[1] - calls[0] >= 0.3, "retry must honour Retry-After"
+    assert all(limiter.throttled == 1 for limiter in limiters.values())
+    assert task.metrics['rate_limited'] == 1
+    assert limiters[primary].snapshot()['available_requests'] < 1000, "stream must acquire before opening"
+    print("✅ Test 6: 429 pauses shared limiter - PASSED")
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("🧪 Testing Rate Limiter")
+    print("=" * 60)
+    test_requests_per_minute()
+    test_tokens_per_minute()
+    test_shared_limiter_paces_threads()
+    test_penalize_and_cancel()
+    test_retry_after_parsing()
+    test_429_pauses_shared_limiter()
+    print("=" * 60)
+    print("✅ All tests passed!")
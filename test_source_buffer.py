@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+测试共享原文缓冲（块只保存偏移，内容按需切片)
+"""
+
+import sys
+import json
+import random
+import tempfile
+from pathlib import Path
+
+# 添加项目路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+import app
+from app import SourceBuffer, TranslationTask, chunk_text, plan_chunks, extract_chapters
+
+TEXT = "## 第一章 Chapter 1\n\nCafé naïve — 日本語のテキスト。\n\n" * 50
+
+
+def write_source(text, newline='\n'):
+    path = Path(tempfile.mkdtemp(prefix='source_buffer_test_')) / 'book.md'
+    with open(path, 'w', encoding='utf-8', newline=newline) as f:
+        f.write(text)
+    return path
+
+
+class small_mmap_settings:
+    """把 mmap 阈值和索引步长调小，让小文件也走 mmap 路径"""
+    def __enter__(self):
+        self.original = (app.SOURCE_MMAP_THRESHOLD, app.SOURCE_INDEX_STEP)
+        app.SOURCE_MMAP_THRESHOLD, app.SOURCE_INDEX_STEP = 0, 7
+
+    def __exit__(self, *exc):
+        app.SOURCE_MMAP_THRESHOLD, app.SOURCE_INDEX_STEP = self.original
+
+
+def test_mapped_slices_match_text():
+    """mmap 映射的非 ASCII 原文按字符偏移切片与字符串一致"""
+    path = write_source(TEXT)
+    with small_mmap_settings():
+        buffer = SourceBuffer.open(path)
+        assert buffer.mapped and len(buffer) == len(TEXT)
+        rng = random.Random(42)
+        for _ in range(500):
+            start = rng.randrange(0, len(TEXT))
+            end = rng.randrange(start, len(TEXT) + 1)
+            assert buffer[start:end] == TEXT[start:end], (start, end)
+        assert buffer[:] == TEXT and buffer[-5:] == TEXT[-5:] and buffer[10:3] == ''
+    print("✅ Test 1: mapped slices match text - PASSED")
+
+
+def test_ascii_and_crlf_sources():
+    """纯 ASCII 原文不需要偏移索引；含 \\r\\n 的原文读入内存，与文本模式读取一致"""
+    with small_mmap_settings():
+        ascii_buffer = SourceBuffer.open(write_source("## A\n\nplain text\n" * 20))
+        assert ascii_buffer.mapped and ascii_buffer._byte_index is None
+        assert ascii_buffer[5:15] == ("## A\n\nplain text\n" * 20)[5:15]
+
+        crlf_path = write_source(TEXT, newline='\r\n')
+        crlf_buffer = SourceBuffer.open(crlf_path)
+        assert not crlf_buffer.mapped
+        assert crlf_buffer.text() == crlf_path.read_text(encoding='utf-8') == TEXT
+    print("✅ Test 2: ascii and crlf sources - PASSED")
+
+
+def test_chunks_store_offsets_only():
+    """分块只保存偏移；前言和尾声与首末章之间空一行"""
+    content = "  Title page\n\n## A\n\naaa\n\n## B\n\nbbb\n\n# Appendix\n\nzzz\n"
+    chapters = extract_chapters(content)
+    chunks = plan_chunks(chapters, content, {**app.plan_chunk_budget(content), 'target_chars': 15})
+    assert all('content' not in chunk for chunk in chunks)
+    texts = [chunk_text(content, chunk) for chunk in chunks]
+    assert texts == ["Title page\n\n## A\n\naaa\n\n", "## B\n\nbbb\n\n\n\n# Appendix\n\nzzz"], texts
+    assert chunks[0]['has_prologue'] and chunks[-1]['has_epilogue']
+    assert all(chunk['size'] == len(text) for chunk, text in zip(chunks, texts))
+    print("✅ Test 3: chunks store offsets only - PASSED")
+
+
+def test_task_materializes_chunks_on_demand():
+    """任务通过原文缓冲生成块内容，计划本身不含原文"""
+    text = TEXT * 20
+    path = write_source(text)
+    with small_mmap_settings():
+        task = TranslationTask('test_source_task', 'book.md', 'Chinese')
+        task.load_source(path)
+        content = task.source_content
+        task.chunks_info = plan_chunks(extract_chapters(content), content)
+        assert task.source.mapped
+        assert 'Café' not in json.dumps(task.chunks_info, ensure_ascii=False), "plan must not copy the source"
+        joined = ''.join(task.chunk_content(chunk) for chunk in task.chunks_info)
+        assert joined == text
+    print("✅ Test 4: task materializes chunks on demand - PASSED")
+
+
+def test_legacy_chunks_with_content():
+    """旧版计划中保存的 content 仍然可用"""
+    task = TranslationTask('test_source_legacy', 'book.md', 'Chinese')
+    task.source_content = "## A\n\naaa\n"
+    assert task.chunk_content({'id': 1, 'content': 'saved text'}) == 'saved text'
+    assert task.chunk_content({'id': 1, 'start_pos': 0, 'end_pos': 4}) == '## A'
+    print("✅ Test 5: legacy chunks with content - PASSED")
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("🧪 Testing Source Buffer")
+    print("=" * 60)
+    test_mapped_slices_match_text()
+    test_ascii_and_crlf_sources()
+    test_chunks_store_offsets_only()
+    test_task_materializes_chunks_on_demand()
+    test_legacy_chunks_with_content()
+    print("=" * 60)
+    print("✅ All tests passed!")
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+测试 SQLite 任务仓库（跨进程共享任务状态)
+"""
+
+import sys
+import tempfile
+from datetime import datetime
+from pathlib import Path
+
+# 添加项目路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+import app
+from app import TaskStore, TranslationTask
+
+
+def new_store_dir():
+    return Path(tempfile.mkdtemp(prefix='task_store_test_'))
+
+
+def make_task(tmp_dir, task_id='test_store_task'):
+    source = tmp_dir / f'{task_id}_book.md'
+    source.write_text("## Chapter 1\n\nHello\n", encoding='utf-8')
+    task = TranslationTask(task_id, source.name, 'Chinese')
+    task.source_path = str(source)
+    task.status = 'analyzed'
+    task.total_chunks = 1
+    task.chunks_info = [{'id': 1, 'chapters': ['Chapter 1'], 'start_pos': 0, 'end_pos': 20,
+                         'content': "## Chapter 1\n\nHello\n"}]
+    return task
+
+
+class use_store:
+    """临时替换全局任务仓库，并清空本进程内存中的任务（模拟另一个进程)"""
+    def __init__(self, store):
+        self.store = store
+
+    def __enter__(self):
+        self.original = (app.task_store, dict(app.tasks))
+        app.task_store = self.store
+        app.tasks.clear()
+        return self.store
+
+    def __exit__(self, *exc):
+        app.task_store = self.original[0]
+        app.tasks.clear()
+        app.tasks.update(self.original[1])
+
+
+def test_save_and_load_roundtrip():
+    """任务元数据、分块计划、源文件都能从仓库恢复"""
+    tmp_dir = new_store_dir()
+    store = TaskStore(tmp_dir / 'tasks.sqlite3')
+    task = make_task(tmp_dir)
+    task.start_time = datetime.now()
+    task.metrics['retries'] = 2
+    store.save(task)
+
+    loaded = store.load(task.task_id)
+    assert loaded.status == 'analyzed' and loaded.language == 'Chinese'
+    assert loaded.chunks_info == task.chunks_info
+    assert loaded.source_content.startswith('## Chapter 1')
+    assert loaded.md_index['headings'][0]['title'] == 'Chapter 1'
+    assert loaded.start_time == task.start_time
+    assert loaded.metrics['retries'] == 2
+
+    status = store.get_status(task.task_id)
+    assert status['status'] == 'analyzed' and 'chunks' not in status
+    assert store.load('missing') is None and store.get_status('missing') is None
+    print("✅ Test 1: save/load roundtrip - PASSED")
+
+
+def test_wal_mode_and_indexes():
+    """数据库使用 WAL，状态列有索引"""
+    store = TaskStore(new_store_dir() / 'tasks.sqlite3')
+    mode = store._conn.execute('PRAGMA journal_mode').fetchone()[0]
+    indexes = {row[1] for row in store._conn.execute("PRAGMA index_list('tasks')")}
+    assert mode == 'wal'
+    assert 'idx_tasks_status' in indexes
+    print("✅ Test 2: WAL mode and indexes - PASSED")
+
+
+def test_claim_prevents_double_start():
+    """两个进程（两个连接)同时启动同一任务，只有一个成功"""
+    tmp_dir = new_store_dir()
+    store_a = TaskStore(tmp_dir / 'tasks.sqlite3')
+    store_b = TaskStore(tmp_dir / 'tasks.sqlite3')
+    task = make_task(tmp_dir)
+    store_a.save(task)
+    copy_b = store_b.load(task.task_id)
+    assert store_a.claim(task, 'analyzed', 'queued')
+    assert not store_b.claim(copy_b, 'analyzed', 'queued')
+    assert store_b.get_status(task.task_id)['status'] == 'queued'
+    print("✅ Test 3: claim prevents double start - PASSED")
+
+
+def test_claim_persists_options():
+    """启动选项随占用一起写入仓库；占用失败时不修改任务"""
+    tmp_dir = new_store_dir()
+    store = TaskStore(tmp_dir / 'tasks.sqlite3')
+    task = make_task(tmp_dir, 'test_store_options')
+    with use_store(store):
+        store.save(task)
+        app.tasks[task.task_id] = task
+        client = app.app.test_client()
+        response = client.post(f'/api/translate/{task.task_id}', json={'concurrency': 'x', 'use_terminology': False})
+        assert response.status_code == 400 and task.use_terminology is True
+
+        stale = store.load(task.task_id)
+        stale_options = (stale.use_terminology, stale.max_concurrency)
+        assert app.claim_task(task, 'analyzed', 'queued', use_terminology=False, max_concurrency=7)
+        assert not app.claim_task(stale, 'analyzed', 'queued', use_terminology=False, max_concurrency=99)
+        assert (stale.use_terminology, stale.max_concurrency) == stale_options
+
+        task.status, task.progress = 'translating', 40
+        app.persist_task(task)
+        worker_copy = store.load(task.task_id)
+        assert worker_copy.use_terminology is False and worker_copy.max_concurrency == 7
+        assert worker_copy.status == 'translating' and worker_copy.progress == 40
+    print("✅ Test 4: claim persists options - PASSED")
+
+
+def test_status_and_download_from_other_process():
+    """本进程内存中没有任务时，/api/status 和 /api/download 从仓库读取"""
+    tmp_dir = new_store_dir()
+    store = TaskStore(tmp_dir / 'tasks.sqlite3')
+    task = make_task(tmp_dir, 'test_store_other_process')
+    result = tmp_dir / 'result.md'
+    result.write_text("# 第一章\n\n你好\n", encoding='utf-8')
+    task.status = 'completed'
+    task.progress = 100
+    task.result_file = str(result)
+    store.save(task)
+
+    with use_store(store):
+        client = app.app.test_client()
+        status = client.get(f'/api/status/{task.task_id}').get_json()
+        assert status['status'] == 'completed' and status['progress'] == 100
+        assert task.task_id not in app.tasks, "status reads must not load the whole task"
+        download = client.get(f'/api/download/{task.task_id}')
+        assert download.status_code == 200
+        assert download.data.decode('utf-8').startswith('# 第一章')
+        download.close()
+        assert client.get('/api/status/test_store_missing').status_code == 404
+    print("✅ Test 5: status/download across processes - PASSED")
+
+
+def test_stale_local_copy_is_refreshed():
+    """仓库中的任务比本进程内存中的新时，使用仓库版本"""
+    tmp_dir = new_store_dir()
+    store = TaskStore(tmp_dir / 'tasks.sqlite3')
+    local = make_task(tmp_dir, 'test_store_stale')
+    with use_store(store):
+        store.save(local)
+        app.tasks[local.task_id] = local
+        assert app.get_task(local.task_id) is local
+
+        other = store.load(local.task_id)  # 另一个进程推进了任务
+        other.status = 'completed'
+        other.result_file = '/tmp/result.md'
+        store.save(other)
+        fresh = app.get_task(local.task_id)
+        assert fresh is not local and fresh.status == 'completed'
+        assert app.tasks[local.task_id] is fresh
+    print("✅ Test 6: stale local copy refreshed - PASSED")
+
+
+def test_status_only_changes_skip_reload():
+    """其他进程只推进进度时原地刷新状态列，不重新读取原文；分块计划变化时才重新加载"""
+    tmp_dir = new_store_dir()
+    store = TaskStore(tmp_dir / 'tasks.sqlite3')
+    local = make_task(tmp_dir, 'test_store_progress')
+    with use_store(store):
+        store.save(local)
+        app.tasks[local.task_id] = local
+        other = store.load(local.task_id)
+        loads = []
+        original_load = store.load
+        store.load = lambda *args, **kwargs: loads.append(args) or original_load(*args, **kwargs)
+        try:
+            for progress in (10, 20, 30):
+                other.status, other.progress = 'translating', progress
+                store.update_status(other)
+                task = app.get_task(local.task_id)
+                assert task is local and task.progress == progress and task.status == 'translating'
+            assert loads == [], "progress updates must not reload the source"
+
+            other.chunks_info.append({'id': 2, 'chapters': ['Chapter 2'], 'content': "More"})
+            store.save(other)
+            assert app.get_task(local.task_id).chunks_info == other.chunks_info
+            assert len(loads) == 1
+        finally:
+            store.load = original_load
+    print("✅ Test 7: status-only changes skip reload - PASSED")
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("🧪 Testing Task Store")
+    print("=" * 60)
+    test_save_and_load_roundtrip()
+    test_wal_mode_and_indexes()
+    test_claim_prevents_double_start()
+    test_claim_persists_options()
+    test_status_and_download_from_other_process()
+    test_stale_local_copy_is_refreshed()
+    test_status_only_changes_skip_reload()
+    print("=" * 60)
+    print("✅ All tests passed!")
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+测试术语自动机（Aho-Corasick，不区分大小写、按词边界匹配)和每块术语选择
+"""
+
+import re
+import sys
+import time
+import random
+from pathlib import Path
+
+# 添加项目路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+import app
+from app import (TermMatcher, TranslationTask, get_term_matcher, extract_terminology_from_chunk,
+                 select_chunk_terms, load_terminology_db, prepare_chunk)
+
+
+def regex_scan(terms, text):
+    """逐个术语用正则扫描的参考实现"""
+    hits = {}
+    for term in terms:
+        pattern = (r'(?<!\w)' if re.match(r'\w', term) else '') + re.escape(term) + (r'(?!\w)' if re.search(r'\w$', term) else '')
+        positions = [m.start() for m in re.finditer(f'(?=({pattern}))', text, re.IGNORECASE)]
+        if positions:
+            hits[term] = positions
+    return hits
+
+
+def test_positions_and_counts():
+    """返回每个术语的位置和次数；重叠术语都报告"""
+    matcher = TermMatcher(['deep learning', 'learning', 'AI', 'C++', 'OpenAI'])
+    text = "Deep Learning said AI; OpenAI ships C++ and deep-learning. LEARNING!"
+    hits = matcher.scan(text)
+    assert hits == {
+        'deep learning': [0],
+        'learning': [5, 49, 59],
+        'AI': [19],
+        'OpenAI': [23],
+        'C++': [36],
+    }, hits
+    assert matcher.counts(text)['learning'] == 3
+    assert [text[s:e] for s, e, _ in matcher.finditer(text)][:2] == ['Deep Learning', 'Learning']
+    print("✅ Test 1: positions and counts - PASSED")
+
+
+def test_matches_regex_reference():
+    """随机文本上与逐个正则扫描的结果一致"""
+    rng = random.Random(7)
+    words = ['ab', 'abc', 'bca', 'cab', 'a', 'b', 'Ab', 'x-y', 'Ünïcode', 'naïve']
+    terms = ['ab', 'abc', 'bc', 'cab ab', 'a', 'x-y', 'ünïcode', 'NAÏVE', 'b c']
+    for _ in range(200):
+        text = ''.join(rng.choice(words) + rng.choice([' ', '', '.', '-', '_']) for _ in range(30))
+        assert TermMatcher(terms).scan(text) == regex_scan(terms, text), text
+    print("✅ Test 2: matches regex reference - PASSED")
+
+
+def test_matcher_cached_per_glossary_version():
+    """同一术语表复用自动机，术语表变化时重新构建"""
+    terms = [f'term{i}' for i in range(20000)]
+    start = time.time()
+    first = get_term_matcher(terms)
+    build = time.time() - start
+    assert get_term_matcher(list(terms)) is first
+    assert get_term_matcher(terms + ['extra']) is not first
+    text = ' '.join(f'term{i}' for _ in range(5) for i in range(0, 20000, 97))
+    start = time.time()
+    counts = first.counts(text)
+    scan = time.time() - start
+    assert len(counts) == len(range(0, 20000, 97)) and set(counts.values()) == {5}
+    print(f"✅ Test 3: 20k-term matcher built in {build:.2f}s, scan {scan * 1000:.1f}ms, cached - PASSED")
+
+
+def test_extract_respects_word_boundaries():
+    """动态提取不再把 "said" 识别为 AI"""
+    terms = extract_terminology_from_chunk("", "He said the model learned. Machine Learning works.")
+    assert 'AI' not in terms
+    assert 'model' in terms and 'machine learning' in terms
+    print("✅ Test 4: extraction respects word boundaries - PASSED")
+
+
+def test_chunk_terms_ranked_and_budgeted():
+    """只选本块出现的术语，按出现次数排序，受 token 预算限制"""
+    glossary = ['DeepMind', 'OpenAI', 'containment', 'wave', 'CRISPR', 'governance']
+    text = "The wave is coming. Containment of the wave, containment again; the wave. CRISPR."
+    assert select_chunk_terms(glossary, text) == ['wave', 'containment', 'CRISPR']
+    assert select_chunk_terms(glossary, text, token_budget=7) == ['wave', 'containment']
+    assert select_chunk_terms(None, text) == [] and select_chunk_terms(glossary, "Nothing here.") == []
+    print("✅ Test 5: chunk terms ranked and budgeted - PASSED")
+
+
+def test_prompt_lists_terms_present_in_chunk():
+    """提示词中只出现本块用到的术语，包括术语表后部的术语"""
+    glossary = load_terminology_db()
+    original_memory = app.translation_memory
+    app.translation_memory = None
+    try:
+        task = TranslationTask('test_chunk_terms', 'book.md', 'Chinese')
+        chunk = "## Risk\n\nGovernance of synthetic biology is hard. Governance needs incentives."
+        _, attempts = prepare_chunk(task, 1, 1, chunk, 'Chinese', terminology=glossary)
+    finally:
+        app.translation_memory = original_memory
+    prompt = attempts.messages[1]['content']
+    terms = prompt.split('<key_terminology>')[1].split('</key_terminology>')[0].strip().splitlines()[1]
+    assert terms == 'governance, synthetic biology, incentives', terms
+    assert glossary.index('incentives') > 25 and 'Mustafa Suleyman' not in prompt
+    print("✅ Test 6: prompt lists terms present in chunk - PASSED")
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("🧪 Testing Term Matcher")
+    print("=" * 60)
+    test_positions_and_counts()
+    test_matches_regex_reference()
+    test_matcher_cached_per_glossary_version()
+    test_extract_respects_word_boundaries()
+    test_chunk_terms_ranked_and_budgeted()
+    test_prompt_lists_terms_present_in_chunk()
+    print("=" * 60)
+    print("✅ All tests passed!")
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+测试翻译记忆缓存
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+
+# 添加项目路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+import app
+from app import TranslationMemory, TranslationTask
+
+
+def new_memory(max_bytes=10 * 1024 * 1024):
+    """在临时目录创建翻译记忆"""
+    tmp_dir = tempfile.mkdtemp(prefix='tm_test_')
+    return TranslationMemory(Path(tmp_dir) / 'tm.sqlite3', max_bytes=max_bytes)
+
+
+def test_put_and_get():
+    """写入后可命中，统计命中/未命中"""
+    memory = new_memory()
+    key = TranslationMemory.make_key("Hello world", "Chinese", "model-a")
+    assert memory.get(key) is None
+    memory.put(key, "你好世界", "model-a", "Chinese")
+    assert memory.get(key) == "你好世界"
+    stats = memory.stats()
+    assert stats['hits'] == 1 and stats['misses'] == 1 and stats['entries'] == 1
+    print("✅ Test 1: put/get - PASSED")
+
+
+def test_key_includes_language_model_and_prompt_version():
+    """语言、模型、提示词版本不同则键不同"""
+    base = TranslationMemory.make_key("Text", "Chinese", "model-a", "v1")
+    assert base == TranslationMemory.make_key("Text", "Chinese", "model-a", "v1")
+    assert base != TranslationMemory.make_key("Text", "Japanese", "model-a", "v1")
+    assert base != TranslationMemory.make_key("Text", "Chinese", "model-b", "v1")
+    assert base != TranslationMemory.make_key("Text", "Chinese", "model-a", "v2")
+    assert base != TranslationMemory.make_key("Text ", "Chinese", "model-a", "v1")
+    print("✅ Test 2: key components - PASSED")
+
+
+def test_size_bounded_eviction():
+    """超出容量时淘汰最久未使用的记录"""
+    memory = new_memory(max_bytes=2000)
+    keys = []
+    for i in range(10):
+        key = TranslationMemory.make_key(f"chunk {i}", "Chinese", "model-a")
+        memory.put(key, "译" * 100, "model-a", "Chinese")  # ~364 bytes each
+        keys.append(key)
+    stats = memory.stats()
+    assert stats['bytes'] <= 2000, stats
+    assert stats['evictions'] > 0
+    assert memory.get(keys[0]) is None, "oldest entry should be evicted"
+    assert memory.get(keys[-1]) is not None, "newest entry should survive"
+    print("✅ Test 3: eviction - PASSED")
+
+
+def test_persistence_across_instances():
+    """重新打开数据库后记录仍然存在"""
+    memory = new_memory()
+    key = TranslationMemory.make_key("Persist me", "French", "model-a")
+    memory.put(key, "Persistez-moi", "model-a", "French")
+    reopened = TranslationMemory(memory.db_path)
+    assert reopened.get(key) == "Persistez-moi"
+    assert reopened.stats()['bytes'] == memory.stats()['bytes']
+    print("✅ Test 4: persistence - PASSED")
+
+
+def test_translate_chunk_web_uses_memory():
+    """命中翻译记忆时不调用 completion"""
+    memory = new_memory()
+    key = TranslationMemory.make_key("Boilerplate chapter", "Chinese", app.MODEL)
+    memory.put(key, "样板章节", app.MODEL, "Chinese")
+
+    def no_api_call(*args, **kwargs):
+        raise AssertionError("completion should not be called on a cache hit")
+
+    original_memory, original_completion = app.translation_memory, app.completion
+    app.translation_memory, app.completion = memory, no_api_call
+    try:
+        task = TranslationTask("test_tm_task", "book.md", "Chinese")
+        task.total_chunks = 1
+        result = app.translate_chunk_web(task, 1, 1, "Boilerplate chapter", "Chinese")
+    finally:
+        app.translation_memory, app.completion = original_memory, original_completion
+    assert result == "样板章节"
+    print("✅ Test 5: translate_chunk_web cache hit - PASSED")
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("🧪 Testing Translation Memory")
+    print("=" * 60)
+    test_put_and_get()
+    test_key_includes_language_model_and_prompt_version()
+    test_size_bounded_eviction()
+    test_persistence_across_instances()
+    test_translate_chunk_web_uses_memory()
+    print("=" * 60)
+    print("✅ All tests passed!")
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+测试按内容寻址的上传存储（去重、复用转换结果和分块计划、任务 ID 唯一)
+"""
+
+import io
+import os
+import sys
+import tempfile
+import threading
+from pathlib import Path
+
+from docx import Document
+
+# 添加项目路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+import app
+from app import TaskStore, store_upload, create_upload_task
+
+BOOK = "## Chapter 1\n\nThe first chapter.\n\n## Chapter 2\n\nThe second chapter.\n"
+
+
+class use_tmp_storage:
+    """上传目录、对象目录、计划缓存和任务仓库都换成临时目录"""
+    KEYS = ('UPLOAD_FOLDER', 'UPLOAD_OBJECTS_FOLDER', 'UPLOAD_MANIFEST_FOLDER', 'PLAN_CACHE_FOLDER')
+
+    def __enter__(self):
+        root = Path(tempfile.mkdtemp(prefix='upload_test_'))
+        self.original = ({key: app.app.config[key] for key in self.KEYS}, app.task_store, dict(app.tasks))
+        app.app.config['UPLOAD_FOLDER'] = root / 'uploads'
+        app.app.config['UPLOAD_OBJECTS_FOLDER'] = root / 'uploads' / 'objects'
+        app.app.config['UPLOAD_MANIFEST_FOLDER'] = root / 'uploads' / 'manifests'
+        app.app.config['PLAN_CACHE_FOLDER'] = root / 'plans'
+        for key in self.KEYS:
+            app.app.config[key].mkdir(parents=True, exist_ok=True)
+        app.task_store = TaskStore(root / 'tasks.sqlite3')
+        return root
+
+    def __exit__(self, *exc):
+        app.app.config.update(self.original[0])
+        app.task_store = self.original[1]
+        app.tasks.clear()
+        app.tasks.update(self.original[2])
+
+
+def upload(client, data, filename):
+    response = client.post('/api/upload', data={'file': (io.BytesIO(data), filename)},
+                           content_type='multipart/form-data')
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+def test_identical_uploads_are_stored_once():
+    """相同内容只保存一个对象，任务文件都是指向它的链接"""
+    with use_tmp_storage():
+        client = app.app.test_client()
+        first = upload(client, BOOK.encode('utf-8'), 'book.md')
+        second = upload(client, BOOK.encode('utf-8'), 'book.md')
+        assert not first['deduplicated'] and second['deduplicated']
+        assert first['sha256'] == second['sha256'] and first['chars'] == len(BOOK)
+        assert first['task_id'] != second['task_id']
+
+        objects = list(app.app.config['UPLOAD_OBJECTS_FOLDER'].iterdir())
+        assert [p.name for p in objects] == [f"{first['sha256']}.md"]
+        task_files = [app.app.config['UPLOAD_FOLDER'] / f"{r['task_id']}_book.md" for r in (first, second)]
+        assert all(p.read_text(encoding='utf-8') == BOOK for p in task_files)
+        assert os.stat(task_files[0]).st_ino == os.stat(objects[0]).st_ino
+    print("✅ Test 1: identical uploads stored once - PASSED")
+
+
+def test_task_ids_unique_under_concurrency():
+    """同一秒内并发上传同名文件，任务 ID 和任务文件互不冲突"""
+    with use_tmp_storage():
+        _, object_path, _ = store_upload(io.BytesIO(BOOK.encode('utf-8')), 'md')
+        results = []
+        lock = threading.Lock()
+
+        def worker():
+            for _ in range(25):
+                task_id, filepath = create_upload_task('book.md', object_path)
+                with lock:
+                    results.append((task_id, filepath))
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert len({task_id for task_id, _ in results}) == 200
+        assert all(path.exists() for _, path in results)
+    print("✅ Test 2: task ids unique under concurrency - PASSED")
+
+
+def test_docx_conversion_reused():
+    """重复上传同一 Word 文档时复用已转换的 Markdown"""
+    buffer = io.BytesIO()
+    doc = Document()
+    doc.add_heading('Chapter 1', level=1)
+    doc.add_paragraph('Hello world.')
+    doc.save(buffer)
+    calls = []
+    original = app.convert_docx_to_markdown_file
+
+    def counting_convert(docx_path, md_path):
+        calls.append(docx_path)
+        return original(docx_path, md_path)
+
+    with use_tmp_storage():
+        app.convert_docx_to_markdown_file = counting_convert
+        try:
+            client = app.app.test_client()
+            first = upload(client, buffer.getvalue(), 'book.docx')
+            second = upload(client, buffer.getvalue(), 'book.docx')
+        finally:
+            app.convert_docx_to_markdown_file = original
+        assert len(calls) == 1
+        assert second['deduplicated'] and second['chars'] == first['chars']
+        converted = app.app.config['UPLOAD_FOLDER'] / f"{second['task_id']}_converted.md"
+        assert converted.read_text(encoding='utf-8') == "# Chapter 1\n\nHello world."
+    print("✅ Test 3: docx conversion reused - PASSED")
+
+
+def test_chunk_plan_cached():
+    """相同内容、相同语言再次分析时使用缓存的分块计划"""
+    with use_tmp_storage():
+        client = app.app.test_client()
+        ids = [upload(client, BOOK.encode('utf-8'), 'book.md')['task_id'] for _ in range(2)]
+        first = client.post(f'/api/analyze/{ids[0]}', json={'language': 'Chinese'}).get_json()
+        second = client.post(f'/api/analyze/{ids[1]}', json={'language': 'Chinese'}).get_json()
+        other_language = client.post(f'/api/analyze/{ids[1]}', json={'language': 'Japanese'}).get_json()
+        assert not first['plan_cached'] and second['plan_cached']
+        assert not other_language['plan_cached']
+        assert first['chunks'] == second['chunks']
+
+        # 缓存经过 JSON 往返后与重新规划的结果一致
+        md_index, chunks, _, cached = app.plan_document(BOOK, 'Chinese')
+        assert cached and md_index == app.index_markdown(BOOK)
+        assert app.task_store.load(ids[0]).chunks_info == chunks
+    print("✅ Test 4: chunk plan cached - PASSED")
+
+
+def test_manifest_resolves_files_without_scanning():
+    """分析和预览从上传清单定位文件，不扫描上传目录"""
+    def no_glob(self, pattern):
+        raise AssertionError(f"unexpected directory scan: {pattern}")
+
+    with use_tmp_storage():
+        client = app.app.test_client()
+        result = upload(client, BOOK.encode('utf-8'), 'book.md')
+        task_id = result['task_id']
+        manifest = app.load_upload_manifest(task_id)
+        assert manifest['filename'] == 'book.md' and manifest['sha256'] == result['sha256']
+        assert manifest['markdown'] == manifest['source'] and manifest['converted'] is None
+
+        original_glob = Path.glob
+        Path.glob = no_glob
+        try:
+            preview = client.get(f'/api/preview-source/{task_id}').get_json()
+            assert preview['content'] == BOOK and preview['outline'][0]['title'] == 'Chapter 1'
+            analysis = client.post(f'/api/analyze/{task_id}', json={'language': 'Chinese'})
+            assert analysis.status_code == 200
+        finally:
+            Path.glob = original_glob
+        assert app.tasks[task_id].filename == 'book.md'
+        assert client.post('/api/analyze/missing_task', json={}).status_code == 404
+        assert app.load_upload_manifest('../manifests') is None
+    print("✅ Test 5: manifest resolves files without scanning - PASSED")
+
+
+def test_overlapping_task_prefixes():
+    """task_id 互为前缀时各自解析到自己的文件"""
+    with use_tmp_storage():
+        client = app.app.test_client()
+        other = "## Other\n\nA different book.\n"
+        short = upload(client, BOOK.encode('utf-8'), 'a.md')['task_id']
+        # 构造以 short 为前缀的另一个任务（旧的 glob 查找会匹配到两个文件)
+        _, object_path, _ = store_upload(io.BytesIO(other.encode('utf-8')), 'md')
+        longer = f"{short}_b"
+        filepath = app.app.config['UPLOAD_FOLDER'] / f"{longer}_b.md"
+        app.link_upload(object_path, filepath)
+        app.write_upload_manifest(longer, {'task_id': longer, 'filename': 'b.md', 'markdown': str(filepath)})
+
+        for task_id, expected in ((short, BOOK), (longer, other)):
+            response = client.post(f'/api/analyze/{task_id}', json={'language': 'Chinese'})
+            assert response.status_code == 200
+            assert app.tasks[task_id].source_content == expected
+    print("✅ Test 6: overlapping task prefixes - PASSED")
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("🧪 Testing Upload Storage")
+    print("=" * 60)
+    test_identical_uploads_are_stored_once()
+    test_task_ids_unique_under_concurrency()
+    test_docx_conversion_reused()
+    test_chunk_plan_cached()
+    test_manifest_resolves_files_without_scanning()
+    test_overlapping_task_prefixes()
+    print("=" * 60)
+    print("✅ All tests passed!")
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+翻译引擎测试共用的假对象与任务工厂（假 API 异常、流式增量、已分析的任务)
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+import app
+from app import TranslationTask
+
+
+class FakeAPIError(Exception):
+    """带 HTTP 状态码的假 API 异常"""
+    def __init__(self, status_code, message=None):
+        super().__init__(message or f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+def delta(text):
+    """一个流式响应增量（与 litellm 流式 chunk 结构相同)"""
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+
+def stream(*pieces):
+    """同步流式响应：依次产出各片段"""
+    return iter([delta(piece) for piece in pieces])
+
+
+async def fake_stream(pieces, delay=0.0):
+    """异步流式响应：每个片段之前等待 delay 秒"""
+    for piece in pieces:
+        await asyncio.sleep(delay)
+        yield delta(piece)
+
+
+def make_task(num_chunks, concurrency=1, task_id=None):
+    """构造一个已分析的任务（第 i 块内容为 "## Chapter i" + "Source paragraph of chunk i.")"""
+    task = TranslationTask(task_id or f"test_task_{num_chunks}_{concurrency}", 'book.md', 'Chinese')
+    task.chunks_info = [
+        {'id': i, 'chapters': [f'Chapter {i}'], 'content': f"## Chapter {i}\n\nSource paragraph of chunk {i}."}
+        for i in range(1, num_chunks + 1)
+    ]
+    task.total_chunks = num_chunks
+    task.max_concurrency = concurrency
+    return task
+
+
+def reset_breakers():
+    """重置所有模型的熔断器"""
+    for breaker in app.circuit_breakers.values():
+        breaker.reset()